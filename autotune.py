@@ -0,0 +1,282 @@
+"""autotune.py - Runs several shared queue jobs at once, hill-climbing the job count to the best total fps
+
+psutil is optional: with it CPU utilisation is measured directly and jobs can be niced and pinned
+to CPUs on any platform, without it the load average stands in for CPU utilisation and only
+nice is available (POSIX only).
+"""
+import logging
+import multiprocessing
+import os
+import re
+import time
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+from shared_queue import Worker
+
+logger = logging.getLogger('autotune')
+
+# e.g. "Encoding: task 1 of 1, 45.12 % (87.34 fps, avg 85.10 fps, ETA 00h05m12s)"
+PROGRESS_RE = re.compile(r'Encoding: task \d+ of \d+, [\d.]+ % \(([\d.]+) fps')
+
+
+class ProgressTail(object):
+    """Follows a HandBrakeCLI log file and returns the latest reported encode fps"""
+    def __init__(self, filename):
+        self.filename = filename
+        self.offset = 0
+        self.partial = ''
+        self.fps = 0.0
+
+    def Read(self):
+        """Returns the fps of the last progress line written so far (0.0 before the first one)"""
+        try:
+            f = open(self.filename, 'rb')
+        except IOError:
+            return self.fps
+        try:
+            f.seek(self.offset)
+            data = f.read()
+        finally:
+            f.close()
+        self.offset += len(data)
+        if not isinstance(data, str):
+            data = data.decode('latin-1')
+        # Progress lines end in '\r', keep a line cut short by the read for the next call
+        lines = re.split('[\r\n]', self.partial + data)
+        self.partial = lines.pop()
+        for line in reversed(lines):
+            match = PROGRESS_RE.search(line)
+            if match:
+                self.fps = float(match.group(1))
+                break
+        return self.fps
+
+
+class SystemSampler(object):
+    """Samples the 1 minute load average and CPU utilisation (percent of all CPUs)"""
+    def __init__(self):
+        self.num_cpus = multiprocessing.cpu_count()
+        if psutil:
+            # The first call only starts the measurement interval
+            psutil.cpu_percent(interval=None)
+
+    def Sample(self):
+        """Returns (load average or None, CPU percent or None)"""
+        load = os.getloadavg()[0] if hasattr(os, 'getloadavg') else None
+        if psutil:
+            cpu_percent = psutil.cpu_percent(interval=None)
+        elif load is not None:
+            cpu_percent = min(100.0, 100.0 * load / self.num_cpus)
+        else:
+            cpu_percent = None
+        return load, cpu_percent
+
+
+class ConcurrencyTuner(object):
+    """
+    Hill-climbs the number of concurrent jobs to the one with the highest total fps.
+    Each step measures the median total fps over window samples taken with every slot busy.
+    A step that does not improve on the previous count by more than tolerance turns the climb
+    around, and the count it returns to is then held for hold windows before probing the other
+    side.  A hold ends early when the total fps moves by more than tolerance, i.e. the job mix changed.
+    """
+    def __init__(self, min_workers, max_workers, window=12, tolerance=0.05, max_cpu=95.0, hold=10):
+        assert 1 <= min_workers <= max_workers
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.window = window
+        self.tolerance = tolerance
+        self.max_cpu = max_cpu
+        self.hold_windows = hold
+        self.workers = min_workers
+        self.direction = 1
+        self.samples = list()
+        self.cpu_samples = list()
+        # (workers, median fps) of the last completed step
+        self.previous = None
+        # Windows left to hold the count for, and the fps measured when the hold started
+        self.hold = 0
+        self.hold_fps = None
+
+    def Update(self, fps, cpu_percent=None, num_running=None):
+        """Adds a total fps sample, returns the number of jobs to run from now on"""
+        if num_running is not None and num_running != self.workers:
+            # Ramping up or the queue is running dry, the sample says nothing about this count
+            return self.workers
+        self.samples.append(fps)
+        if cpu_percent is not None:
+            self.cpu_samples.append(cpu_percent)
+        if len(self.samples) < self.window:
+            return self.workers
+        measured = sorted(self.samples)[len(self.samples) // 2]
+        cpu = sorted(self.cpu_samples)[len(self.cpu_samples) // 2] if self.cpu_samples else None
+        self.samples = list()
+        self.cpu_samples = list()
+
+        if self.hold:
+            if self.hold_fps is None:
+                self.hold_fps = measured
+            changed = abs(measured - self.hold_fps) > self.hold_fps * self.tolerance
+            self.hold -= 1
+            self.previous = (self.workers, measured)
+            if self.hold and not changed:
+                return self.workers
+            if changed:
+                logger.info('Total fps moved from %.1f to %.1f at %d jobs, ending the hold', self.hold_fps,
+                            measured, self.workers)
+            self.hold = 0
+        elif self.previous is not None and measured <= self.previous[1] * (1.0 + self.tolerance):
+            if self.previous[0] != self.workers:
+                # No better than where the climb came from, turn around and settle there for a while
+                self.direction = -self.direction
+                self.hold = self.hold_windows
+                self.hold_fps = None
+        target = self.workers + self.direction
+        if target > self.workers and cpu is not None and cpu >= self.max_cpu:
+            # Saturated, more jobs would only compete for the same CPUs
+            self.direction = -1
+            target = max(self.min_workers, self.workers - 1)
+        elif not self.min_workers <= target <= self.max_workers:
+            self.direction = -self.direction
+            target = max(self.min_workers, min(self.max_workers, self.workers + self.direction))
+        if target != self.workers:
+            logger.info('Concurrency %d -> %d (%.1f fps at %d jobs, CPU %s)', self.workers, target, measured,
+                        self.workers, '?' if cpu is None else '{:.0f}%'.format(cpu))
+        self.previous = (self.workers, measured)
+        self.workers = target
+        return self.workers
+
+
+def CpuSlices(num_cpus, num_slices):
+    """Splits CPUs 0..num_cpus-1 into num_slices contiguous lists"""
+    num_slices = max(1, min(num_slices, num_cpus))
+    return [list(range(num_cpus * i // num_slices, num_cpus * (i + 1) // num_slices))
+            for i in range(num_slices)]
+
+
+class AutotuneWorker(Worker):
+    """Worker running as many jobs at once as its ConcurrencyTuner asks for, with optional nice/affinity"""
+    def __init__(self, queue, transcoder, tuner, worker_id=None, lease_timeout=300.0, heartbeat_interval=30.0,
+                 poll_interval=30.0, sample_interval=5.0, nice=None, affinity=False):
+        Worker.__init__(self, queue, transcoder, worker_id, lease_timeout, heartbeat_interval, poll_interval)
+        self.tuner = tuner
+        self.sample_interval = sample_interval
+        self.nice = nice
+        self.affinity = affinity
+        # Number of CPU slices the running jobs are pinned to
+        self.num_slices = None
+        self.sampler = SystemSampler()
+        if affinity and not psutil:
+            logger.warning('psutil is not installed, ignoring --affinity')
+            self.affinity = False
+        if nice is not None and not psutil and os.name == 'nt':
+            logger.warning('psutil is not installed, ignoring --nice')
+            self.nice = None
+
+    def PreExec(self):
+        """Returns the Popen preexec_fn for a job (nice without psutil on POSIX)"""
+        if self.nice is None or psutil or os.name == 'nt':
+            return None
+        nice = self.nice
+        return lambda: os.nice(nice)
+
+    def SetPriority(self, running):
+        """Applies nice to a started job with psutil"""
+        if not psutil or running.process is None or self.nice is None:
+            return
+        try:
+            process = psutil.Process(running.process.pid)
+            if os.name == 'nt':
+                process.nice(psutil.BELOW_NORMAL_PRIORITY_CLASS if self.nice > 0 else psutil.NORMAL_PRIORITY_CLASS)
+            else:
+                process.nice(self.nice)
+        except psutil.Error as e:
+            # The job may already have exited
+            logger.debug('Unable to set the priority of job %s: %s', running.job['id'], e)
+
+    def SetAffinity(self, running, cpus):
+        """Pins a started job to cpus with psutil"""
+        running.cpus = cpus
+        if running.process is None:
+            return
+        try:
+            psutil.Process(running.process.pid).cpu_affinity(cpus)
+        except psutil.Error as e:
+            logger.debug('Unable to set the affinity of job %s: %s', running.job['id'], e)
+
+    def PinJobs(self, running):
+        """
+        Pins new jobs to a CPU slice each.  The CPUs are split into as many slices as jobs are wanted
+        (or running, while the count steps down), and every job is re-pinned when that number changes.
+        """
+        if not self.affinity or not running:
+            return
+        num_slices = max(self.tuner.workers, len(running))
+        if num_slices != self.num_slices:
+            logger.debug('Splitting %d CPUs between %d jobs', self.sampler.num_cpus, num_slices)
+            self.num_slices = num_slices
+            # Renumber the slots so the jobs left after a step down fill the slices from the first
+            for slot, job in enumerate(sorted(running, key=lambda x: x.slot)):
+                job.slot = slot
+                job.cpus = None
+        slices = CpuSlices(self.sampler.num_cpus, self.num_slices)
+        for job in running:
+            if job.cpus is None:
+                self.SetAffinity(job, slices[job.slot % len(slices)])
+
+    def Run(self, max_jobs=None, exit_when_empty=False):
+        """Encodes jobs until max_jobs have started, or the queue is empty when exit_when_empty is set"""
+        running = list()
+        tails = dict()
+        num_jobs = 0
+        last_reclaim = 0
+        while True:
+            for job in list(running):
+                if job.Poll() is not None:
+                    self.FinishJob(job)
+                elif job.HeartbeatDue(self.heartbeat_interval) and not self.queue.Heartbeat(job.claim_name):
+                    # Only this job was reclaimed, the others keep running
+                    self.AbandonJob(job)
+                else:
+                    continue
+                running.remove(job)
+                del tails[job.claim_name]
+
+            if time.time() - last_reclaim >= self.poll_interval:
+                self.queue.ReclaimExpired(self.lease_timeout)
+                last_reclaim = time.time()
+            queue_empty = False
+            while len(running) < self.tuner.workers and (max_jobs is None or num_jobs < max_jobs):
+                claim = self.queue.Claim(self.worker_id)
+                if claim is None:
+                    queue_empty = True
+                    break
+                slots = set(getattr(x, 'slot', -1) for x in running)
+                job = self.StartJob(claim[0], claim[1], self.PreExec())
+                job.slot = min(x for x in range(len(running) + 1) if x not in slots)
+                job.cpus = None
+                self.SetPriority(job)
+                running.append(job)
+                tails[job.claim_name] = ProgressTail(job.log_filename)
+                num_jobs += 1
+            self.PinJobs(running)
+
+            if not running:
+                if max_jobs is not None and num_jobs >= max_jobs:
+                    break
+                if queue_empty and exit_when_empty and not self.queue.Counts()['claimed']:
+                    break
+                time.sleep(self.poll_interval if queue_empty else self.sample_interval)
+                continue
+
+            time.sleep(self.sample_interval)
+            fps = sum(tail.Read() for tail in tails.values())
+            load, cpu_percent = self.sampler.Sample()
+            logger.debug('%d jobs, %.1f fps, load %s, CPU %s', len(running), fps, load, cpu_percent)
+            self.tuner.Update(fps, cpu_percent, len(running))
+        logger.info('%s finished after %d jobs', self.worker_id, num_jobs)
+        return num_jobs
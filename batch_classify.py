@@ -0,0 +1,120 @@
+"""batch_classify.py - Classifies and numbers the titles of many DVDs at once with NumPy array operations
+
+Gives the same results as EpisodeDetector.RemoveShortTitles and FindEpisodesAndExtras applied to
+each DVD in turn.  NumPy is optional, check Available() before using this module.
+"""
+import logging
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from time_util import GetInHMS
+
+logger = logging.getLogger('batch_classify')
+
+
+def Available():
+    """True if NumPy could be imported"""
+    return np is not None
+
+
+def _Titles(dvds):
+    """Returns (titles, dvd of each title) for every title of dvds, in numbering order"""
+    titles = list()
+    title_dvds = list()
+    for dvd in dvds:
+        titles.extend(dvd.titles)
+        title_dvds.extend([dvd] * len(dvd.titles))
+    return titles, title_dvds
+
+
+def _Arrays(titles):
+    """
+    Returns the (durations, enabled) arrays of titles.  An unknown duration (None) sorts below every
+    duration as it does in the per-DVD comparisons, so the title is short and outside every window.
+    """
+    missing = np.iinfo(np.int64).min
+    durations = np.fromiter((missing if x.duration is None else x.duration for x in titles),
+                            dtype=np.int64, count=len(titles))
+    enabled = np.fromiter((x.enabled for x in titles), dtype=bool, count=len(titles))
+    return durations, enabled
+
+
+def WindowMask(durations, windows):
+    """Returns a mask of the durations inside any of the (duration, variance) windows"""
+    if not windows:
+        return np.zeros(len(durations), dtype=bool)
+    windows = np.asarray(windows, dtype=np.int64).reshape(-1, 2)
+    low = windows[:, 0] - windows[:, 1]
+    high = windows[:, 0] + windows[:, 1]
+    return ((durations[:, None] >= low) & (durations[:, None] <= high)).any(axis=1)
+
+
+def ClassifyTitles(durations, enabled, eps_durations, eps_2x_durations):
+    """
+    Returns the (episode, double episode, extra) masks of the enabled titles.
+    A duration matching both window sets is a single episode, as in FindEpisodesAndExtras.
+    """
+    episode = enabled & WindowMask(durations, eps_durations)
+    double = enabled & ~episode & WindowMask(durations, eps_2x_durations)
+    extra = enabled & ~episode & ~double
+    return episode, double, extra
+
+
+def RemoveShortTitles(dvds, title_min_duration):
+    """Disables the enabled titles of dvds shorter than title_min_duration, returns how many were removed"""
+    titles, title_dvds = _Titles(dvds)
+    if not titles:
+        return 0
+    durations, enabled = _Arrays(titles)
+    short = np.flatnonzero(enabled & (durations < title_min_duration))
+    log_debug = logger.isEnabledFor(logging.DEBUG)
+    for i in short:
+        titles[i].enabled = False
+        titles[i].eps_type = 'too short'
+        if log_debug:
+            logger.debug('Removed Title #%d for duration shorter than %d seconds',
+                         titles[i].num, title_min_duration)
+    return len(short)
+
+
+def NumberTitles(dvds, eps_start_num, extras_start_num, eps_durations, eps_2x_durations):
+    """
+    Assigns eps_type and episode/extras numbers to the enabled titles of dvds, numbering them
+    in order from eps_start_num and extras_start_num.  Returns the next (eps_start_num, extras_start_num).
+    """
+    titles, title_dvds = _Titles(dvds)
+    if not titles:
+        return eps_start_num, extras_start_num
+    durations, enabled = _Arrays(titles)
+    episode, double, extra = ClassifyTitles(durations, enabled, eps_durations, eps_2x_durations)
+
+    # Each title takes the numbers after those used by the titles before it
+    eps_count = episode.astype(np.int64) + 2 * double.astype(np.int64)
+    eps_start = eps_start_num + np.cumsum(eps_count) - eps_count
+    extras_count = extra.astype(np.int64)
+    extras_start = extras_start_num + np.cumsum(extras_count) - extras_count
+
+    log_info = logger.isEnabledFor(logging.INFO)
+    for i in np.flatnonzero(enabled):
+        title = titles[i]
+        if extra[i]:
+            title.eps_type = 'extra'
+            title.eps_start_num = title.eps_end_num = int(extras_start[i])
+            if log_info:
+                logger.info('Title #%2d is extras  "S%02dExtras%02d", duration %s',
+                            title.num, title_dvds[i].season, title.eps_start_num, GetInHMS(title.duration))
+        else:
+            title.eps_type = 'episode'
+            title.eps_start_num = int(eps_start[i])
+            title.eps_end_num = title.eps_start_num + int(eps_count[i]) - 1
+            if log_info and double[i]:
+                logger.info('Title #%2d is episode "S%02dE%02dE%02d", duration %s',
+                            title.num, title_dvds[i].season, title.eps_start_num, title.eps_end_num,
+                            GetInHMS(title.duration))
+            elif log_info:
+                logger.info('Title #%2d is episode "S%02dE%02d", duration %s',
+                            title.num, title_dvds[i].season, title.eps_start_num, GetInHMS(title.duration))
+    return eps_start_num + int(eps_count.sum()), extras_start_num + int(extras_count.sum())
@@ -0,0 +1,121 @@
+"""bench_logging.py - Measures the logging overhead of parsing a large scan with each logging setup
+
+Run from the repository root:  python benchmarks/bench_logging.py [--titles N]
+"""
+import argparse
+import logging
+import logging.config
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pprint import pformat
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from hbscan import ParseHBOutput
+from log_util import ConfigureLogging, StopLogging
+
+NULL_STREAM = open(os.devnull, 'w')
+
+
+def MakeScanOutput(num_titles, num_chapters=12):
+    """Returns synthetic HandBrakeCLI scan output with num_titles titles"""
+    lines = ['[12:00:00] scan: DVD has {} title(s)'.format(num_titles)]
+    for num in range(1, num_titles + 1):
+        lines.extend([
+            '+ title {}:'.format(num),
+            '  + vts 1, ttn {}, cells 0->{} ({} blocks)'.format(num, num_chapters, num * 1000),
+            '  + duration: 00:{:02d}:00'.format(num % 60),
+            '  + size: 720x480, pixel aspect: 32/27, display aspect: 1.78, 23.976 fps',
+            '  + autocrop: 0/0/0/0',
+            '  + combing detected, may be interlaced or telecined',
+            '  + chapters:'])
+        for chapter in range(1, num_chapters + 1):
+            lines.append('    + {0}: cells {0}->{0}, 1000 blocks, duration 00:02:00'.format(chapter))
+        lines.extend([
+            '  + audio tracks:',
+            '    + 1, English (AC3) (2.0 ch) (iso639-2: eng), 48000Hz, 192000bps',
+            '    + 2, Francais (AC3) (2.0 ch) (iso639-2: fra), 48000Hz, 192000bps',
+            '  + subtitle tracks:',
+            '    + 1, English (iso639-2: eng) (Bitmap)(VOBSUB)',
+            '    + 2, Closed Captions (iso639-2: eng) (Text)(CC)'])
+    lines.append('HandBrake has exited.')
+    return '\n'.join(lines) + '\n'
+
+
+def MakeConfig(folder):
+    """Same handler layout as hbq.py, writing into folder"""
+    handlers = dict(
+        console=dict({'class': 'logging.StreamHandler'}, level='INFO', formatter='simple',
+                     stream='ext://__main__.NULL_STREAM'),
+        info_file=dict({'class': 'logging.FileHandler'}, level='INFO', formatter='simple',
+                       filename=os.path.join(folder, 'info.log')),
+        debug_file=dict({'class': 'logging.FileHandler'}, level='DEBUG', formatter='precise',
+                        filename=os.path.join(folder, 'debug.log')))
+    logger_cfg = dict(level='DEBUG', handlers=['console', 'info_file', 'debug_file'])
+    return dict(
+        version=1,
+        disable_existing_loggers=False,
+        formatters=dict(
+            simple=dict(format='%(asctime)s - %(levelname)5s - %(message)s'),
+            precise=dict(format='%(asctime)s - %(levelname)5s - %(module)s:%(lineno)03d'
+                                '[%(funcName)s()] - %(message)s')),
+        handlers=handlers,
+        loggers=dict(hbscan=logger_cfg, eps_detector=logger_cfg))
+
+
+def Run(src, repeat):
+    """Parse src repeat times, logging the detector's per-disc debug payload like ProcessFolder does"""
+    logger = logging.getLogger('eps_detector')
+    start = time.time()
+    for _ in range(repeat):
+        dvd = ParseHBOutput(src)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(pformat(dvd))
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--titles', type=int, default=40, help='Titles per synthetic disc (default: 40)')
+    parser.add_argument('--repeat', type=int, default=20, help='Discs parsed per setup (default: 20)')
+    args = parser.parse_args()
+
+    src = MakeScanOutput(args.titles)
+    logging.disable(logging.NOTSET)
+    baseline = None
+    print('{:32s} {:>10s} {:>10s} {:>9s}'.format('setup', 'hot path', 'total', 'overhead'))
+    for name, use_queue, level in (('no logging', None, None),
+                                   ('synchronous handlers, DEBUG', False, 'DEBUG'),
+                                   ('queue handler, DEBUG', True, 'DEBUG'),
+                                   ('queue handler, INFO', True, 'INFO'),
+                                   ('queue handler, WARNING', True, 'WARNING')):
+        folder = tempfile.mkdtemp(prefix='hbq_bench_')
+        try:
+            if use_queue is None:
+                logging.disable(logging.CRITICAL)
+            else:
+                logging.disable(logging.NOTSET)
+                config = MakeConfig(folder)
+                if use_queue:
+                    ConfigureLogging(config, level)
+                else:
+                    logging.config.dictConfig(config)
+            start = time.time()
+            hot_path = Run(src, args.repeat)
+            StopLogging()
+            for handler in logging.getLogger('hbscan').handlers:
+                handler.flush()
+            total = time.time() - start
+        finally:
+            logging.config.dictConfig(dict(version=1, disable_existing_loggers=False))
+            shutil.rmtree(folder, ignore_errors=True)
+        if baseline is None:
+            baseline = hot_path
+        print('{:32s} {:9.3f}s {:9.3f}s {:8.1f}%'.format(name, hot_path, total,
+                                                         100.0 * (hot_path - baseline) / baseline))
+
+
+if __name__ == '__main__':
+    main()
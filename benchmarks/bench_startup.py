@@ -0,0 +1,84 @@
+"""bench_startup.py - Measures the wall time of short hbq.py invocations, as run by watch mode and scripts
+
+Run from the repository root:  python benchmarks/bench_startup.py [--repeat N]
+Each command runs in a fresh interpreter, 'python -c pass' is reported as the interpreter's own share.
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+from dvdinfo import DvdInfo, WriteDvdListToXML
+from hbscan import ParseHBOutput
+from bench_logging import MakeScanOutput
+
+HBQ = os.path.join(REPO, 'hbq.py')
+
+
+def MakeControlFile(filename, num_dvds=4):
+    """Writes a control file of num_dvds synthetic DVDs with every title enabled as an extra"""
+    dvds = list()
+    for num in range(1, num_dvds + 1):
+        dvd = ParseHBOutput(MakeScanOutput(6))
+        dvd.folder = 'D:\\rips\\Show_S1D{:d}'.format(num)
+        dvd.series = 'Show'
+        dvd.season = 1
+        for title in dvd.titles:
+            title.eps_type = 'extra'
+            title.eps_start_num = title.eps_end_num = title.num
+        dvds.append(dvd)
+    WriteDvdListToXML(dvds, filename)
+
+
+def TimeCommand(cmd, folder, repeat):
+    """Returns the (best, median) wall time of running cmd repeat times in folder"""
+    times = list()
+    devnull = open(os.devnull, 'w')
+    try:
+        for _ in range(repeat):
+            start = time.time()
+            returncode = subprocess.call(cmd, cwd=folder, stdout=devnull, stderr=devnull)
+            times.append(time.time() - start)
+            if returncode:
+                raise RuntimeError('{} exited with {}'.format(' '.join(cmd), returncode))
+    finally:
+        devnull.close()
+    times.sort()
+    return times[0], times[len(times) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=20, help='Runs per command (default: 20)')
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp(prefix='hbq_bench_')
+    try:
+        empty_folder = os.path.join(folder, 'rips')
+        os.mkdir(empty_folder)
+        control_file = os.path.join(folder, 'show.xml')
+        MakeControlFile(control_file)
+        commands = (('python -c pass', [sys.executable, '-c', 'pass']),
+                    ('hbq.py --help', [sys.executable, HBQ, '--help']),
+                    ('hbq.py scan (no DVDs)', [sys.executable, HBQ, 'scan', empty_folder,
+                                               '-f', os.path.join(folder, 'scan.xml'), '--no-scan-archive']),
+                    ('hbq.py build (4 DVDs)', [sys.executable, HBQ, 'build', control_file,
+                                               '-o', os.path.join(folder, 'show.queue')]))
+        baseline = None
+        print('{:28s} {:>9s} {:>9s} {:>12s}'.format('command', 'best', 'median', 'over python'))
+        for name, cmd in commands:
+            best, median = TimeCommand(cmd, folder, args.repeat)
+            if baseline is None:
+                baseline = best
+            print('{:28s} {:8.3f}s {:8.3f}s {:11.3f}s'.format(name, best, median, best - baseline))
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
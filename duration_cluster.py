@@ -0,0 +1,79 @@
+"""duration_cluster.py - Infers episode durations by clustering the title durations of a season"""
+import logging
+
+logger = logging.getLogger('duration_cluster')
+
+# Two sorted durations further apart than this (or CLUSTER_GAP_RATIO of the shorter) start a new cluster
+CLUSTER_GAP = 60
+CLUSTER_GAP_RATIO = 0.05
+# A cluster spanning more than this (or CLUSTER_SPREAD_RATIO of its shortest) is split at its largest relative gap
+CLUSTER_SPREAD = 180
+CLUSTER_SPREAD_RATIO = 0.1
+# Smallest +/- window reported for a cluster
+MIN_VARIANCE = 30
+# A cluster is only trusted as the episode length if it has at least this many titles
+MIN_EPISODES = 2
+# How close a cluster must be to twice the episode length to be taken as the double-episode length
+DOUBLE_RATIO_TOLERANCE = 0.1
+
+
+def _SplitWide(cluster):
+    """
+    Splits a cluster wider than the spread cap at its largest relative gap, until every part fits.
+    This stops a run of extras a minute apart from chaining onto the episode cluster.
+    """
+    if cluster[-1] - cluster[0] <= max(CLUSTER_SPREAD, cluster[0] * CLUSTER_SPREAD_RATIO):
+        return [cluster]
+    split = max(range(1, len(cluster)),
+                key=lambda i: float(cluster[i] - cluster[i - 1]) / max(1, cluster[i - 1]))
+    return _SplitWide(cluster[:split]) + _SplitWide(cluster[split:])
+
+
+def ClusterDurations(durations):
+    """
+    Returns a list of clusters (each a sorted list of durations) from a 1-D gap split of durations.
+    Sorting once and comparing neighbours makes this a single pass over the season, clusters wider
+    than the spread cap are then split further.
+    """
+    clusters = list()
+    for duration in sorted(durations):
+        if clusters:
+            prev = clusters[-1][-1]
+            if duration - prev <= max(CLUSTER_GAP, prev * CLUSTER_GAP_RATIO):
+                clusters[-1].append(duration)
+                continue
+        clusters.append([duration])
+    return [part for cluster in clusters for part in _SplitWide(cluster)]
+
+
+def _Window(cluster):
+    """Returns the (duration, variance) window covering cluster, centred on its median"""
+    center = cluster[len(cluster) // 2]
+    variance = max(MIN_VARIANCE, center - cluster[0], cluster[-1] - center)
+    return center, variance
+
+
+def FindEpisodeDurations(durations, expect_2x_duration=True):
+    """
+    Returns (eps_durations, eps_2x_durations) in the same (duration, variance) tuple format as
+    the --eps-duration argument, or (None, None) if no cluster looks like an episode length.
+    The episode cluster is the one holding the most total playtime.
+    """
+    clusters = [x for x in ClusterDurations(durations) if x]
+    candidates = [x for x in clusters if len(x) >= MIN_EPISODES]
+    if not candidates:
+        return None, None
+    eps_cluster = max(candidates, key=lambda x: (sum(x), len(x)))
+    eps_window = _Window(eps_cluster)
+    eps_2x_window = None
+    if expect_2x_duration:
+        target = eps_window[0] * 2
+        doubles = [x for x in clusters if x is not eps_cluster and
+                   abs(_Window(x)[0] - target) <= target * DOUBLE_RATIO_TOLERANCE]
+        if doubles:
+            eps_2x_window = _Window(max(doubles, key=len))
+        else:
+            eps_2x_window = (target, eps_window[1] * 2)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug('Duration clusters: %s', [(_Window(x), len(x)) for x in clusters])
+    return (eps_window,), ((eps_2x_window,) if eps_2x_window else None)
@@ -3,7 +3,6 @@ from collections import namedtuple
 import re
 import xml.etree.ElementTree as et
 from xml.etree.ElementTree import Element, SubElement, ElementTree
-from xml.dom.minidom import parseString
 
 
 
@@ -22,7 +21,7 @@ class Title(object):
     def __init__(self, num=None, duration=None, fps=None, num_blocks=None, audio_tracks=None, 
                  subtitle_tracks=None, chapters=None, enabled=True, eps_type=None, 
                  eps_start_num=0, eps_end_num=0, default_audio_track=0, default_subtitle_track=0,
-                 combing_detected=False):
+                 combing_detected=False, chapter_start=None, chapter_end=None):
         self.num = num
         self.duration = duration
         self.fps = fps
@@ -37,6 +36,9 @@ class Title(object):
         self.default_audio_track = default_audio_track
         self.default_subtitle_track = default_subtitle_track
         self.combing_detected = combing_detected
+        # Set when only chapters chapter_start..chapter_end of title num are encoded (a split title)
+        self.chapter_start = chapter_start
+        self.chapter_end = chapter_end
         
     def ParseXML(self, title_elem):
         assert(isinstance(title_elem, Element))
@@ -45,6 +47,9 @@ class Title(object):
         self.eps_start_num = int(title_elem.attrib['eps_start_num'])
         self.eps_end_num = int(title_elem.attrib['eps_end_num'])
         self.eps_type = title_elem.attrib['eps_type']
+        if 'chapter_start' in title_elem.attrib:
+            self.chapter_start = int(title_elem.attrib['chapter_start'])
+            self.chapter_end = int(title_elem.attrib['chapter_end'])
         self.enabled = title_elem.attrib['enabled'] == 'True'
         self.num = int(title_elem.find('num').text)
         self.duration = int(title_elem.find('duration').text)
@@ -87,6 +92,9 @@ class Title(object):
                                     eps_end_num=str(self.eps_end_num),
                                     default_audio_track=str(self.default_audio_track),
                                     default_subtitle_track=str(self.default_subtitle_track)))
+        if self.chapter_start is not None:
+            title_elem.set('chapter_start', str(self.chapter_start))
+            title_elem.set('chapter_end', str(self.chapter_end))
         SubElement(title_elem, 'num').text = str(self.num)
         SubElement(title_elem, 'duration').text = str(self.duration)
         SubElement(title_elem, 'fps').text = str(self.fps)
@@ -153,21 +161,27 @@ class Title(object):
             ',\n\tdefault_audio_track=', repr(self.default_audio_track),
             ',\n\tdefault_subtitle_track=', repr(self.default_subtitle_track),
             ',\n\tcombing_detected=', repr(self.combing_detected),
+            ',\n\tchapter_start=', repr(self.chapter_start),
+            ',\n\tchapter_end=', repr(self.chapter_end),
             ')\n'))
     
     
 class DvdInfo(object):
     """Describes the content of a single DVD"""
-    def __init__(self, titles=None, folder=None, series=None, season=None):
+    def __init__(self, titles=None, folder=None, series=None, season=None, signature=None):
         self.titles = titles or list()
         self.folder = folder
         self.series = series
         self.season = season
+        # Fingerprint of the IFO files when folder was scanned, used to detect changed folders
+        self.signature = signature
 
     def EmitXML(self):
         dvd_elem = Element('dvd', 
                            attrib=dict(folder=str(self.folder), series=str(self.series), 
                                        season=str(self.season)))
+        if self.signature:
+            dvd_elem.set('signature', self.signature)
         titles_elem = SubElement(dvd_elem, 'titles')
         for title in self.titles:
             titles_elem.append(title.EmitXML())
@@ -178,6 +192,7 @@ class DvdInfo(object):
         self.folder = dvd_elem.attrib['folder']
         self.series = dvd_elem.attrib['series']
         self.season = int(dvd_elem.attrib['season'])
+        self.signature = dvd_elem.attrib.get('signature')
         self.titles = list()
         for title_elem in dvd_elem.findall('titles/title'):
             title = Title()
@@ -194,9 +209,12 @@ class DvdInfo(object):
             ',folder=', repr(self.folder),
             ',series=', repr(self.series),
             ',season=', repr(self.season),
+            ',signature=', repr(self.signature),
             ')\n'))
 
 def WriteDvdListToXML(dvds, filename):
+    # minidom is only needed for pretty printing, readers of the XML do not pay for it
+    from xml.dom.minidom import parseString
     dvds_elem = et.Element('dvds') 
     for dvd in dvds:
         dvds_elem.append(dvd.EmitXML())
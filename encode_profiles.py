@@ -0,0 +1,124 @@
+"""encode_profiles.py - Named HandBrakeCLI encode profiles, compiled once into query templates"""
+import logging
+import os.path
+
+import yaml
+
+logger = logging.getLogger('encode_profiles')
+
+DEFAULT_PROFILES_FILENAME = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                         'hbq_profiles_default.yaml')
+
+PROFILE_SETTINGS = ('tier', 'encoder', 'quality', 'width', 'anamorphic', 'filters',
+                    'encoder_preset', 'encoder_options', 'audio_encoder', 'extra_args')
+RULE_FIELDS = ('series', 'season', 'eps_type')
+
+
+class ProfileError(Exception):
+    pass
+
+
+def _Literal(text):
+    """Escapes text for use inside a str.format template"""
+    return str(text).replace('{', '{{').replace('}', '}}')
+
+
+class EncodeProfile(object):
+    """A named set of encode settings and the query template compiled from them"""
+    def __init__(self, name, tier=None, encoder='x264', quality=20, width=None, anamorphic=None,
+                 filters='', encoder_preset=None, encoder_options=None, audio_encoder='copy:ac3',
+                 extra_args=''):
+        self.name = name
+        self.tier = tier or name
+        self.encoder = encoder
+        self.quality = quality
+        self.width = width
+        self.anamorphic = anamorphic
+        self.filters = filters
+        self.encoder_preset = encoder_preset
+        self.encoder_options = encoder_options
+        self.audio_encoder = audio_encoder
+        self.extra_args = extra_args
+        self.template = self.Compile()
+
+    def Compile(self):
+        """
+        Returns the query template for this profile.  Every profile setting is already part of
+        the string, only the per-job fields (source, title, destination, tracks...) remain.
+        """
+        parts = [' -i "{src_folder}"',
+                 ' -t {title_num}{chapters}',
+                 ' --angle 1',
+                 ' -o "{destination}"',
+                 ' -f mkv',
+                 ' {detelecine}']
+        if self.filters:
+            parts.append(' ' + _Literal(self.filters))
+        if self.width:
+            parts.append(' -w {:d}'.format(int(self.width)))
+        if self.anamorphic:
+            parts.append(' --{}-anamorphic'.format(_Literal(self.anamorphic)))
+        parts.append(' -e {} -q {}'.format(_Literal(self.encoder), _Literal(self.quality)))
+        if self.encoder_preset:
+            parts.append(' --x264-preset {}'.format(_Literal(self.encoder_preset)))
+        parts.extend([' -r {fps}',
+                      ' -a {audio_tracks} -E {audio_encoders}',
+                      ' --subtitle {subtitles} --subtitle-default={default_subtitle}',
+                      ' -m'])
+        if self.encoder_options:
+            parts.append(' -x ' + _Literal(self.encoder_options))
+        if self.extra_args:
+            parts.append(' ' + _Literal(self.extra_args))
+        parts.append(' -v 2')
+        return ''.join(parts)
+
+    def FormatQuery(self, cfg):
+        """Returns the HandBrakeCLI query for the job settings in cfg"""
+        return self.template.format(**cfg)
+
+    def __repr__(self):
+        return 'EncodeProfile(name={!r}, tier={!r}, template={!r})'.format(self.name, self.tier, self.template)
+
+
+class ProfileSet(object):
+    """Encode profiles plus the rules selecting one per series, season and eps_type"""
+    def __init__(self, profiles, rules=None, default_profile=None):
+        self.profiles = profiles
+        self.rules = rules or list()
+        self.default_profile = default_profile
+        for rule in self.rules:
+            if rule['profile'] not in self.profiles:
+                raise ProfileError('Rule {!r} uses unknown profile "{}"'.format(rule, rule['profile']))
+            unknown = set(rule) - set(RULE_FIELDS) - set(['profile'])
+            if unknown:
+                raise ProfileError('Rule {!r} has unknown fields {}'.format(rule, sorted(unknown)))
+        if default_profile not in self.profiles:
+            raise ProfileError('Unknown default_profile "{}"'.format(default_profile))
+
+    def Select(self, dvd, title):
+        """Returns the EncodeProfile for title on dvd"""
+        values = dict(series=dvd.series, season=dvd.season, eps_type=title.eps_type)
+        for rule in self.rules:
+            if all(rule[field] == values[field] for field in RULE_FIELDS if field in rule):
+                return self.profiles[rule['profile']]
+        return self.profiles[self.default_profile]
+
+
+def LoadProfiles(filename=None):
+    """Returns the ProfileSet defined in the YAML file filename (default: hbq_profiles_default.yaml)"""
+    filename = filename or DEFAULT_PROFILES_FILENAME
+    f = open(filename)
+    try:
+        cfg = yaml.safe_load(f)
+    finally:
+        f.close()
+    profiles = dict()
+    for name, settings in (cfg.get('profiles') or {}).items():
+        unknown = set(settings) - set(PROFILE_SETTINGS)
+        if unknown:
+            raise ProfileError('Profile "{}" in "{}" has unknown settings {}'.format(name, filename,
+                                                                                   sorted(unknown)))
+        profiles[name] = EncodeProfile(name, **settings)
+    profile_set = ProfileSet(profiles, cfg.get('rules'), cfg.get('default_profile'))
+    logger.debug('Loaded encode profiles %s from "%s"', sorted(profiles), filename)
+    return profile_set
@@ -1,13 +1,19 @@
+import glob
+import hashlib
 import logging
 import os.path
 from pprint import pformat
 import re
-from hbscan import ParseHBOutput, ScanDvd
+from hbscan import HandBrakeScanner, ParseHBOutput
 from dvdinfo import DvdInfo, Title
 from itertools import combinations
 # Personal library modules
 from oreillycookbook.files import all_folders
 from time_util import GetInHMS
+from duration_cluster import FindEpisodeDurations
+import batch_classify
+import metrics
+from track_policy import DefaultTrackPolicies
 
 
 logger = logging.getLogger('eps_detector')
@@ -15,9 +21,128 @@ logger = logging.getLogger('eps_detector')
 class DvdNameError(Exception):
     pass
 
+
+def ParseDvdFolderName(folder):
+    """Returns (series, season, disc) from a DVD folder named like 'Series_Name_S01D02'"""
+    basename = os.path.basename(folder)
+    match = re.search('(.+?)_?[sS](\d+)_?[dD](\d+)', basename)
+    if not match:
+        raise DvdNameError("Unable to parse folder name '{}'".format(folder))
+    series = match.group(1)
+    series = series.replace('_', ' ')
+    series = series.strip()
+    return series, int(match.group(2)), int(match.group(3))
+
+
+def IsDvdFolder(folder):
+    """True if folder holds DVD content (a VIDEO_TS folder or VIDEO_TS.IFO)"""
+    return (os.path.exists(os.path.join(folder, 'VIDEO_TS')) or
+            os.path.exists(os.path.join(folder, 'VIDEO_TS.IFO')))
+
+
+def FindDvdFolders(folder):
+    """Returns the DVD folders at or below folder, in the order ProcessFolder visits them"""
+    if IsDvdFolder(folder):
+        return [folder]
+    dvd_folders = list()
+    for sub_folder in sorted(all_folders(folder, single_level=True)):
+        dvd_folders.extend(FindDvdFolders(sub_folder))
+    return dvd_folders
+
+
+def GetIfoFiles(folder):
+    """Returns the IFO files of a DVD folder"""
+    return (glob.glob(os.path.join(folder, 'VIDEO_TS', '*.IFO')) +
+            glob.glob(os.path.join(folder, '*.IFO')))
+
+
+def DvdFolderSignature(folder):
+    """
+    Returns a fingerprint of the name, size and modification time of the IFO files in a DVD folder,
+    or None if there are no IFO files yet.
+    """
+    ifo_files = GetIfoFiles(folder)
+    if not ifo_files:
+        return None
+    md5 = hashlib.md5()
+    for filename in sorted(ifo_files):
+        stat = os.stat(filename)
+        md5.update('{}:{:d}:{:d}\n'.format(os.path.basename(filename).upper(), 
+                                           stat.st_size, int(stat.st_mtime)).encode('utf-8'))
+    return md5.hexdigest()
+
+
+def _InWindow(duration, windows):
+    return any((center - variance) <= duration <= (center + variance) for center, variance in windows)
+
+
+def GroupChapters(chapters, eps_durations, title_min_duration):
+    """
+    Returns the (first, last) chapter indexes of consecutive chapter groups that each last an
+    episode duration, or None if chapters do not divide into at least 2 episodes.
+    Of all such divisions the one closest to the episode durations is used.  Trailing chapters
+    shorter than title_min_duration in total (e.g. credits) join the last group.
+    """
+    def Distance(duration):
+        return min(abs(duration - center) for center, variance in eps_durations)
+    ends = [0]
+    for chapter in chapters:
+        ends.append(ends[-1] + chapter.duration)
+    # best[i] is (cost, start of last group) of the closest division of the first i chapters
+    best = [(0, None)] + [None] * len(chapters)
+    for i in range(1, len(chapters) + 1):
+        for j in range(i):
+            duration = ends[i] - ends[j]
+            if best[j] is not None and _InWindow(duration, eps_durations):
+                cost = best[j][0] + Distance(duration)
+                if best[i] is None or cost < best[i][0]:
+                    best[i] = (cost, j)
+    last = len(chapters)
+    while best[last] is None or last == 0:
+        last -= 1
+        if last <= 0 or ends[-1] - ends[last] >= title_min_duration:
+            return None
+    groups = list()
+    i = last
+    while i > 0:
+        groups.insert(0, (best[i][1], i - 1))
+        i = best[i][1]
+    if len(groups) < 2:
+        return None
+    groups[-1] = (groups[-1][0], len(chapters) - 1)
+    return groups
+
+
+def SplitTitleByChapters(title, eps_durations, title_min_duration):
+    """
+    Returns one Title per episode found in the chapters of title, each limited to its chapter
+    range, or None if the chapters do not divide into episodes.
+    """
+    groups = GroupChapters(title.chapters, eps_durations, title_min_duration)
+    if groups is None:
+        return None
+    split_titles = list()
+    for first, last in groups:
+        chapters = title.chapters[first:last + 1]
+        split_titles.append(Title(
+            num=title.num,
+            duration=sum(x.duration for x in chapters),
+            fps=title.fps,
+            num_blocks=sum(x.block_count for x in chapters),
+            audio_tracks=list(title.audio_tracks),
+            subtitle_tracks=list(title.subtitle_tracks),
+            chapters=list(chapters),
+            combing_detected=title.combing_detected,
+            chapter_start=chapters[0].num,
+            chapter_end=chapters[-1].num))
+    return split_titles
+
+
 class EpisodeDetector(object):
     def __init__(self, eps_start_num, extras_start_num, remove_dup_titles, remove_virtual_titles, 
-                 title_min_duration, eps_durations, eps_2x_durations, default_close_captions):
+                 title_min_duration, eps_durations, eps_2x_durations, default_close_captions,
+                 auto_eps_duration=False, archive=None, existing_dvds=None, previous_archive=None,
+                 folder_filter=None, batch=False, split_chapters=False, scanner=None, track_policies=None):
         self.eps_start_num = eps_start_num
         self.extras_start_num = extras_start_num
         self.remove_dup_titles = remove_dup_titles
@@ -26,72 +151,288 @@ class EpisodeDetector(object):
         self.eps_durations = eps_durations
         self.eps_2x_durations = eps_2x_durations
         self.default_close_captions = default_close_captions
+        self.auto_eps_duration = auto_eps_duration
+        # Optional ScanArchive receiving the raw scan output of each DVD folder
+        self.archive = archive
+        # DVDs loaded from an earlier control file (incremental scan), by normalised folder
+        self.existing_dvds = dict((os.path.normcase(x.folder), x) for x in existing_dvds or ())
+        # ScanArchive of the earlier scan, copied into archive for DVDs that are not rescanned
+        self.previous_archive = previous_archive
+        self.kept_dvds = set()
+        # Optional callable, new or changed DVD folders are only scanned if folder_filter(folder) is True
+        self.folder_filter = folder_filter
+        # Remove and number the titles of a whole season at once with NumPy (see batch_classify)
+        self.batch = batch and batch_classify.Available()
+        # Split long titles holding several episodes at chapter boundaries
+        self.split_chapters = split_chapters
+        # hbscan.Scanner producing the scan output of each new or changed DVD folder
+        self.scanner = scanner or HandBrakeScanner()
+        # track_policy.TrackPolicySet choosing the audio and subtitle tracks of each DVD
+        self.track_policies = track_policies or DefaultTrackPolicies()
+        # Used when auto_eps_duration cannot find an episode length for a season
+        self.fallback_eps_durations = eps_durations
+        self.fallback_eps_2x_durations = eps_2x_durations
         self.previous_season = None
         self.previous_series = None
         self.curr_dvd = None
+        # DVDs of the current season waiting for episode numbering (auto_eps_duration or batch only)
+        self.season_dvds = list()
         self.dvds = list()
         
     def ProcessFolder(self, folder):
         """
         Process the given folder for DVD content.
         If the folder does not contain DVD content, recurse into subfolders.
+        The DVD folders to scan are passed to the scanner as one batch and processed in folder order.
+        Call Finish() once all folders have been processed.
         """
         folder = os.path.abspath(folder)
         logger.info('Searching folder: %s', folder)
-        if (os.path.exists(os.path.join(folder, 'VIDEO_TS')) or 
-            os.path.exists(os.path.join(folder, 'VIDEO_TS.IFO'))):
-            # Process this folder
-            basename = os.path.basename(folder)
-            match = re.search('(.+?)_?[sS](\d+)_?[dD](\d+)', basename)
-            if match:
-                series = match.group(1)
-                series = series.replace('_', ' ')
-                series = series.strip()
-                season = int(match.group(2))
-                disc = int(match.group(3))
+        with metrics.Timer('discovery'):
+            dvd_folders = FindDvdFolders(folder)
+        # (folder, signature, existing DVD to keep or None, (series, season) to scan or None)
+        plan = list()
+        for dvd_folder in dvd_folders:
+            with metrics.Timer('discovery'):
+                signature = DvdFolderSignature(dvd_folder)
+            existing_dvd = self.existing_dvds.pop(os.path.normcase(dvd_folder), None)
+            skipped = self.folder_filter is not None and not self.folder_filter(dvd_folder)
+            # Control files written before signatures were recorded are trusted as unchanged
+            if existing_dvd and existing_dvd.signature in (None, signature):
+                existing_dvd.signature = signature
+                skipped = True
+            if existing_dvd and skipped:
+                plan.append((dvd_folder, signature, existing_dvd, None))
+            elif skipped:
+                logger.info('Skipping DVD folder: %s', dvd_folder)
+            else:
+                series, season, disc = ParseDvdFolderName(dvd_folder)
                 logger.info('series = "%s", season = %d, disc = %d', series, season, disc)
-                
-                if (self.previous_season and season != self.previous_season or
-                    self.previous_series and series != self.previous_series):
-                    # Restart the episode numbering
-                    self.eps_start_num = 1
-                    self.extras_start_num = 1
-                
-                raw = ScanDvd(folder)
-                self.curr_dvd = ParseHBOutput(raw)
-                self.curr_dvd.folder = folder
-                self.curr_dvd.series = series
-                self.curr_dvd.season = season
-                
-                if self.remove_dup_titles:
+                plan.append((dvd_folder, signature, None, (series, season)))
+        # DVDs of the control file below folder whose DVD folder is gone (e.g. an offline share) are kept
+        # in folder order too, so the numbering of the discs after them continues after theirs
+        prefix = os.path.normcase(os.path.join(folder, ''))
+        for key in [x for x in self.existing_dvds if x.startswith(prefix)]:
+            existing_dvd = self.existing_dvds.pop(key)
+            plan.append((existing_dvd.folder, existing_dvd.signature, existing_dvd, None))
+        plan.sort(key=lambda x: x[0].split(os.sep))
+        found_folders = set(dvd_folders)
+
+        scans = self.scanner.ScanMany([x[0] for x in plan if x[3] is not None])
+        for dvd_folder, signature, existing_dvd, series_season in plan:
+            if existing_dvd and dvd_folder not in found_folders:
+                # Kept rather than losing the edits made to it
+                logger.warning('DVD folder from control file not found, keeping it unchanged: %s', dvd_folder)
+                self.KeepDvd(existing_dvd)
+                continue
+            if existing_dvd:
+                logger.info('Keeping DVD from control file: %s', dvd_folder)
+                if self.archive and self.previous_archive:
+                    raw = self.previous_archive.Get(existing_dvd.folder)
+                    if raw is not None:
+                        self.archive.Add(dvd_folder, raw)
+                self.KeepDvd(existing_dvd)
+                continue
+            scanned_folder, raw = next(scans)
+            assert scanned_folder == dvd_folder
+            if self.archive:
+                self.archive.Add(dvd_folder, raw)
+            with metrics.Timer('parse'):
+                dvd = ParseHBOutput(raw)
+            dvd.signature = signature
+            self.ProcessDvd(dvd, dvd_folder, series_season[0], series_season[1])
+
+    def StartDvd(self, series, season):
+        """Restarts the episode numbering when the series or season changes"""
+        if (self.previous_season and season != self.previous_season or
+            self.previous_series and series != self.previous_series):
+            self.FinishSeason()
+            # Restart the episode numbering
+            self.eps_start_num = 1
+            self.extras_start_num = 1
+        self.previous_season = season
+        self.previous_series = series
+
+    def KeepDvd(self, dvd):
+        """Adds a previously detected DvdInfo unchanged, continuing the numbering after it"""
+        self.StartDvd(dvd.series, dvd.season)
+        self.kept_dvds.add(id(dvd))
+        if self.auto_eps_duration or self.batch:
+            self.season_dvds.append(dvd)
+        else:
+            self.NumberDvd(dvd)
+
+    def ProcessDvd(self, dvd, folder, series, season):
+        """Removes unwanted titles from a parsed DvdInfo and numbers its episodes and extras"""
+        self.StartDvd(series, season)
+        
+        self.curr_dvd = dvd
+        self.curr_dvd.folder = folder
+        self.curr_dvd.series = series
+        self.curr_dvd.season = season
+
+        if self.batch:
+            # Titles are removed and numbered for the whole season in FinishSeason
+            self.season_dvds.append(self.curr_dvd)
+            return
+
+        if self.remove_dup_titles:
+            with metrics.Timer('remove_duplicate_titles'):
+                self.RemoveDuplicateTitles()
+        with metrics.Timer('remove_short_titles'):
+            self.RemoveShortTitles()
+        if self.remove_virtual_titles:
+            with metrics.Timer('remove_virtual_titles'):
+                self.RemoveVirtualTitles()
+        self.LogTitleSummary()
+
+        if self.auto_eps_duration:
+            # Numbering waits until every disc of the season has been seen
+            self.season_dvds.append(self.curr_dvd)
+        else:
+            self.NumberDvd(self.curr_dvd)
+
+    def LogTitleSummary(self):
+        """Reports the playtime of the titles kept and rejected on this DVD"""
+        active_durations = [x.duration for x in self.curr_dvd.titles if x.enabled]
+        active_duration_total = sum(active_durations)
+        inactive_durations = [x.duration for x in self.curr_dvd.titles if not x.enabled]
+        inactive_duration_total = sum(inactive_durations)
+        logger.info('*** %d active titles with total playtime of %s '
+                    '(%d inactive titles with playtime of %s) ***',
+                    len(active_durations), GetInHMS(active_duration_total),
+                    len(inactive_durations), GetInHMS(inactive_duration_total))
+
+    def NumberDvd(self, dvd):
+        """Assigns episode/extras numbers and tracks to dvd and adds it to the list of DVDs"""
+        self.curr_dvd = dvd
+        if id(dvd) in self.kept_dvds:
+            self.ContinueNumbering(dvd)
+            self.dvds.append(dvd)
+            return
+        if self.split_chapters:
+            self.SplitChapterTitles()
+        with metrics.Timer('find_episodes'):
+            self.FindEpisodesAndExtras()
+        self.AddNumberedDvd()
+
+    def AddNumberedDvd(self):
+        """Enables the tracks of the numbered curr_dvd and adds it to the list of DVDs"""
+        self.EnableAudioAndSubtitleTracks()
+        self.CountTitles()
+        self.dvds.append(self.curr_dvd)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(pformat(self.curr_dvd))
+
+    def FinishSeason(self):
+        """
+        Removes unwanted titles from the pending season (batch), detects its episode durations
+        (auto_eps_duration) and numbers its DVDs
+        """
+        if not self.season_dvds:
+            return
+        if self.batch:
+            self.RemoveSeasonTitles()
+        if self.auto_eps_duration:
+            self.DetectSeasonDurations()
+        if self.batch:
+            self.NumberSeason()
+        else:
+            for dvd in self.season_dvds:
+                self.NumberDvd(dvd)
+        self.season_dvds = list()
+
+    def DetectSeasonDurations(self):
+        """Sets the episode durations from the enabled titles of the pending season"""
+        with metrics.Timer('detect_eps_duration'):
+            durations = [title.duration for dvd in self.season_dvds for title in dvd.titles if title.enabled]
+            eps_durations, eps_2x_durations = FindEpisodeDurations(durations, 
+                                                                   self.fallback_eps_2x_durations is not None)
+        if eps_durations:
+            self.eps_durations = eps_durations
+            self.eps_2x_durations = eps_2x_durations
+            logger.info('Detected episode duration %s for "%s" season %d',
+                        ', '.join('{}+{}'.format(GetInHMS(d), GetInHMS(v)) 
+                                  for d, v in self.eps_durations + (self.eps_2x_durations or ())),
+                        self.season_dvds[0].series, self.season_dvds[0].season)
+        else:
+            self.eps_durations = self.fallback_eps_durations
+            self.eps_2x_durations = self.fallback_eps_2x_durations
+            logger.warning('Unable to detect an episode duration for "%s" season %d, using --eps-duration',
+                           self.season_dvds[0].series, self.season_dvds[0].season)
+
+    def RemoveSeasonTitles(self):
+        """Removes unwanted titles from the newly scanned DVDs of the pending season (batch)"""
+        new_dvds = [x for x in self.season_dvds if id(x) not in self.kept_dvds]
+        if self.remove_dup_titles:
+            with metrics.Timer('remove_duplicate_titles'):
+                for dvd in new_dvds:
+                    self.curr_dvd = dvd
                     self.RemoveDuplicateTitles()
-                self.RemoveShortTitles()
-                if self.remove_virtual_titles:
+        with metrics.Timer('remove_short_titles'):
+            batch_classify.RemoveShortTitles(new_dvds, self.title_min_duration)
+        for dvd in new_dvds:
+            self.curr_dvd = dvd
+            if self.remove_virtual_titles:
+                with metrics.Timer('remove_virtual_titles'):
                     self.RemoveVirtualTitles()
-                    
-                # Report summary of durations kept/rejected
-                active_durations = [x.duration for x in self.curr_dvd.titles if x.enabled]
-                active_duration_total = sum(active_durations)
-                inactive_durations = [x.duration for x in self.curr_dvd.titles if not x.enabled]
-                inactive_duration_total = sum(inactive_durations)
-                logger.info('*** %d active titles with total playtime of %s '
-                            '(%d inactive titles with playtime of %s) ***',
-                            len(active_durations), GetInHMS(active_duration_total),
-                            len(inactive_durations), GetInHMS(inactive_duration_total))
-                
-                self.FindEpisodesAndExtras()
-                self.EnableAudioAndSubtitleTracks()
-                self.dvds.append(self.curr_dvd)
-                logger.debug(pformat(self.curr_dvd))
-                
-                self.previous_season = season
-                self.previous_series = series
-                    
+            self.LogTitleSummary()
+
+    def NumberSeason(self):
+        """Numbers the pending season (batch), each run of new DVDs between kept DVDs at once"""
+        run = list()
+        for dvd in self.season_dvds + [None]:
+            if dvd is not None and id(dvd) not in self.kept_dvds:
+                run.append(dvd)
+                continue
+            if run:
+                if self.split_chapters:
+                    for numbered_dvd in run:
+                        self.curr_dvd = numbered_dvd
+                        self.SplitChapterTitles()
+                with metrics.Timer('find_episodes'):
+                    self.eps_start_num, self.extras_start_num = batch_classify.NumberTitles(
+                        run, self.eps_start_num, self.extras_start_num,
+                        self.eps_durations, self.eps_2x_durations)
+                for numbered_dvd in run:
+                    self.curr_dvd = numbered_dvd
+                    self.AddNumberedDvd()
+                run = list()
+            if dvd is not None:
+                self.NumberDvd(dvd)
+
+    def ContinueNumbering(self, dvd):
+        """Moves the next episode/extras numbers past those already assigned on dvd"""
+        for title in dvd.titles:
+            if not title.enabled:
+                continue
+            if title.eps_type == 'episode':
+                self.eps_start_num = max(self.eps_start_num, title.eps_end_num + 1)
+            elif title.eps_type == 'extra':
+                self.extras_start_num = max(self.extras_start_num, title.eps_end_num + 1)
+
+    def Finish(self):
+        """Completes processing of the last season"""
+        self.FinishSeason()
+        for dvd in sorted(self.existing_dvds.values(), key=lambda x: x.folder):
+            # DVDs outside every processed folder, kept rather than losing the edits made to them
+            logger.warning('DVD folder from control file not found, keeping it unchanged: %s', dvd.folder)
+            self.kept_dvds.add(id(dvd))
+            self.dvds.append(dvd)
+        self.existing_dvds = dict()
+
+    def ScannedDvds(self):
+        """Returns the DVDs that were scanned, i.e. not kept from the control file"""
+        return [x for x in self.dvds if id(x) not in self.kept_dvds]
+
+    def CountTitles(self):
+        """Adds the titles seen, kept and rejected (by reason) on this DVD to the metrics counters"""
+        for title in self.curr_dvd.titles:
+            metrics.Increment('titles_seen')
+            if title.enabled:
+                metrics.Increment('titles_kept', eps_type=title.eps_type)
             else:
-                raise DvdNameError("Unable to parse folder name '{}'".format(folder))
-        else:
-            for sub_folder in sorted(all_folders(folder, single_level=True)):
-                self.ProcessFolder(sub_folder)
+                metrics.Increment('titles_rejected', reason=title.eps_type)
 
     def RemoveDuplicateTitles(self):
         """Clears the enabled flag for any Titles that appear to be duplicates of earlier Titles on this DVD"""
@@ -142,27 +483,55 @@ class EpisodeDetector(object):
             if match:
                 title.enabled = False
                 title.eps_type = 'virtual'
-                logger.debug('Removed Title #%d for being a virtual match by block count to titles %s', 
-                             title.num, pformat([x[0] for x in c]))
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug('Removed Title #%d for being a virtual match by block count to titles %s', 
+                                 title.num, pformat([x[0] for x in c]))
 
-    def EnableAudioAndSubtitleTracks(self, langs=('eng', 'und')):
+    def SplitChapterTitles(self):
         """
-        Enable audio and subtitle tracks with a language in langs
+        Replaces each enabled title on this DVD that is longer than a single episode, and whose
+        chapters divide into episodes, by one title per episode.  The original title is kept
+        disabled with eps_type 'split'.
+        """
+        titles = list()
+        for title in self.curr_dvd.titles:
+            titles.append(title)
+            if (not title.enabled or title.chapter_start is not None or
+                    _InWindow(title.duration, self.eps_durations)):
+                continue
+            split_titles = SplitTitleByChapters(title, self.eps_durations, self.title_min_duration)
+            if split_titles:
+                title.enabled = False
+                title.eps_type = 'split'
+                logger.info('Title #%d split into %d episodes at chapters %s', title.num, len(split_titles),
+                            ', '.join('{}-{}'.format(x.chapter_start, x.chapter_end) for x in split_titles))
+                titles.extend(split_titles)
+        self.curr_dvd.titles = titles
+
+    def EnableAudioAndSubtitleTracks(self):
+        """
+        Enable the audio and subtitle tracks selected by the DVD's track policy on every title, also the
+        disabled ones so that a title enabled later by hand in the control file still has its tracks.
         If default to Close Captions is true, set the default_subtitle_track.
+        Titles with the same track layout (e.g. every episode of a disc) share one selection.
         """
         assert(isinstance(self.curr_dvd, DvdInfo))
+        policy = self.track_policies.Select(self.curr_dvd)
+        selections = dict()
         for title in self.curr_dvd.titles:
             assert(isinstance(title, Title))
-            for i, track in enumerate(title.audio_tracks):
-                if track.lang in langs:
-                    title.audio_tracks[i] = track._replace(enabled=True)
-            for i, track in enumerate(title.subtitle_tracks):
-                if track.lang in langs:
-                    title.subtitle_tracks[i] = track._replace(enabled=True)
-                    if (self.default_close_captions 
-                        and title.default_subtitle_track == 0 
-                        and track.src_name == 'CC'):
-                        title.default_subtitle_track = track.num
+            layout = (tuple(title.audio_tracks), tuple(title.subtitle_tracks))
+            selection = selections.get(layout)
+            if selection is None:
+                selection = policy.Select(title.audio_tracks, title.subtitle_tracks, self.default_close_captions)
+                selections[layout] = selection
+            else:
+                metrics.Increment('track_selections_reused')
+            audio_tracks, subtitle_tracks, default_subtitle_track = selection
+            title.audio_tracks = list(audio_tracks)
+            title.subtitle_tracks = list(subtitle_tracks)
+            if default_subtitle_track and title.default_subtitle_track == 0:
+                title.default_subtitle_track = default_subtitle_track
 
     def FindEpisodesAndExtras(self):
         """Finds and assigns episode/extras numbers to active Titles on this DVD"""
@@ -174,7 +543,7 @@ class EpisodeDetector(object):
             is_episode = any((duration - variance) <= title.duration <= (duration + variance) 
                              for duration, variance in self.eps_durations)
             is_2x_episode = any((duration - variance) <= title.duration <= (duration + variance) 
-                                for duration, variance in self.eps_2x_durations)
+                                for duration, variance in self.eps_2x_durations or ())
             if is_episode:
                 logger.info('Title #%2d is episode "S%02dE%02d", duration %s', 
                             title.num, self.curr_dvd.season, self.eps_start_num, GetInHMS(title.duration))
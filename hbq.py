@@ -1,101 +1,303 @@
 """hbq - Command line tool for building a HandBrake Queue"""
 # Python modules
 import argparse
+import collections
+import copy
+import csv
+from itertools import product
 import logging
-import logging.config
 import os
 import os.path
-from pprint import pprint, pformat
-import re
-import xml.etree.ElementTree as et
-from xml.dom.minidom import parseString
-import yaml
-# Personal library modules
-from oreillycookbook.files import all_folders
-# Project modules
-from eps_detector import EpisodeDetector
-from time_util import GetInSeconds, GetDurationInSeconds
-from dvdinfo import DvdInfo, Title, WriteDvdListToXML, ReadDvdListFromXML
+import sys
+import time
+# Project modules, the rest are imported by the sub-commands that use them
+from log_util import ConfigureLogging, LOG_LEVELS
+import metrics
+from profiling import PROFILE_MODES
+from time_util import GetInSeconds, GetDurationInSeconds, GetInHMS
 
 logger = logging.getLogger('hbq')
 
+# Longest wait before watch retries a rip that could not be added and has not changed since
+WATCH_MAX_RETRY_DELAY = 3600
+
+
+def WorkerIdArg(text):
+    """argparse type of --worker-id, rejecting ids that cannot be part of a shared queue claim name"""
+    from shared_queue import CheckWorkerId
+    try:
+        return CheckWorkerId(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
 
 def ParseArguments():
     parser = argparse.ArgumentParser(
         description='Process a series of folders, reading the DVD information, display it to stdout',
         fromfile_prefix_chars='@')
+    parser.add_argument(
+        '--metrics-file',
+        dest='metrics_file',
+        default='',
+        metavar='BASE',
+        help='Write stage timings and counters to BASE.json and BASE.prom (default: no metrics)')
+    parser.add_argument(
+        '--log-level',
+        dest='log_level',
+        choices=LOG_LEVELS,
+        default='DEBUG',
+        help='Most detailed level passed to the log handlers (default: DEBUG)')
+    parser.add_argument(
+        '--profile',
+        dest='profile',
+        choices=PROFILE_MODES,
+        default='',
+        help='Run the sub-command under a deterministic (cProfile) or sampling profiler (default: off)')
+    parser.add_argument(
+        '--profile-output',
+        dest='profile_output',
+        default='hbq_profile',
+        metavar='BASE',
+        help='Write the profile to BASE.pstats and the summary to BASE.txt (default: hbq_profile)')
+    parser.add_argument(
+        '--profile-interval',
+        dest='profile_interval',
+        type=float,
+        default=10.0,
+        metavar='MS',
+        help='Sampling profiler interval in milliseconds (default: 10)')
 
     subparsers = parser.add_subparsers(dest='subparser_name', help='sub-command help')
 
-    parser_scan = subparsers.add_parser('scan', help='scan help',
-                                        usage='hbq.py scan root_folder [options]')
-    parser_scan.add_argument(
-        'root_folder',
-        nargs=1)
-    parser_scan.add_argument(
-        '-f', '--xml-output-filename',
-        dest='xml_filename',
-        nargs=1,
-        default='',
-        metavar='FILE',
-        help='Filename to write scan results to (default: basename(<root_folder>).xml)')
-    parser_scan.add_argument(
+    # Episode detection options shared by scan and watch
+    parser_detection = argparse.ArgumentParser(add_help=False)
+    parser_detection.add_argument(
         '-d', '--eps-duration',
         dest='eps_duration',
         nargs='+',
         default='25:00+1:00',
         metavar='MM:SS+MM:SS',
         help='A list of times (+/- variance) to be considered an episode (default: 25:00+1:00)')
-    parser_scan.add_argument(
+    parser_detection.add_argument(
+        '-a', '--auto-eps-duration',
+        dest='auto_eps_duration',
+        action='store_const',
+        const=True,
+        default=False,
+        help='Detect the episode duration of each season by clustering its title durations, '
+             'falling back to --eps-duration (default: False)')
+    parser_detection.add_argument(
         '-t', '--title-min-duration',
         dest='title_min_duration',
         default='1:00',
         metavar='MM:SS',
         help='Minimum time for a title to be considered an episode or extra (default: 1:00)')
-    parser_scan.add_argument(
+    parser_detection.add_argument(
         '--eps-start-num',
         dest='eps_start_num',
         type=int,
         default=1,
         metavar='N',
         help='The first episode number be be used for the first season detected (default: 1)')
-    parser_scan.add_argument(
+    parser_detection.add_argument(
         '--extras-start-num',
         dest='extras_start_num',
         type=int,
         default=1,
         metavar='N',
         help='The first extra number be be used for the first season detected (default: 1)')
-    parser_scan.add_argument(
+    parser_detection.add_argument(
         '-k', '--keep-dup-titles',
         dest='remove_dup_titles',
         action='store_const',
         const=False,
         default=True,
         help='Keep all duplicate titles (default: False)')
-    parser_scan.add_argument(
+    parser_detection.add_argument(
         '--no-default-close-captions',
         dest='default_close_captions',
         action='store_const',
         const=False,
         default=True,
         help='Do not default subtitles to Closed Captions (default: False)')
-    parser_scan.add_argument(
+    parser_detection.add_argument(
         '-v', '--keep-virtual-titles',
         dest='remove_virtual_titles',
         action='store_const',
         const=False,
         default=True,
         help='Keep all virtual titles (default: False)')
-    parser_scan.add_argument(
+    parser_detection.add_argument(
         '-2', '--no-2x-duration',
         dest='expect_2x_duration',
         action='store_const',
         const=False,
         default=True,
         help='Do not double --eps-duration values to find double-length episodes (default: False)')
+    parser_detection.add_argument(
+        '-c', '--split-chapters',
+        dest='split_chapters',
+        action='store_const',
+        const=True,
+        default=False,
+        help='Split titles holding several episodes (e.g. "play all") at chapter boundaries, '
+             'so each episode is encoded on its own (default: False)')
+    parser_detection.add_argument(
+        '--no-scan-archive',
+        dest='archive_scans',
+        action='store_const',
+        const=False,
+        default=True,
+        help='Do not archive the raw HandBrakeCLI output next to the XML file for redetect (default: False)')
+    parser_detection.add_argument(
+        '--track-policy',
+        dest='track_policy_filename',
+        default='',
+        metavar='FILE',
+        help='YAML file of audio/subtitle track policies and the rules selecting them '
+             '(default: hbq_tracks_default.yaml)')
+    parser_detection.add_argument(
+        '--scanner',
+        dest='scanner',
+        choices=('handbrake', 'ifo'),
+        default='handbrake',
+        help='Read DVD folders with HandBrakeCLI, or from their IFO files without starting a process '
+             '(nominal NTSC/PAL frame rates, no combing detection) (default: handbrake)')
+    parser_detection.add_argument(
+        '--transcoder',
+        dest='transcoder',
+        default='',
+        metavar='FILE',
+        help='HandBrakeCLI used by --scanner handbrake (default: HandBrakeCLI, see hbscan.TRANSCODER)')
+    parser_detection.add_argument(
+        '--scan-args',
+        dest='scan_args',
+        default='',
+        metavar='ARGS',
+        help='Extra HandBrakeCLI arguments for scans, e.g. --scan-args="--min-duration 30" (default: none)')
+    parser_detection.add_argument(
+        '--scan-jobs',
+        dest='scan_jobs',
+        type=int,
+        default=1,
+        metavar='N',
+        help='Number of DVD folders scanned at once (default: 1)')
+    parser_detection.add_argument(
+        '--scan-cache',
+        dest='scan_cache',
+        default='',
+        metavar='DIR',
+        help='Keep the scan output of each DVD folder in DIR and reuse it while the folder\'s IFO files '
+             'are unchanged (default: no cache)')
+    parser_detection.add_argument(
+        '--replay-scans',
+        dest='replay_scans',
+        action='store_const',
+        const=True,
+        default=False,
+        help='Reuse the scan output archived next to the XML file, only scanning folders missing from it '
+             '(default: False)')
+
+    parser_scan = subparsers.add_parser('scan', help='scan help', parents=[parser_detection],
+                                        usage='hbq.py scan root_folder [options]')
+    parser_scan.add_argument(
+        'root_folder',
+        nargs=1)
+    parser_scan.add_argument(
+        '-f', '--xml-output-filename',
+        dest='xml_filename',
+        nargs=1,
+        default='',
+        metavar='FILE',
+        help='Filename to write scan results to (default: basename(<root_folder>).xml)')
+    parser_scan.add_argument(
+        '-i', '--incremental',
+        dest='incremental',
+        action='store_const',
+        const=True,
+        default=False,
+        help='Keep the DVDs already in the XML output file and only scan new or changed folders '
+             '(default: False)')
     parser_scan.set_defaults(command=ScanFolders)
 
+    parser_redetect = subparsers.add_parser('redetect', help='redetect help',
+                                            usage='hbq.py redetect control_file [options]')
+    parser_redetect.add_argument(
+        'archive',
+        nargs=1,
+        help='Control file (or its .scans.zip archive) written by scan')
+    parser_redetect.add_argument(
+        '-d', '--eps-duration',
+        dest='eps_duration',
+        nargs='+',
+        default=['25:00+1:00'],
+        metavar='MM:SS+MM:SS[,MM:SS+MM:SS]',
+        help='Episode duration sets to try, windows within a set are comma separated, '
+             '"auto" tries --auto-eps-duration (default: 25:00+1:00)')
+    parser_redetect.add_argument(
+        '--fallback-eps-duration',
+        dest='fallback_eps_duration',
+        nargs='+',
+        default=['25:00+1:00'],
+        metavar='MM:SS+MM:SS',
+        help='Episode durations used by "auto" when no duration is detected (default: 25:00+1:00)')
+    parser_redetect.add_argument(
+        '-t', '--title-min-duration',
+        dest='title_min_duration',
+        nargs='+',
+        default=['1:00'],
+        metavar='MM:SS',
+        help='Minimum title durations to try (default: 1:00)')
+    parser_redetect.add_argument(
+        '--dup-titles',
+        dest='dup_titles',
+        choices=('remove', 'keep', 'both'),
+        default='remove',
+        help='Remove or keep duplicate titles, or try both (default: remove)')
+    parser_redetect.add_argument(
+        '--virtual-titles',
+        dest='virtual_titles',
+        choices=('remove', 'keep', 'both'),
+        default='remove',
+        help='Remove or keep virtual titles, or try both (default: remove)')
+    parser_redetect.add_argument(
+        '--eps-start-num',
+        dest='eps_start_num',
+        type=int,
+        default=1,
+        metavar='N',
+        help='The first episode number be be used for the first season detected (default: 1)')
+    parser_redetect.add_argument(
+        '--extras-start-num',
+        dest='extras_start_num',
+        type=int,
+        default=1,
+        metavar='N',
+        help='The first extra number be be used for the first season detected (default: 1)')
+    parser_redetect.add_argument(
+        '-2', '--no-2x-duration',
+        dest='expect_2x_duration',
+        action='store_const',
+        const=False,
+        default=True,
+        help='Do not double --eps-duration values to find double-length episodes (default: False)')
+    parser_redetect.add_argument(
+        '-c', '--split-chapters',
+        dest='split_chapters',
+        action='store_const',
+        const=True,
+        default=False,
+        help='Split titles holding several episodes (e.g. "play all") at chapter boundaries, '
+             'so each episode is encoded on its own (default: False)')
+    parser_redetect.add_argument(
+        '-r', '--report',
+        dest='report_filename',
+        nargs=1,
+        default='',
+        metavar='FILE',
+        help='Also write the report to FILE as CSV')
+    parser_redetect.set_defaults(command=Redetect)
+
     parser_build = subparsers.add_parser('build', help='build help')
     parser_build.add_argument('control_file',
                               nargs='+')
@@ -120,8 +322,284 @@ def ParseArguments():
         const=True,
         default=False,
         help='Create 1st generation queue format (default: False)')
+    parser_build.add_argument(
+        '-p', '--profiles',
+        dest='profiles_filename',
+        default='',
+        metavar='FILE',
+        help='YAML file of encode profiles and the rules selecting them (default: hbq_profiles_default.yaml)')
+    parser_build.add_argument(
+        '-o', '--queue-filename',
+        dest='queue_filename',
+        nargs=1,
+        default='',
+        metavar='FILE',
+        help='Queue file to update, new jobs are appended to an existing one '
+             '(default: <first control_file without extension>.queue)')
+    parser_build.add_argument(
+        '-r', '--rebuild',
+        dest='rebuild_queue',
+        action='store_const',
+        const=True,
+        default=False,
+        help='Replace an existing queue file instead of appending to it, numbering jobs from 1 (default: False)')
+    parser_build.add_argument(
+        '-j', '--jobs',
+        dest='num_processes',
+        type=int,
+        default=None,
+        metavar='N',
+        help='Number of processes reading control files (default: number of CPUs)')
+    parser_build.add_argument(
+        '-s', '--shared-queue',
+        dest='shared_queue',
+        default='',
+        metavar='DIR',
+        help='Publish the jobs to the shared queue DIR for "worker" nodes instead of writing a queue file, '
+             'jobs pending or running there are skipped, done or failed ones run again (default: none)')
     parser_build.set_defaults(command=BuildQueue)
 
+    parser_worker = subparsers.add_parser('worker', help='worker help',
+                                          usage='hbq.py worker shared_queue [options]')
+    parser_worker.add_argument(
+        'shared_queue',
+        nargs=1,
+        help='Shared queue directory written by "build --shared-queue"')
+    parser_worker.add_argument(
+        '--transcoder',
+        dest='transcoder',
+        default='',
+        metavar='FILE',
+        help='Program run with each job query (default: HandBrakeCLI, see hbscan.TRANSCODER)')
+    parser_worker.add_argument(
+        '--worker-id',
+        dest='worker_id',
+        type=WorkerIdArg,
+        default='',
+        metavar='NAME',
+        help='Name of this worker in the shared queue (default: <hostname>-<pid>)')
+    parser_worker.add_argument(
+        '--lease-timeout',
+        dest='lease_timeout',
+        type=float,
+        default=300.0,
+        metavar='SECONDS',
+        help='Time without a heartbeat after which a claimed job is given to another worker (default: 300)')
+    parser_worker.add_argument(
+        '--heartbeat-interval',
+        dest='heartbeat_interval',
+        type=float,
+        default=30.0,
+        metavar='SECONDS',
+        help='Time between lease renewals while a job is encoding (default: 30)')
+    parser_worker.add_argument(
+        '--poll-interval',
+        dest='poll_interval',
+        type=float,
+        default=30.0,
+        metavar='SECONDS',
+        help='Time between checks of an empty queue (default: 30)')
+    parser_worker.add_argument(
+        '--max-jobs',
+        dest='max_jobs',
+        type=int,
+        default=None,
+        metavar='N',
+        help='Exit after N jobs (default: no limit)')
+    parser_worker.add_argument(
+        '--exit-when-empty',
+        dest='exit_when_empty',
+        action='store_const',
+        const=True,
+        default=False,
+        help='Exit once no jobs are pending or claimed instead of polling (default: False)')
+    parser_worker.add_argument(
+        '--min-workers',
+        dest='min_workers',
+        type=int,
+        default=1,
+        metavar='N',
+        help='Fewest jobs encoded at the same time (default: 1)')
+    parser_worker.add_argument(
+        '--max-workers',
+        dest='max_workers',
+        type=int,
+        default=1,
+        metavar='N',
+        help='Most jobs encoded at the same time, the count in between is tuned for the best total fps '
+             '(default: 1)')
+    parser_worker.add_argument(
+        '--sample-interval',
+        dest='sample_interval',
+        type=float,
+        default=5.0,
+        metavar='SECONDS',
+        help='Time between samples of the encode fps and CPU use (default: 5)')
+    parser_worker.add_argument(
+        '--tune-window',
+        dest='tune_window',
+        type=int,
+        default=12,
+        metavar='N',
+        help='Samples measured at each job count before it is changed (default: 12)')
+    parser_worker.add_argument(
+        '--tune-hold',
+        dest='tune_hold',
+        type=int,
+        default=10,
+        metavar='N',
+        help='Windows of samples the best job count is kept for after a step made no gain, before '
+             'probing again, 0 to keep probing (default: 10)')
+    parser_worker.add_argument(
+        '--max-cpu',
+        dest='max_cpu',
+        type=float,
+        default=95.0,
+        metavar='PERCENT',
+        help='CPU use above which no more jobs are started (default: 95)')
+    parser_worker.add_argument(
+        '--nice',
+        dest='nice',
+        type=int,
+        default=None,
+        metavar='N',
+        help='Run the transcoder with this nice value, so scans keep priority (default: unchanged)')
+    parser_worker.add_argument(
+        '--affinity',
+        dest='affinity',
+        action='store_const',
+        const=True,
+        default=False,
+        help='Pin each job to its own share of the CPUs, needs psutil (default: False)')
+    parser_worker.set_defaults(command=RunWorker)
+
+    parser_verify = subparsers.add_parser('verify', help='verify help',
+                                          usage='hbq.py verify queue_file -c control_file [...] [options]')
+    parser_verify.add_argument(
+        'queue_filename',
+        nargs=1,
+        help='Queue file whose outputs are checked')
+    parser_verify.add_argument(
+        '-c', '--control-file',
+        dest='control_file',
+        nargs='+',
+        required=True,
+        metavar='FILE',
+        help='Control files the queue was built from')
+    parser_verify.add_argument(
+        '-t', '--duration-tolerance',
+        dest='duration_tolerance',
+        default='0:05',
+        metavar='MM:SS',
+        help='Largest difference between the output and title durations (default: 0:05)')
+    parser_verify.add_argument(
+        '--transcoder',
+        dest='transcoder',
+        default='',
+        metavar='FILE',
+        help='Program used to probe the outputs (default: HandBrakeCLI, see hbscan.TRANSCODER)')
+    parser_verify.add_argument(
+        '-j', '--jobs',
+        dest='num_threads',
+        type=int,
+        default=None,
+        metavar='N',
+        help='Number of outputs probed at the same time (default: number of CPUs)')
+    parser_verify.add_argument(
+        '-o', '--requeue-filename',
+        dest='requeue_filename',
+        nargs=1,
+        default='',
+        metavar='FILE',
+        help='Queue file for the jobs to re-run (default: <queue base>_requeue.queue)')
+    parser_verify.add_argument(
+        '-r', '--report',
+        dest='report_filename',
+        nargs=1,
+        default='',
+        metavar='FILE',
+        help='Also write the report to FILE as CSV')
+    parser_verify.set_defaults(command=VerifyQueue)
+
+    parser_watch = subparsers.add_parser('watch', help='watch help', parents=[parser_detection],
+                                         usage='hbq.py watch ingest_folder [options]')
+    parser_watch.add_argument(
+        'root_folder',
+        nargs=1)
+    parser_watch.add_argument(
+        '-f', '--xml-output-filename',
+        dest='xml_filename',
+        nargs=1,
+        default='',
+        metavar='FILE',
+        help='Control file new DVDs are added to (default: basename(<ingest_folder>).xml)')
+    parser_watch.add_argument(
+        '-q', '--queue-filename',
+        dest='queue_filename',
+        nargs=1,
+        default='',
+        metavar='FILE',
+        help='Queue file new jobs are appended to (default: <control file base>.queue)')
+    parser_watch.add_argument(
+        '--dest-folder',
+        dest='dst_folder',
+        nargs=1,
+        default=['W:\\video_handbrake'],
+        metavar='DIR',
+        help='Destination directory for MKV files (default: W:\\video_handbrake)')
+    parser_watch.add_argument(
+        '--make-output-folders',
+        dest='make_output_folders',
+        action='store_const',
+        const=True,
+        default=False,
+        help='Create all output folders (default: False)')
+    parser_watch.add_argument(
+        '--1st-gen-queue',
+        dest='make_1st_gen_queue',
+        action='store_const',
+        const=True,
+        default=False,
+        help='Create 1st generation queue format (default: False)')
+    parser_watch.add_argument(
+        '-p', '--profiles',
+        dest='profiles_filename',
+        default='',
+        metavar='FILE',
+        help='YAML file of encode profiles and the rules selecting them (default: hbq_profiles_default.yaml)')
+    parser_watch.add_argument(
+        '--poll-interval',
+        dest='poll_interval',
+        type=float,
+        default=30.0,
+        metavar='SECONDS',
+        help='Time between snapshots of the ingest folder (default: 30)')
+    parser_watch.add_argument(
+        '--settle-time',
+        dest='settle_time',
+        type=float,
+        default=120.0,
+        metavar='SECONDS',
+        help='Time the IFO files of a new rip must stay unchanged before it is scanned (default: 120)')
+    parser_watch.add_argument(
+        '--settle-from-mtime',
+        dest='settle_from_mtime',
+        action='store_const',
+        const=True,
+        default=False,
+        help='Start the settle time at the newest IFO file modification time instead of when the rip '
+             'is first seen, only for rips whose copies get new times (cp -p, robocopy and rsync -t '
+             'keep the old ones) (default: False)')
+    parser_watch.add_argument(
+        '--once',
+        dest='once',
+        action='store_const',
+        const=True,
+        default=False,
+        help='Take a snapshot, wait --settle-time for rips still settling, take a second one and exit, '
+             'e.g. when run from a scheduler (default: False)')
+    parser_watch.set_defaults(command=WatchFolder)
+
     args = parser.parse_args()
 
     return args
@@ -133,194 +611,522 @@ def ScanFolders(args):
 
     Scans the folder provided and builds an XML output file
     """
+    from dvdinfo import ReadDvdListFromXML, WriteDvdListToXML
+
     # convert the MM:SS and MM:SS+MM:SS argument values to seconds
     args.title_min_duration = GetInSeconds(args.title_min_duration)
     # MEZ this is a bit of a hack.  Is there a more Pythonistic way to ensure I have an iterable from a string
     if not isinstance(args.eps_duration, list):
         args.eps_duration = (args.eps_duration,)
-    args.eps_duration = [GetDurationInSeconds(duration) for duration in args.eps_duration]
 
     root_folder = os.path.abspath(args.root_folder[0])
-    # Create 2x episode duration tuple
-    eps_durations = args.eps_duration
-    if args.expect_2x_duration:
-        eps_2x_durations = tuple((duration * 2, variance * 2)
-                                 for duration, variance in eps_durations)
-    else:
-        eps_2x_durations = None
+    xml_filename = GetXMLFilename(root_folder, args.xml_filename)
 
-    episodes = list()
-    eps_start_num = args.eps_start_num
-    extras_start_num = args.extras_start_num
-    previous_season = None
+    existing_dvds = None
+    if args.incremental and os.path.exists(xml_filename):
+        with metrics.Timer('xml_read'):
+            existing_dvds = ReadDvdListFromXML(xml_filename)
+        logger.info('Loaded %d DVDs from "%s"', len(existing_dvds), xml_filename)
 
-    episodes = EpisodeDetector(eps_start_num, extras_start_num, args.remove_dup_titles,
-                               args.remove_virtual_titles, args.title_min_duration,
-                               eps_durations, eps_2x_durations, args.default_close_captions)
+    episodes = DetectEpisodes(args, root_folder, xml_filename, existing_dvds)
 
-    episodes.ProcessFolder(root_folder)
-    if not args.xml_filename:
+    with metrics.Timer('xml_write'):
+        WriteDvdListToXML(episodes.dvds, xml_filename)
+
+
+def GetXMLFilename(root_folder, xml_filename_arg):
+    """Returns the XML filename given with -f, or basename(root_folder).xml"""
+    if not xml_filename_arg:
         xml_filename = os.path.basename(root_folder)
         xml_filename = xml_filename or 'hbq'
         xml_filename = xml_filename + '.xml'
     else:
-        xml_filename = args.xml_filename[0]
+        xml_filename = xml_filename_arg[0]
+    return xml_filename
 
-    WriteDvdListToXML(episodes.dvds, xml_filename)
 
+def MakeScanner(args, replay_archive=None):
+    """Returns the hbscan.Scanner selected by the scan arguments in args"""
+    import shlex
+    from eps_detector import DvdFolderSignature
+    from hbscan import CachedScanner, HandBrakeScanner, IfoScanner, ReplayScanner, TRANSCODER
 
-def BuildQueue(args):
-    xml_filename = args.control_file[0]
-    dvds = ReadDvdListFromXML(xml_filename)
-    #pprint(dvds)
-    WriteDvdListToXML(dvds, 'test.xml')
+    if args.scanner == 'ifo':
+        scanner = IfoScanner(args.scan_jobs)
+    else:
+        scanner = HandBrakeScanner(args.transcoder or TRANSCODER, shlex.split(args.scan_args), args.scan_jobs)
+    if args.scan_cache:
+        scanner = CachedScanner(scanner, args.scan_cache, DvdFolderSignature)
+    if replay_archive:
+        scanner = ReplayScanner(replay_archive, scanner)
+    return scanner
+
+
+def DetectEpisodes(args, root_folder, xml_filename, existing_dvds=None, folder_filter=None):
+    """
+    Runs an EpisodeDetector over root_folder with the detection arguments in args and returns it.
+    DVDs in existing_dvds are kept unless their folder changed, folder_filter limits which new
+    folders are scanned.  The raw scan output is archived next to xml_filename.
+    """
+    from eps_detector import EpisodeDetector
+    from scan_archive import ArchiveFilename, ScanArchive
+    from track_policy import LoadTrackPolicies
 
-    cq = 19.25
-    job_num = 0
-    dst_root_folder = args.dst_folder[0]
+    eps_durations, eps_2x_durations = GetEpisodeDurations(args.eps_duration, args.expect_2x_duration)
+    eps_start_num = args.eps_start_num
+    extras_start_num = args.extras_start_num
+    track_policies = LoadTrackPolicies(args.track_policy_filename)
+
+    previous_archive = None
+    archive = None
+    archive_filename = ArchiveFilename(xml_filename)
+    if existing_dvds and os.path.exists(archive_filename):
+        previous_archive = ScanArchive(archive_filename)
+    if args.archive_scans:
+        archive = ScanArchive(archive_filename + '.tmp', 'w')
+    replay_archive = None
+    if args.replay_scans and os.path.exists(archive_filename):
+        replay_archive = ScanArchive(archive_filename)
+    scanner = MakeScanner(args, replay_archive)
+    try:
+        episodes = EpisodeDetector(eps_start_num, extras_start_num, args.remove_dup_titles,
+                                   args.remove_virtual_titles, args.title_min_duration,
+                                   eps_durations, eps_2x_durations, args.default_close_captions,
+                                   args.auto_eps_duration, archive, existing_dvds, previous_archive,
+                                   folder_filter, split_chapters=args.split_chapters, scanner=scanner,
+                                   track_policies=track_policies)
+
+        episodes.ProcessFolder(root_folder)
+        episodes.Finish()
+    finally:
+        scanner.Close()
+        if replay_archive:
+            replay_archive.Close()
+        if previous_archive:
+            previous_archive.Close()
+        if archive:
+            archive.Close()
+    if archive:
+        if os.path.exists(archive_filename):
+            os.remove(archive_filename)
+        os.rename(archive.filename, archive_filename)
+    return episodes
+
+
+def WatchRetryDelay(args, failures):
+    """Returns the seconds to wait before retrying an unchanged rip that failed failures times"""
+    return min(WATCH_MAX_RETRY_DELAY, max(args.settle_time, args.poll_interval) * 2 ** failures)
+
+
+def WatchFolder(args):
+    """
+    Implements command line 'watch' arg
+
+    Polls the ingest folder for completed rips (IFO files unchanged for --settle-time), scans
+    them into the control file and appends their jobs to the queue file.
+    """
+    from dvdinfo import ReadDvdListFromXML, WriteDvdListToXML
+    from encode_profiles import LoadProfiles
+    from eps_detector import DvdFolderSignature, FindDvdFolders, GetIfoFiles
+    from hbqueue import AppendToQueue, DeduplicateJobs, MakeJobs
+
+    args.title_min_duration = GetInSeconds(args.title_min_duration)
+    if not isinstance(args.eps_duration, list):
+        args.eps_duration = (args.eps_duration,)
 
-    if args.make_1st_gen_queue:
-        root = et.Element('ArrayOfJob')
+    root_folder = os.path.abspath(args.root_folder[0])
+    xml_filename = GetXMLFilename(root_folder, args.xml_filename)
+    if args.queue_filename:
+        queue_filename = args.queue_filename[0]
     else:
-        root = et.Element('ArrayOfQueueTask')
-
-    for dvd in dvds:
-        assert(isinstance(dvd, DvdInfo))
-        for title in dvd.titles:
-            assert(isinstance(title, Title))
-            if not title.enabled:
-                continue
-
-            cfg = {}
-            cfg['cq'] = cq
-            cfg['title_num'] = title.num
-            cfg['src_folder'] = dvd.folder
-            if title.eps_type == 'episode':
-                eps_num_str = ''.join(['E{:02d}'.format(x) for x in
-                                       range(title.eps_start_num, title.eps_end_num + 1)])
-            elif title.eps_type == 'extra':
-                eps_num_str = 'Extras{:02d}'.format(title.eps_start_num)
-            else:
-                raise Exception('eps_type must be "episode" or "extra" (had "{}")'.format(title.eps_type))
-            dest_folder = os.path.join(dst_root_folder,
-                                       dvd.series,
-                                       'Season {:d}'.format(dvd.season))
-
-            if args.make_output_folders and not os.path.isdir(dest_folder):
-                logger.debug('Creating folder "%s"', dest_folder)
-                os.makedirs(dest_folder)
-            cfg['destination'] = '{0} S{1:02d}{2}.mkv'.format(os.path.join(dest_folder, dvd.series),
-                                                              dvd.season,
-                                                              eps_num_str)
-            cfg['fps'] = title.fps
-            cfg['audio_tracks'] = ','.join([str(track.num) for track in title.audio_tracks if track.enabled])
-            cfg['audio_encoders'] = ','.join(['copy:ac3' for track in title.audio_tracks if track.enabled])
-            enabled_subtitles = [track.num for track in title.subtitle_tracks if track.enabled]
-            cfg['subtitles'] = ",".join([str(x) for x in enabled_subtitles])
-            if title.default_subtitle_track:
-                # The value is based on the 'subtitles' idx, not the value in track.num
-                cfg['default_subtitle'] = str(enabled_subtitles.index(title.default_subtitle_track) + 1)
-            elif cfg['subtitles']:
-                # There is at least 1 subtitle enabled
-                cfg['default_subtitle'] = '1'
-            else:
-                cfg['default_subtitle'] = ''
-            if title.combing_detected:
-                cfg['detelecine'] = '--detelecine'
-            else:
-                cfg['detelecine'] = ''
-            job_num += 1
+        queue_filename = os.path.splitext(xml_filename)[0] + '.queue'
 
-            if args.make_1st_gen_queue:
-                job = et.SubElement(root, 'Job')
-            else:
-                job = et.SubElement(root, 'QueueTask')
-            et.SubElement(job, 'Id').text = format(job_num)
-            et.SubElement(job, 'Title').text = '{:d}'.format(cfg['title_num'])
-            et.SubElement(job, 'Query').text = (
-                ' -i "{src_folder}"'
-                ' -t {title_num}'
-                ' --angle 1'
-                ' -o "{destination}"'
-                ' -f mkv'
-                ' {detelecine} --decomb --denoise="weak"'
-                ' -w 720 --loose-anamorphic'
-                ' -e x264 -q {cq}'
-                ' -r {fps}'
-                ' -a {audio_tracks} -E {audio_encoders}'
-                ' --subtitle {subtitles} --subtitle-default={default_subtitle}'
-                ' -m'
-                ' -x ref=5:bframes=5:subq=9:mixed-refs=0:8x8dct=1:trellis=2:b-pyramid=1:me=umh:merange=32:analyse=all'
-                ' -v 2'.format(**cfg))
-            if args.make_1st_gen_queue:
-                et.SubElement(job, 'CustomQuery').text = 'false'
+    profiles = LoadProfiles(args.profiles_filename)
+    known_folders = set()
+    if os.path.exists(xml_filename):
+        known_folders.update(os.path.normcase(x.folder) for x in ReadDvdListFromXML(xml_filename))
+    # folder -> (signature, time that signature was first seen)
+    pending = dict()
+    # folder -> (signature, time of the last failure, number of failures) of rips that could not be added
+    failed = dict()
+    settling_checked = False
+    logger.info('Watching "%s" (%d DVDs already in "%s")', root_folder, len(known_folders), xml_filename)
+    while True:
+        ready = set()
+        with metrics.Timer('watch_poll'):
+            now = time.time()
+            for folder in FindDvdFolders(root_folder):
+                key = os.path.normcase(folder)
+                if key in known_folders:
+                    continue
+                signature = DvdFolderSignature(folder)
+                if signature is None:
+                    # No IFO files written yet
+                    continue
+                if key in failed:
+                    failed_signature, failed_time, failures = failed[key]
+                    if failed_signature == signature and now - failed_time < WatchRetryDelay(args, failures):
+                        continue
+                    if failed_signature != signature:
+                        # Changed since it failed, it has to settle again
+                        del failed[key]
+                if key not in pending or pending[key][0] != signature:
+                    # The settle time (re)starts whenever the signature changes, file times are only
+                    # used when asked for since copies can keep the times of the original files
+                    first_seen = now
+                    if args.settle_from_mtime:
+                        first_seen = min(now, max(os.path.getmtime(x) for x in GetIfoFiles(folder)))
+                    pending[key] = (signature, first_seen)
+                if now - pending[key][1] >= args.settle_time:
+                    ready.add(key)
+                else:
+                    logger.debug('Rip in progress: %s', folder)
+
+        if ready:
+            logger.info('Found %d completed rips', len(ready))
+            existing_dvds = None
+            if os.path.exists(xml_filename):
+                with metrics.Timer('xml_read'):
+                    existing_dvds = ReadDvdListFromXML(xml_filename)
+            try:
+                episodes = DetectEpisodes(args, root_folder, xml_filename, existing_dvds,
+                                          folder_filter=lambda x: os.path.normcase(x) in ready)
+                with metrics.Timer('xml_write'):
+                    WriteDvdListToXML(episodes.dvds, xml_filename)
+                new_dvds = episodes.ScannedDvds()
+                with metrics.Timer('queue_generation'):
+                    # Like build: a re-ripped or moved disc does not queue its destinations twice
+                    jobs = MakeJobs(new_dvds, args.dst_folder[0], profiles, args.make_output_folders)
+                    unique_jobs = DeduplicateJobs(jobs)
+                    diff = AppendToQueue(queue_filename, unique_jobs, args.make_1st_gen_queue)
+                logger.info('Added %d jobs to "%s": %d already queued, %d changed, '
+                            '%d duplicate or conflicting jobs dropped', len(diff.added), queue_filename,
+                            len(diff.unchanged), len(diff.changed), len(jobs) - len(unique_jobs))
+            except Exception:
+                # Keep watching, the rips are retried when they change or after a growing delay
+                logger.exception('Unable to add rips %s', sorted(ready))
+                for key in ready:
+                    failures = failed[key][2] + 1 if key in failed else 1
+                    failed[key] = (pending.pop(key)[0], time.time(), failures)
+                    logger.warning('Retrying %s in %.1f seconds or once it changes', key,
+                                   WatchRetryDelay(args, failures))
             else:
-                et.SubElement(job, 'CustomQuery').text = 'true'
-                et.SubElement(job, 'Status').text = 'Waiting'
+                for key in ready:
+                    known_folders.add(key)
+                    del pending[key]
+                    failed.pop(key, None)
+
+        if args.once:
+            if settling_checked or not pending:
+                break
+            # Rips first seen by this snapshot are ready on the second one if they did not change
+            settling_checked = True
+            time.sleep(args.settle_time)
+            continue
+        time.sleep(args.poll_interval)
+
+
+def GetEpisodeDurations(eps_duration_args, expect_2x_duration):
+    """Returns the (eps_durations, eps_2x_durations) windows in seconds for a list of MM:SS+MM:SS strings"""
+    eps_durations = [GetDurationInSeconds(duration) for duration in eps_duration_args]
+    # Create 2x episode duration tuple
+    if expect_2x_duration:
+        eps_2x_durations = tuple((duration * 2, variance * 2)
+                                 for duration, variance in eps_durations)
+    else:
+        eps_2x_durations = None
+    return eps_durations, eps_2x_durations
+
+
+def Redetect(args):
+    """
+    Implements command line 'redetect' arg
 
-            et.SubElement(job, 'Source').text = cfg['src_folder']
-            et.SubElement(job, 'Destination').text = cfg['destination']
+    Replays episode detection over the archived scan output of a control file, once per combination
+    of the swept parameters, and reports how each combination classifies the titles.
+    """
+    import batch_classify
+    from eps_detector import EpisodeDetector, ParseDvdFolderName
+    from hbscan import ParseHBOutput
+    from scan_archive import ArchiveFilename, ScanArchive
+
+    archive_filename = args.archive[0]
+    if not archive_filename.endswith('.zip'):
+        archive_filename = ArchiveFilename(archive_filename)
+
+    # Each parameter accepts several values, every combination of them is evaluated
+    eps_duration_options = list()
+    for value in args.eps_duration:
+        if value == 'auto':
+            eps_duration_options.append(value)
+        else:
+            eps_duration_options.append(value.split(','))
+    title_min_durations = [GetInSeconds(x) for x in args.title_min_duration]
+    sweep = {'remove': (True,), 'keep': (False,), 'both': (True, False)}
+    combos = list(product(eps_duration_options, title_min_durations,
+                          sweep[args.dup_titles], sweep[args.virtual_titles]))
 
+    # Parse every archived scan once, each combination works on its own copy
+    discs = list()
+    with ScanArchive(archive_filename) as archive:
+        for folder, raw in archive.Items():
+            series, season, disc = ParseDvdFolderName(folder)
+            with metrics.Timer('parse'):
+                discs.append((ParseHBOutput(raw), folder, series, season))
+    logger.info('Replaying %d archived scans from "%s" with %d parameter combinations%s',
+                len(discs), archive_filename, len(combos),
+                '' if batch_classify.Available() else ' (NumPy not installed, classifying one title at a time)')
 
-    txt = et.tostring(root)
-    ugly_xml = parseString(txt).toprettyxml(indent="  ")
-    text_re = re.compile('>\n\s+([^<>\s].*?)\n\s+</', re.DOTALL)
-    pretty_xml = text_re.sub('>\g<1></', ugly_xml)
-    (base, ext) = os.path.splitext(os.path.basename(xml_filename))
-    fid = open(base + '.queue', 'w')
+    report = list()
+    # The per-title detection logging would swamp the report
+    detector_loggers = [logging.getLogger(x) for x in ('eps_detector', 'batch_classify', 'duration_cluster',
+                                                       'track_policy')]
+    detector_levels = [x.level for x in detector_loggers]
+    for detector_logger, detector_level in zip(detector_loggers, detector_levels):
+        detector_logger.setLevel(max(detector_level, logging.WARNING))
     try:
-        fid.write(pretty_xml)
+        with metrics.Timer('redetect'):
+            for eps_duration, title_min_duration, remove_dup_titles, remove_virtual_titles in combos:
+                auto_eps_duration = eps_duration == 'auto'
+                if auto_eps_duration:
+                    eps_durations, eps_2x_durations = GetEpisodeDurations(args.fallback_eps_duration,
+                                                                          args.expect_2x_duration)
+                else:
+                    eps_durations, eps_2x_durations = GetEpisodeDurations(eps_duration, args.expect_2x_duration)
+                episodes = EpisodeDetector(args.eps_start_num, args.extras_start_num, remove_dup_titles,
+                                           remove_virtual_titles, title_min_duration,
+                                           eps_durations, eps_2x_durations, True, auto_eps_duration,
+                                           batch=batch_classify.Available(),
+                                           split_chapters=args.split_chapters)
+                for dvd, folder, series, season in discs:
+                    episodes.ProcessDvd(copy.deepcopy(dvd), folder, series, season)
+                episodes.Finish()
+
+                counts = collections.Counter()
+                for dvd in episodes.dvds:
+                    for title in dvd.titles:
+                        if not title.enabled:
+                            counts['rejected'] += 1
+                            counts['rejected ' + title.eps_type] += 1
+                        elif title.eps_type == 'episode':
+                            counts['episode titles'] += 1
+                            counts['episodes'] += title.eps_end_num - title.eps_start_num + 1
+                        else:
+                            counts['extras'] += 1
+                report.append((dict(eps_duration=eps_duration if auto_eps_duration else ','.join(eps_duration),
+                                    title_min_duration=GetInHMS(title_min_duration),
+                                    dup_titles='remove' if remove_dup_titles else 'keep',
+                                    virtual_titles='remove' if remove_virtual_titles else 'keep'),
+                               counts))
     finally:
-        fid.close()
-
-
-
-
-logging_conf = """
-version: 1
-formatters:
-    simple:
-        format: "%(asctime)s - %(levelname)5s - %(message)s"
-    precise:
-        format: "%(asctime)s - %(levelname)5s - %(module)s:%(lineno)03d[%(funcName)s()] - %(message)s"
-handlers:
-    console:
-        class: logging.StreamHandler
-        level: INFO
-        formatter: simple
-        stream: ext://sys.stdout
-    info_file:
-        class: logging.FileHandler
-        level: INFO
-        filename: hbq_info.log
-        formatter: simple
-    debug_file:
-        class: logging.FileHandler
-        level: DEBUG
-        filename: hbq_debug.log
-        formatter: precise
-loggers:
-    hbq:
-        level: DEBUG
-        handlers: [console, info_file, debug_file]
-    eps_detector:
-        level: DEBUG
-        handlers: [console, info_file, debug_file]
-"""
-"""
-root:
-    level: DEBUG
-    handlers: [console, info_file, debug_file]
-"""
+        for detector_logger, detector_level in zip(detector_loggers, detector_levels):
+            detector_logger.setLevel(detector_level)
+
+    columns = ('eps_duration', 'title_min_duration', 'dup_titles', 'virtual_titles',
+               'episodes', 'episode titles', 'extras', 'rejected',
+               'rejected duplicate', 'rejected too short', 'rejected virtual', 'rejected split')
+    rows = [[params.get(x, counts[x]) for x in columns] for params, counts in report]
+    logger.info('%s', '  '.join('{:>18}'.format(x) for x in columns))
+    for row in rows:
+        logger.info('%s', '  '.join('{:>18}'.format(x) for x in row))
+    if args.report_filename:
+        f = open(args.report_filename[0], 'wb')
+        try:
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            writer.writerows(rows)
+        finally:
+            f.close()
+
+
+def BuildQueue(args):
+    """
+    Implements command line 'build' arg
+
+    Reads every control file (in parallel when there are several) and writes a single queue,
+    with globally numbered jobs and no two jobs writing the same destination.  An existing queue
+    file is diffed against the jobs by destination: its jobs keep their IDs and statuses and only
+    new jobs are appended, so a queue the GUI is working through can be extended.
+    """
+    import multiprocessing
+    from dvdinfo import ReadDvdListFromXML
+    from encode_profiles import LoadProfiles
+    from hbqueue import AppendJobs, AppendToQueue, DeduplicateJobs, MakeJobs, NewQueue, WriteQueue
+
+    control_files = args.control_file
+    profiles = LoadProfiles(args.profiles_filename)
+    with metrics.Timer('xml_read'):
+        num_processes = min(args.num_processes or multiprocessing.cpu_count(), len(control_files))
+        if num_processes > 1:
+            pool = multiprocessing.Pool(num_processes)
+            try:
+                dvd_lists = pool.map(ReadDvdListFromXML, control_files)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            dvd_lists = [ReadDvdListFromXML(x) for x in control_files]
+
+    with metrics.Timer('queue_generation'):
+        jobs = list()
+        for xml_filename, dvds in zip(control_files, dvd_lists):
+            for cfg in MakeJobs(dvds, args.dst_folder[0], profiles, args.make_output_folders):
+                cfg['control_file'] = xml_filename
+                jobs.append(cfg)
+        unique_jobs = DeduplicateJobs(jobs)
+        if args.shared_queue:
+            for job_num, cfg in enumerate(unique_jobs, 1):
+                cfg['id'] = job_num
+            from shared_queue import SharedQueue
+            SharedQueue(args.shared_queue).Publish(unique_jobs)
+            return
+        if args.queue_filename:
+            queue_filename = args.queue_filename[0]
+        else:
+            queue_filename = os.path.splitext(control_files[0])[0] + '.queue'
+        if os.path.exists(queue_filename) and not args.rebuild_queue:
+            diff = AppendToQueue(queue_filename, unique_jobs, args.make_1st_gen_queue)
+            logger.info('Added %d jobs to "%s": %d unchanged, %d changed, %d no longer generated, '
+                        '%d duplicate or conflicting jobs dropped', len(diff.added), queue_filename,
+                        len(diff.unchanged), len(diff.changed), len(diff.missing), len(jobs) - len(unique_jobs))
+        else:
+            root = NewQueue(args.make_1st_gen_queue)
+            AppendJobs(root, unique_jobs)
+            WriteQueue(root, queue_filename)
+            logger.info('Wrote %d jobs from %d control files to "%s" (%d duplicate or conflicting jobs dropped)',
+                        len(unique_jobs), len(control_files), queue_filename, len(jobs) - len(unique_jobs))
+
+
+def RunWorker(args):
+    """
+    Implements command line 'worker' arg
+
+    Claims jobs from the shared queue directory and encodes them until stopped, one at a time
+    or with the number of concurrent jobs tuned between --min-workers and --max-workers.
+    """
+    from hbscan import TRANSCODER
+    from shared_queue import SharedQueue, Worker
+
+    queue = SharedQueue(args.shared_queue[0])
+    if args.max_workers > 1 or args.nice is not None or args.affinity:
+        from autotune import AutotuneWorker, ConcurrencyTuner
+        tuner = ConcurrencyTuner(args.min_workers, max(args.min_workers, args.max_workers),
+                                 args.tune_window, max_cpu=args.max_cpu, hold=args.tune_hold)
+        worker = AutotuneWorker(queue, args.transcoder or TRANSCODER, tuner, args.worker_id, args.lease_timeout,
+                                args.heartbeat_interval, args.poll_interval, args.sample_interval,
+                                args.nice, args.affinity)
+    else:
+        worker = Worker(queue, args.transcoder or TRANSCODER, args.worker_id, args.lease_timeout,
+                        args.heartbeat_interval, args.poll_interval)
+    worker.Run(args.max_jobs, args.exit_when_empty)
+    logger.info('Shared queue "%s": %s', queue.root,
+                ', '.join('{} {:d}'.format(k, v) for k, v in sorted(queue.Counts().items())))
+
+
+def VerifyQueue(args):
+    """
+    Implements command line 'verify' arg
+
+    Probes the destination of every job in the queue and compares its duration and track counts
+    with the title in the control files.  Jobs with a missing or mismatched output are written
+    to a new queue file for re-encoding.  Returns 1 (the exit status) when there are any, so the
+    check can gate scripts.
+    """
+    import multiprocessing
+    from dvdinfo import ReadDvdListFromXML
+    from hbqueue import GetJobElements, ReadQueue, WriteQueue
+    from hbscan import TRANSCODER
+    from verify_queue import IndexTitles, MakeRequeue, QueueVerifier
+
+    queue_filename = args.queue_filename[0]
+    queue_root = ReadQueue(queue_filename)
+    titles = dict()
+    with metrics.Timer('xml_read'):
+        for xml_filename in args.control_file:
+            titles.update(IndexTitles(ReadDvdListFromXML(xml_filename)))
+
+    verifier = QueueVerifier(titles, args.transcoder or TRANSCODER, GetInSeconds(args.duration_tolerance),
+                             args.num_threads or multiprocessing.cpu_count())
+    results = verifier.Verify(GetJobElements(queue_root))
+
+    counts = collections.Counter(x.status for x in results)
+    for result in results:
+        if result.status != 'ok':
+            logger.warning('Job %s %s: "%s" (%s)', result.job_id, result.status.upper(), result.destination,
+                           '; '.join(result.problems))
+    logger.info('Verified %d jobs: %s', len(results),
+                ', '.join('{} {:d}'.format(x, counts[x]) for x in ('ok', 'failed', 'missing', 'unknown')))
+
+    if args.report_filename:
+        f = open(args.report_filename[0], 'wb')
+        try:
+            writer = csv.writer(f)
+            writer.writerow(('id', 'status', 'source', 'title', 'destination', 'problems'))
+            for result in results:
+                writer.writerow((result.job_id, result.status, result.source, result.title_num,
+                                 result.destination, '; '.join(result.problems)))
+        finally:
+            f.close()
+
+    requeue_root = MakeRequeue(queue_root, results)
+    if len(requeue_root):
+        if args.requeue_filename:
+            requeue_filename = args.requeue_filename[0]
+        else:
+            requeue_filename = os.path.splitext(queue_filename)[0] + '_requeue.queue'
+        WriteQueue(requeue_root, requeue_filename)
+        logger.info('Wrote %d jobs to re-queue to "%s"', len(requeue_root), requeue_filename)
+        return 1
+    return 0
+
+
+# The handlers of hbq_logging_default.yaml, kept as a dict so startup does not need a YAML parse
+LOGGED_MODULES = ('hbq', 'eps_detector', 'hbscan', 'batch_classify', 'duration_cluster', 'track_policy',
+                  'encode_profiles', 'hbqueue', 'scan_archive', 'verify_queue', 'shared_queue', 'autotune',
+                  'profiling', 'metrics')
+logging_conf = {
+    'version': 1,
+    'formatters': {
+        'simple': {
+            'format': '%(asctime)s - %(levelname)5s - %(message)s'},
+        'precise': {
+            'format': '%(asctime)s - %(levelname)5s - %(module)s:%(lineno)03d[%(funcName)s()] - %(message)s'}},
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'level': 'INFO',
+            'formatter': 'simple',
+            'stream': 'ext://sys.stdout'},
+        'info_file': {
+            'class': 'logging.FileHandler',
+            'level': 'INFO',
+            'filename': 'hbq_info.log',
+            'formatter': 'simple'},
+        'debug_file': {
+            'class': 'logging.FileHandler',
+            'level': 'DEBUG',
+            'filename': 'hbq_debug.log',
+            'formatter': 'precise'}},
+    'loggers': dict((name, {'level': 'DEBUG', 'handlers': ['console', 'info_file', 'debug_file']})
+                    for name in LOGGED_MODULES),
+}
 
 def main():
     args = ParseArguments()
 
-    logging_dict = yaml.load(logging_conf)
-    logging.config.dictConfig(logging_dict)
+    ConfigureLogging(copy.deepcopy(logging_conf), args.log_level)
+
+    if args.profile:
+        from profiling import RunProfiled
+        status = RunProfiled(args.command, args, args.profile, args.profile_output,
+                             interval=args.profile_interval / 1000.0)
+    else:
+        status = args.command(args)
 
-    args.command(args)
+    if args.metrics_file:
+        metrics.registry.WriteFiles(args.metrics_file)
+    return status
 
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
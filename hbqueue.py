@@ -0,0 +1,260 @@
+"""hbqueue.py - Builds HandBrake GUI queue jobs from DvdInfo instances and reads/writes queue files"""
+from collections import namedtuple
+import logging
+import os
+import os.path
+import re
+import sys
+import xml.etree.ElementTree as et
+
+from dvdinfo import DvdInfo, Title
+import metrics
+
+logger = logging.getLogger('hbqueue')
+
+# added: job settings not in the queue yet, changed: (element, job settings) of queued jobs for the
+# same destination with another source or query, unchanged: elements matching their job settings,
+# missing: elements no job settings were generated for
+QueueDiff = namedtuple('QueueDiff', 'added, changed, unchanged, missing')
+
+
+def MakeJob(dvd, title, dst_root_folder, profiles, make_output_folders=False):
+    """Returns the job settings (a dict) for encoding title from dvd with the profile selected from profiles"""
+    assert(isinstance(dvd, DvdInfo))
+    assert(isinstance(title, Title))
+    profile = profiles.Select(dvd, title)
+    cfg = {}
+    cfg['profile'] = profile.name
+    cfg['tier'] = profile.tier
+    cfg['title_num'] = title.num
+    if title.chapter_start is not None:
+        cfg['chapter_range'] = '{:d}-{:d}'.format(title.chapter_start, title.chapter_end)
+        cfg['chapters'] = ' -c ' + cfg['chapter_range']
+    else:
+        cfg['chapter_range'] = ''
+        cfg['chapters'] = ''
+    cfg['src_folder'] = dvd.folder
+    if title.eps_type == 'episode':
+        eps_num_str = ''.join(['E{:02d}'.format(x) for x in
+                               range(title.eps_start_num, title.eps_end_num + 1)])
+    elif title.eps_type == 'extra':
+        eps_num_str = 'Extras{:02d}'.format(title.eps_start_num)
+    else:
+        raise Exception('eps_type must be "episode" or "extra" (had "{}")'.format(title.eps_type))
+    dest_folder = os.path.join(dst_root_folder,
+                               dvd.series,
+                               'Season {:d}'.format(dvd.season))
+
+    if make_output_folders and not os.path.isdir(dest_folder):
+        logger.debug('Creating folder "%s"', dest_folder)
+        os.makedirs(dest_folder)
+    cfg['destination'] = '{0} S{1:02d}{2}.mkv'.format(os.path.join(dest_folder, dvd.series),
+                                                      dvd.season,
+                                                      eps_num_str)
+    cfg['fps'] = title.fps
+    cfg['audio_tracks'] = ','.join([str(track.num) for track in title.audio_tracks if track.enabled])
+    cfg['audio_encoders'] = ','.join([profile.audio_encoder for track in title.audio_tracks if track.enabled])
+    enabled_subtitles = [track.num for track in title.subtitle_tracks if track.enabled]
+    cfg['subtitles'] = ",".join([str(x) for x in enabled_subtitles])
+    if title.default_subtitle_track:
+        # The value is based on the 'subtitles' idx, not the value in track.num
+        cfg['default_subtitle'] = str(enabled_subtitles.index(title.default_subtitle_track) + 1)
+    elif cfg['subtitles']:
+        # There is at least 1 subtitle enabled
+        cfg['default_subtitle'] = '1'
+    else:
+        cfg['default_subtitle'] = ''
+    if title.combing_detected:
+        cfg['detelecine'] = '--detelecine'
+    else:
+        cfg['detelecine'] = ''
+    cfg['query'] = profile.FormatQuery(cfg)
+    return cfg
+
+
+def MakeJobs(dvds, dst_root_folder, profiles, make_output_folders=False):
+    """Returns the list of jobs for every enabled title in dvds"""
+    jobs = list()
+    for dvd in dvds:
+        for title in dvd.titles:
+            if title.enabled:
+                cfg = MakeJob(dvd, title, dst_root_folder, profiles, make_output_folders)
+                jobs.append(cfg)
+                metrics.Increment('jobs_generated', profile=cfg['profile'], tier=cfg['tier'])
+    return jobs
+
+
+def DeduplicateJobs(jobs):
+    """
+    Returns jobs without those targeting a destination already used by an earlier job.
+    Identical jobs are dropped quietly, different sources for the same destination are reported.
+    """
+    unique_jobs = list()
+    by_destination = dict()
+    for cfg in jobs:
+        key = os.path.normcase(os.path.normpath(cfg['destination']))
+        kept = by_destination.get(key)
+        if kept is None:
+            by_destination[key] = cfg
+            unique_jobs.append(cfg)
+        elif (os.path.normcase(kept['src_folder']) == os.path.normcase(cfg['src_folder']) and
+              kept['title_num'] == cfg['title_num'] and kept['chapter_range'] == cfg['chapter_range']):
+            logger.debug('Dropped duplicate job for "%s"', cfg['destination'])
+            metrics.Increment('jobs_deduplicated')
+        else:
+            logger.warning('Conflicting jobs for "%s": kept title %d of "%s" (%s), '
+                           'dropped title %d of "%s" (%s)', cfg['destination'],
+                           kept['title_num'], kept['src_folder'], kept.get('control_file', '?'),
+                           cfg['title_num'], cfg['src_folder'], cfg.get('control_file', '?'))
+            metrics.Increment('job_conflicts')
+    return unique_jobs
+
+
+def NewQueue(make_1st_gen_queue=False):
+    """Returns an empty queue root element"""
+    if make_1st_gen_queue:
+        return et.Element('ArrayOfJob')
+    return et.Element('ArrayOfQueueTask')
+
+
+def AddJobElement(root, job_id, cfg):
+    """Appends a Job/QueueTask element for cfg to the queue root element"""
+    make_1st_gen_queue = root.tag == 'ArrayOfJob'
+    if make_1st_gen_queue:
+        job = et.SubElement(root, 'Job')
+    else:
+        job = et.SubElement(root, 'QueueTask')
+    et.SubElement(job, 'Id').text = format(job_id)
+    et.SubElement(job, 'Title').text = '{:d}'.format(cfg['title_num'])
+    et.SubElement(job, 'Query').text = cfg['query']
+    if make_1st_gen_queue:
+        et.SubElement(job, 'CustomQuery').text = 'false'
+    else:
+        et.SubElement(job, 'CustomQuery').text = 'true'
+        et.SubElement(job, 'Status').text = 'Waiting'
+
+    et.SubElement(job, 'Source').text = cfg['src_folder']
+    et.SubElement(job, 'Destination').text = cfg['destination']
+    # Not used by the GUI, records which encode profile (and its tier) produced the query
+    et.SubElement(job, 'Profile', tier=cfg['tier']).text = cfg['profile']
+    if cfg['chapter_range']:
+        # Not used by the GUI either, the chapters of a split title (the query has them as -c)
+        et.SubElement(job, 'Chapters').text = cfg['chapter_range']
+    return job
+
+
+def GetJobElements(root):
+    """Returns the Job/QueueTask elements of a queue root element"""
+    return list(root)
+
+
+def ReadQueue(filename):
+    """Returns the root element of an existing queue file"""
+    root = et.parse(filename).getroot()
+    if root.tag not in ('ArrayOfJob', 'ArrayOfQueueTask'):
+        raise ValueError('"{}" is not a HandBrake queue file (root is <{}>)'.format(filename, root.tag))
+    return root
+
+
+def _ReplaceFile(src, dst):
+    """Renames src over dst in one step, so readers see either the old or the new dst"""
+    if os.name == 'nt':
+        import ctypes
+        MOVEFILE_REPLACE_EXISTING = 0x1
+        MOVEFILE_WRITE_THROUGH = 0x8
+        (src, dst) = [x if isinstance(x, type(u'')) else x.decode(sys.getfilesystemencoding())
+                      for x in (src, dst)]
+        if not ctypes.windll.kernel32.MoveFileExW(src, dst, MOVEFILE_REPLACE_EXISTING | MOVEFILE_WRITE_THROUGH):
+            raise ctypes.WinError()
+    else:
+        os.rename(src, dst)
+
+
+def WriteQueue(root, filename):
+    """Writes the queue root element to filename, through a temporary file renamed over it"""
+    from xml.dom.minidom import parseString
+    # Drop the whitespace left from reading a pretty printed queue, toprettyxml adds its own
+    for elem in root.iter():
+        if elem.text is not None and not elem.text.strip():
+            elem.text = None
+        elem.tail = None
+    txt = et.tostring(root)
+    ugly_xml = parseString(txt).toprettyxml(indent="  ")
+    text_re = re.compile('>\n\s+([^<>\s].*?)\n\s+</', re.DOTALL)
+    pretty_xml = text_re.sub('>\g<1></', ugly_xml)
+    # Next to filename so the rename stays on one file system
+    tmp_filename = '{}.{:d}.tmp'.format(filename, os.getpid())
+    try:
+        fid = open(tmp_filename, 'w')
+        try:
+            fid.write(pretty_xml)
+            fid.flush()
+            os.fsync(fid.fileno())
+        finally:
+            fid.close()
+        _ReplaceFile(tmp_filename, filename)
+    except Exception:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        raise
+
+
+def _DestinationKey(destination):
+    return os.path.normcase(os.path.normpath(destination))
+
+
+def DiffQueue(root, jobs):
+    """Returns the QueueDiff of the job settings in jobs against the jobs of a queue root element, by destination"""
+    queued = dict()
+    for elem in GetJobElements(root):
+        queued.setdefault(_DestinationKey(elem.findtext('Destination', '')), elem)
+    added = list()
+    changed = list()
+    unchanged = list()
+    for cfg in jobs:
+        elem = queued.pop(_DestinationKey(cfg['destination']), None)
+        if elem is None:
+            added.append(cfg)
+        elif (os.path.normcase(elem.findtext('Source', '')) == os.path.normcase(cfg['src_folder']) and
+              elem.findtext('Title') == '{:d}'.format(cfg['title_num']) and
+              elem.findtext('Chapters', '') == cfg['chapter_range'] and
+              elem.findtext('Query') == cfg['query']):
+            unchanged.append(elem)
+        else:
+            changed.append((elem, cfg))
+    missing = [x for x in GetJobElements(root) if _DestinationKey(x.findtext('Destination', '')) in queued]
+    return QueueDiff(added, changed, unchanged, missing)
+
+
+def AppendJobs(root, jobs):
+    """Appends jobs to the queue root element, numbering them after the existing jobs"""
+    job_ids = [int(x.findtext('Id', '0')) for x in GetJobElements(root)]
+    next_id = max(job_ids or [0]) + 1
+    for cfg in jobs:
+        AddJobElement(root, next_id, cfg)
+        next_id += 1
+
+
+def AppendToQueue(filename, jobs, make_1st_gen_queue=False):
+    """
+    Appends the jobs whose destination is not in the queue file yet (creating the file if needed),
+    numbering them after the existing jobs.  Returns the QueueDiff of jobs against the queue.
+    """
+    if os.path.exists(filename):
+        root = ReadQueue(filename)
+        if (root.tag == 'ArrayOfJob') != make_1st_gen_queue:
+            logger.warning('"%s" is a %s generation queue, adding jobs in that format', filename,
+                           '1st' if root.tag == 'ArrayOfJob' else '2nd')
+    else:
+        root = NewQueue(make_1st_gen_queue)
+    diff = DiffQueue(root, jobs)
+    for elem, cfg in diff.changed:
+        logger.warning('Job %s (%s) for "%s" differs from the control files, left unchanged',
+                       elem.findtext('Id'), elem.findtext('Status', 'queued'), cfg['destination'])
+    if diff.changed:
+        metrics.Increment('queue_jobs_changed', len(diff.changed))
+    # With nothing to append the file (and any GUI holding it open) is left alone
+    if diff.added or not os.path.exists(filename):
+        AppendJobs(root, diff.added)
+        WriteQueue(root, filename)
+    return diff
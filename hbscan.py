@@ -1,11 +1,16 @@
 """hbscan.py - Routines for calling HandBrakeCLI executable and parsing the resulting output into DvdInfo instance"""
+import hashlib
 import re
+import os
 import subprocess
 import time
 import logging
 from cStringIO import StringIO
+from multiprocessing.pool import ThreadPool
 
 from dvdinfo import DvdInfo, Title, SubtitleTrack, AudioTrack, Chapter
+import ifo_reader
+import metrics
 
 logger = logging.getLogger('hbscan')    
 
@@ -21,6 +26,10 @@ class ParseException(Exception):
     pass
 
 
+class ScanError(Exception):
+    pass
+
+
 STATES = enum('ReadLine', 'Scanning', 
               'TitleStart', 'InTitle', 'TitleEnd', 
               'ChaptersStart', 'InChapters', 'ChaptersEnd', 
@@ -29,18 +38,222 @@ STATES = enum('ReadLine', 'Scanning',
               'Done')
     
 
-def ScanDvd(folder):
-    """Returns a string containing the output from calling HandBrakeCLI on a folder"""
-    logger.info('****** Scanning folder ****** %s', folder)
-    cmd = ['{}'.format(TRANSCODER), '-i', '{}'.format(folder), '-t', '0']
+def _RunHandBrakeCLI(path, transcoder, extra_args=()):
+    """Returns (output, seconds) of HandBrakeCLI scanning every title of path"""
+    cmd = ['{}'.format(transcoder), '-i', '{}'.format(path), '-t', '0'] + list(extra_args)
     scan_start = time.time()
-    scanning = subprocess.Popen(cmd, executable=TRANSCODER, shell=False, 
-                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-    (stdout, stderr) = scanning.communicate()
-    logger.info('Scan took %.3f seconds', time.time() - scan_start)
+    # Wall time with any HandBrakeCLI running, scans in several threads overlap
+    with metrics.BusyTimer('hb_wait'):
+        scanning = subprocess.Popen(cmd, executable=transcoder, shell=False, 
+                                    stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        (stdout, stderr) = scanning.communicate()
     assert isinstance(stdout, str)
+    return stdout, time.time() - scan_start
+
+
+def ScanDvd(folder, transcoder=TRANSCODER, extra_args=()):
+    """Returns a string containing the output from calling HandBrakeCLI on a folder"""
+    logger.info('****** Scanning folder ****** %s', folder)
+    stdout, scan_time = _RunHandBrakeCLI(folder, transcoder, extra_args)
+    logger.info('Scan took %.3f seconds', scan_time)
+    metrics.AddTime('hb_scan', scan_time)
+    metrics.Increment('discs_scanned')
+    metrics.Increment('scan_output_bytes', len(stdout))
     return stdout
-    
+
+
+def ProbeFile(filename, transcoder=TRANSCODER):
+    """Returns the HandBrakeCLI scan output of an encoded file, timed apart from the DVD scans"""
+    logger.info('Probing %s', filename)
+    stdout, probe_time = _RunHandBrakeCLI(filename, transcoder)
+    logger.debug('Probe took %.3f seconds', probe_time)
+    metrics.AddTime('verify_probe', probe_time)
+    metrics.Increment('outputs_probed')
+    return stdout
+
+
+class Scanner(object):
+    """
+    Produces HandBrakeCLI style scan output (see ParseHBOutput) for DVD folders.
+    Subclasses implement Scan, ScanMany scans a batch of folders up to num_threads at a time.
+    """
+    def __init__(self, num_threads=1):
+        self.num_threads = num_threads
+        self.pool = None
+        # True while a threaded ScanMany batch has not been read to the end
+        self.batch_open = False
+
+    def Scan(self, folder):
+        """Returns the scan output of one folder"""
+        raise NotImplementedError
+
+    def _ScanPair(self, folder):
+        return folder, self.Scan(folder)
+
+    def ScanMany(self, folders):
+        """Yields (folder, scan output) for each of folders in order, as soon as each scan is done"""
+        folders = list(folders)
+        if self.num_threads <= 1 or len(folders) <= 1:
+            for folder in folders:
+                yield self._ScanPair(folder)
+            return
+        if self.pool is None:
+            # Kept until Close, the same threads scan every batch
+            self.pool = ThreadPool(self.num_threads)
+        self.batch_open = True
+        for pair in self.pool.imap(self._ScanPair, folders):
+            yield pair
+        self.batch_open = False
+
+    def Close(self):
+        """Stops the scanning threads, dropping the queued scans of a batch that was not read to the end"""
+        if self.pool is not None:
+            if self.batch_open:
+                # Processing the scans failed part way, only the scans already running are waited for
+                self.pool.terminate()
+                self.batch_open = False
+            else:
+                self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+
+class HandBrakeScanner(Scanner):
+    """
+    Scans with HandBrakeCLI, one process per disc.  HandBrakeCLI scans a single source per
+    process and cannot be kept running, so batches overlap num_threads processes instead.
+    """
+    def __init__(self, transcoder=TRANSCODER, extra_args=(), num_threads=1):
+        Scanner.__init__(self, num_threads)
+        self.transcoder = transcoder
+        self.extra_args = tuple(extra_args)
+
+    def Scan(self, folder):
+        return ScanDvd(folder, self.transcoder, self.extra_args)
+
+
+class IfoScanner(Scanner):
+    """
+    Reads the IFO files of a disc directly (see ifo_reader), no transcoder process is started.
+    The frame rate is the nominal NTSC/PAL rate, HandBrakeCLI reports 23.976 fps for film
+    content, and combing is never detected.
+    """
+    def Scan(self, folder):
+        logger.info('****** Reading IFO files ****** %s', folder)
+        scan_start = time.time()
+        try:
+            raw = ifo_reader.RenderHBOutput(ifo_reader.ReadDvd(folder))
+        except (ifo_reader.IfoError, EnvironmentError) as e:
+            raise ScanError('Unable to read the IFO files of "{}": {}'.format(folder, e))
+        scan_time = time.time() - scan_start
+        metrics.AddTime('ifo_scan', scan_time)
+        metrics.Increment('discs_scanned')
+        metrics.Increment('scan_output_bytes', len(raw))
+        return raw
+
+
+class LookupScanner(Scanner):
+    """
+    Returns stored scan output where Lookup finds it, scanning the other folders with scanner
+    (in one ScanMany batch) and passing their output to Store.
+    """
+    def __init__(self, scanner=None):
+        Scanner.__init__(self)
+        self.scanner = scanner
+
+    def Lookup(self, folder):
+        """Returns the stored scan output of folder or None"""
+        raise NotImplementedError
+
+    def Store(self, folder, raw):
+        pass
+
+    def Scan(self, folder):
+        return next(self.ScanMany([folder]))[1]
+
+    def ScanMany(self, folders):
+        found = dict()
+        missing = list()
+        for folder in folders:
+            raw = self.Lookup(folder)
+            if raw is None:
+                if self.scanner is None:
+                    raise ScanError('No stored scan of "{}"'.format(folder))
+                missing.append(folder)
+            else:
+                found[folder] = raw
+        if found:
+            metrics.Increment('scans_found', len(found))
+        scans = self.scanner.ScanMany(missing) if missing else iter(())
+        for folder in folders:
+            if folder in found:
+                yield folder, found[folder]
+            else:
+                scanned_folder, raw = next(scans)
+                self.Store(scanned_folder, raw)
+                yield scanned_folder, raw
+
+    def Close(self):
+        if self.scanner is not None:
+            self.scanner.Close()
+
+
+class CachedScanner(LookupScanner):
+    """
+    Keeps the output of scanner in cache_folder, one file per disc named after key(folder),
+    e.g. eps_detector.DvdFolderSignature.  A folder whose key is None is always scanned.
+    """
+    def __init__(self, scanner, cache_folder, key):
+        LookupScanner.__init__(self, scanner)
+        self.cache_folder = cache_folder
+        self.key = key
+        if not os.path.isdir(cache_folder):
+            os.makedirs(cache_folder)
+
+    def CacheFilename(self, folder):
+        key = self.key(folder)
+        if key is None:
+            return None
+        name = hashlib.md5(os.path.normcase(os.path.abspath(folder)).encode('utf-8')).hexdigest()[:12]
+        return os.path.join(self.cache_folder, '{}_{}.txt'.format(name, key))
+
+    def Lookup(self, folder):
+        filename = self.CacheFilename(folder)
+        if filename is None or not os.path.exists(filename):
+            return None
+        logger.info('Using cached scan of %s', folder)
+        with open(filename, 'rb') as f:
+            return f.read()
+
+    def Store(self, folder, raw):
+        filename = self.CacheFilename(folder)
+        if filename is None:
+            return
+        tmp_filename = '{}.{:d}.tmp'.format(filename, os.getpid())
+        with open(tmp_filename, 'wb') as f:
+            f.write(raw)
+        if os.path.exists(filename):
+            # Another process cached the same disc meanwhile
+            os.remove(tmp_filename)
+        else:
+            os.rename(tmp_filename, filename)
+
+
+class ReplayScanner(LookupScanner):
+    """
+    Replays the scan output recorded in a ScanArchive.  Folders missing from the archive are
+    scanned with scanner, or raise ScanError if there is none.
+    """
+    def __init__(self, archive, scanner=None):
+        LookupScanner.__init__(self, scanner)
+        self.archive = archive
+
+    def Lookup(self, folder):
+        raw = self.archive.Get(folder)
+        if raw is not None:
+            logger.info('Replaying scan of %s', folder)
+        return raw
+
 
 def ParseHBOutput(src):
     """Parses the output from HandBrakeCLI executable into a DvdInfo instance"""
@@ -197,9 +410,9 @@ def ParseHBOutput(src):
                 elif match2:
                     # Try alternate HB format
                     track = AudioTrack(
-                        num=int(match1.group(1)), 
-                        desc=match1.group(2), 
-                        lang=match1.group(3), 
+                        num=int(match2.group(1)), 
+                        desc=match2.group(2), 
+                        lang=match2.group(3), 
                         sr=-1, 
                         rate=-1,
                         enabled=False)
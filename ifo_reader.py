@@ -0,0 +1,224 @@
+"""ifo_reader.py - Reads the title, chapter and track tables of a DVD from its IFO files
+
+Only the IFO files are read (a few KB per title set), no VOB data, so a disc is described in
+milliseconds instead of the seconds HandBrakeCLI needs to open and probe it.  RenderHBOutput
+formats the result like HandBrakeCLI's scan output, for hbscan.ParseHBOutput.
+"""
+import glob
+import os.path
+import struct
+
+SECTOR_SIZE = 2048
+
+# ISO 639-1 codes stored in the IFO -> (name, ISO 639-2 code) as HandBrakeCLI prints them
+LANGUAGES = {
+    'en': ('English', 'eng'), 'fr': ('Francais', 'fra'), 'es': ('Espanol', 'spa'),
+    'de': ('Deutsch', 'deu'), 'it': ('Italiano', 'ita'), 'nl': ('Nederlands', 'nld'),
+    'pt': ('Portugues', 'por'), 'sv': ('Svenska', 'swe'), 'da': ('Dansk', 'dan'),
+    'no': ('Norsk', 'nor'), 'fi': ('Suomi', 'fin'), 'ja': ('Japanese', 'jpn'),
+    'zh': ('Chinese', 'zho'), 'ko': ('Korean', 'kor'), 'ru': ('Russian', 'rus'),
+    'pl': ('Polski', 'pol'), 'cs': ('Cesky', 'ces'), 'hu': ('Magyar', 'hun'),
+    'el': ('Greek', 'ell'), 'he': ('Hebrew', 'heb'), 'tr': ('Turkce', 'tur'),
+}
+UNKNOWN_LANGUAGE = ('Unknown', 'und')
+
+AUDIO_CODINGS = {0: 'AC3', 2: 'MPEG1', 3: 'MPEG2', 4: 'LPCM', 6: 'DTS'}
+# Audio code extensions, described as HandBrakeCLI describes them
+AUDIO_EXTENSIONS = {2: ' (Visually Impaired)', 3: " (Director's Commentary 1)", 4: " (Director's Commentary 2)"}
+
+
+class IfoError(Exception):
+    pass
+
+
+class IfoTitle(object):
+    """A title from the VMG title table with what its title set says about it"""
+    def __init__(self, num, vts, ttn):
+        self.num = num
+        self.vts = vts
+        self.ttn = ttn
+        self.duration = 0
+        self.fps = None
+        self.size = None
+        self.pixel_aspect = None
+        self.display_aspect = None
+        # (first cell, last cell, blocks, duration) of each chapter, cells numbered from 0
+        self.chapters = list()
+        self.cells = list()
+        # (coding, channels, language code, extension description) of each audio stream used by the title
+        self.audio_streams = list()
+        # (language code, closed captions) of each subpicture stream used by the title
+        self.subtitle_streams = list()
+
+
+def _FindIfo(folder, name):
+    for pattern in (os.path.join(folder, 'VIDEO_TS', name), os.path.join(folder, name)):
+        matches = glob.glob(pattern) or glob.glob(pattern.lower())
+        if matches:
+            return matches[0]
+    raise IfoError('No {} in "{}"'.format(name, folder))
+
+
+def _ReadFile(filename):
+    f = open(filename, 'rb')
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+
+def _Bcd(value):
+    return (value >> 4) * 10 + (value & 0x0f)
+
+
+def _PlaybackTime(data, offset):
+    """Returns (seconds, frame rate) of the BCD playback time at offset"""
+    hours, minutes, seconds, frames = struct.unpack_from('>BBBB', data, offset)
+    rate = {1: 25.0, 3: 29.97}.get(frames >> 6)
+    fraction = _Bcd(frames & 0x3f) / rate if rate else 0.0
+    return _Bcd(hours) * 3600 + _Bcd(minutes) * 60 + _Bcd(seconds) + fraction, rate
+
+
+def _Language(data, offset):
+    code = data[offset:offset + 2]
+    if not isinstance(code, str):
+        code = code.decode('latin-1')
+    return code.strip('\0 ').lower()
+
+
+def ReadTitleTable(folder):
+    """Returns the IfoTitles listed in VIDEO_TS.IFO, numbered like HandBrakeCLI numbers titles"""
+    vmg = _ReadFile(_FindIfo(folder, 'VIDEO_TS.IFO'))
+    if vmg[:12] != b'DVDVIDEO-VMG':
+        raise IfoError('VIDEO_TS.IFO in "{}" is not a VMG IFO'.format(folder))
+    tt_srpt = struct.unpack_from('>I', vmg, 0xc4)[0] * SECTOR_SIZE
+    num_titles = struct.unpack_from('>H', vmg, tt_srpt)[0]
+    titles = list()
+    for i in range(num_titles):
+        vts, ttn = struct.unpack_from('>BB', vmg, tt_srpt + 8 + i * 12 + 6)
+        titles.append(IfoTitle(i + 1, vts, ttn))
+    return titles
+
+
+def ReadTitleSet(folder, vts, titles):
+    """Fills in the IfoTitles of title set vts from VTS_<vts>_0.IFO"""
+    data = _ReadFile(_FindIfo(folder, 'VTS_{:02d}_0.IFO'.format(vts)))
+    if data[:12] != b'DVDVIDEO-VTS':
+        raise IfoError('VTS_{:02d}_0.IFO in "{}" is not a VTS IFO'.format(vts, folder))
+    ptt_srpt = struct.unpack_from('>I', data, 0xc8)[0] * SECTOR_SIZE
+    pgcit = struct.unpack_from('>I', data, 0xcc)[0] * SECTOR_SIZE
+
+    video = struct.unpack_from('>H', data, 0x200)[0]
+    pal = (video >> 12) & 0x3 == 1
+    wide = (video >> 10) & 0x3 == 3
+    closed_captions = bool(video & 0xc0)
+    num_audio = min(8, struct.unpack_from('>H', data, 0x202)[0])
+    audio_attrs = list()
+    for i in range(num_audio):
+        coding, channels = struct.unpack_from('>BB', data, 0x204 + i * 8)
+        extension = struct.unpack_from('>B', data, 0x204 + i * 8 + 5)[0]
+        audio_attrs.append((AUDIO_CODINGS.get(coding >> 5, 'Unknown'), (channels & 0x7) + 1,
+                            _Language(data, 0x204 + i * 8 + 2), AUDIO_EXTENSIONS.get(extension, '')))
+    num_subpictures = min(32, struct.unpack_from('>H', data, 0x254)[0])
+    subpicture_languages = [_Language(data, 0x256 + i * 6 + 2) for i in range(num_subpictures)]
+
+    num_ttus, ptt_end = struct.unpack_from('>H2xI', data, ptt_srpt)
+    ttu_offsets = list(struct.unpack_from('>{:d}I'.format(num_ttus), data, ptt_srpt + 8)) + [ptt_end + 1]
+    num_pgcs = struct.unpack_from('>H', data, pgcit)[0]
+    pgc_offsets = [pgcit + struct.unpack_from('>I', data, pgcit + 8 + i * 8 + 4)[0] for i in range(num_pgcs)]
+
+    for title in titles:
+        if title.ttn > num_ttus:
+            raise IfoError('Title {:d} uses missing ttn {:d} of VTS {:d}'.format(title.num, title.ttn, vts))
+        start = ptt_srpt + ttu_offsets[title.ttn - 1]
+        end = ptt_srpt + ttu_offsets[title.ttn]
+        ptts = [struct.unpack_from('>HH', data, x) for x in range(start, end, 4)]
+        if not ptts:
+            continue
+        # Chapters outside the PGC of the first chapter (multi-PGC titles) are not described
+        pgcn = ptts[0][0]
+        pgc = pgc_offsets[pgcn - 1]
+        num_programs, num_cells = struct.unpack_from('>BB', data, pgc + 2)
+        title.duration, rate = _PlaybackTime(data, pgc + 4)
+        audio_control = struct.unpack_from('>8H', data, pgc + 0x0c)
+        subpicture_control = struct.unpack_from('>32I', data, pgc + 0x1c)
+        program_map, cell_playback = struct.unpack_from('>HH', data, pgc + 0xe6)
+        entry_cells = list(struct.unpack_from('>{:d}B'.format(num_programs), data, pgc + program_map))
+        for i in range(num_cells):
+            cell = pgc + cell_playback + i * 24
+            duration = _PlaybackTime(data, cell + 4)[0]
+            first_sector, last_sector = struct.unpack_from('>I8xI', data, cell + 8)
+            title.cells.append((last_sector - first_sector + 1, duration))
+
+        for pgcn_of_ptt, pgn in ptts:
+            if pgcn_of_ptt != pgcn or pgn > num_programs:
+                continue
+            first = entry_cells[pgn - 1] - 1
+            last = (entry_cells[pgn] - 1 if pgn < num_programs else num_cells) - 1
+            cells = title.cells[first:last + 1]
+            title.chapters.append((first, last, sum(x[0] for x in cells), sum(x[1] for x in cells)))
+
+        title.fps = '25.000' if pal or rate == 25.0 else '29.970'
+        title.size = '720x576' if pal else '720x480'
+        if pal:
+            title.pixel_aspect = '64/45' if wide else '16/15'
+        else:
+            title.pixel_aspect = '32/27' if wide else '8/9'
+        title.display_aspect = '1.78' if wide else '1.33'
+        for i, attrs in enumerate(audio_attrs):
+            if audio_control[i] & 0x8000:
+                title.audio_streams.append(attrs)
+        for i, lang in enumerate(subpicture_languages):
+            if subpicture_control[i] & 0x80000000:
+                title.subtitle_streams.append((lang, False))
+        if closed_captions:
+            title.subtitle_streams.append(('en', True))
+
+
+def ReadDvd(folder):
+    """Returns the IfoTitles of the DVD in folder"""
+    try:
+        titles = ReadTitleTable(folder)
+        for vts in sorted(set(x.vts for x in titles)):
+            ReadTitleSet(folder, vts, [x for x in titles if x.vts == vts])
+    except (struct.error, IndexError) as e:
+        raise IfoError('Truncated or corrupt IFO file in "{}": {}'.format(folder, e))
+    return titles
+
+
+def _HMS(seconds):
+    seconds = int(seconds)
+    return '{:02d}:{:02d}:{:02d}'.format(seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+def RenderHBOutput(titles):
+    """Returns HandBrakeCLI style scan output for titles"""
+    lines = ['[00:00:00] scan: DVD has {:d} title(s)'.format(len(titles))]
+    for title in titles:
+        lines.append('+ title {:d}:'.format(title.num))
+        lines.append('  + vts {:d}, ttn {:d}, cells 0->{:d} ({:d} blocks)'.format(
+            title.vts, title.ttn, max(0, len(title.cells) - 1), sum(x[0] for x in title.cells)))
+        lines.append('  + duration: ' + _HMS(title.duration))
+        if title.fps:
+            lines.append('  + size: {}, pixel aspect: {}, display aspect: {}, {} fps'.format(
+                title.size, title.pixel_aspect, title.display_aspect, title.fps))
+        lines.append('  + chapters:')
+        for num, (first, last, blocks, duration) in enumerate(title.chapters, 1):
+            lines.append('    + {:d}: cells {:d}->{:d}, {:d} blocks, duration {}'.format(
+                num, first, last, blocks, _HMS(duration)))
+        lines.append('  + audio tracks:')
+        for num, (coding, channels, lang, extension) in enumerate(title.audio_streams, 1):
+            name, code = LANGUAGES.get(lang, UNKNOWN_LANGUAGE)
+            # No bitrate in the IFO, this is the HandBrakeCLI format without rate information
+            layout = '{:d}.1'.format(channels - 1) if channels >= 6 else '{:d}.0'.format(channels)
+            lines.append('    + {:d}, {} ({}){} ({} ch) (iso639-2: {})'.format(num, name, coding, extension,
+                                                                           layout, code))
+        lines.append('  + subtitle tracks:')
+        for num, (lang, closed_captions) in enumerate(title.subtitle_streams, 1):
+            name, code = LANGUAGES.get(lang, UNKNOWN_LANGUAGE)
+            if closed_captions:
+                lines.append('    + {:d}, Closed Captions (iso639-2: {}) (Text)(CC)'.format(num, code))
+            else:
+                lines.append('    + {:d}, {} (iso639-2: {}) (Bitmap)(VOBSUB)'.format(num, name, code))
+    lines.append('HandBrake has exited.')
+    return '\n'.join(lines) + '\n'
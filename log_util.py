@@ -0,0 +1,108 @@
+"""log_util.py - Moves the configured logging handlers onto a background thread fed by a queue"""
+import atexit
+import logging
+import logging.config
+import threading
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    from logging.handlers import QueueHandler, QueueListener
+except ImportError:
+    # Python 2 does not ship these, provide the subset hbq needs
+    class QueueHandler(logging.Handler):
+        """Enqueues records instead of emitting them, so the caller never blocks on I/O"""
+        def __init__(self, q):
+            logging.Handler.__init__(self)
+            self.queue = q
+
+        def prepare(self, record):
+            # Render the message now, the args may be mutated before the listener gets to them
+            record.msg = record.getMessage()
+            record.args = None
+            return record
+
+        def emit(self, record):
+            try:
+                self.queue.put_nowait(self.prepare(record))
+            except Exception:
+                self.handleError(record)
+
+    class QueueListener(object):
+        """Hands records taken from a queue to the real handlers on a background thread"""
+        _sentinel = None
+
+        def __init__(self, q, *handlers, **kwargs):
+            self.queue = q
+            self.handlers = handlers
+            self.respect_handler_level = kwargs.get('respect_handler_level', False)
+            self._thread = None
+
+        def start(self):
+            self._thread = threading.Thread(target=self._monitor, name='hbq-logging')
+            self._thread.daemon = True
+            self._thread.start()
+
+        def handle(self, record):
+            for handler in self.handlers:
+                if not self.respect_handler_level or record.levelno >= handler.level:
+                    handler.handle(record)
+
+        def _monitor(self):
+            while True:
+                record = self.queue.get()
+                if record is self._sentinel:
+                    break
+                self.handle(record)
+
+        def stop(self):
+            self.queue.put_nowait(self._sentinel)
+            self._thread.join()
+            self._thread = None
+
+LOG_LEVELS = ('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL')
+
+_listener = None
+
+
+def ConfigureLogging(config, level=None):
+    """
+    Apply the dictConfig style config, then route every configured logger through a single
+    QueueHandler whose listener thread owns the real (file/console) handlers.
+    If level is given it overrides the level of every configured logger.
+    """
+    global _listener
+    StopLogging()
+    logging.config.dictConfig(config)
+
+    loggers = [logging.getLogger(name) for name in config.get('loggers', {})]
+    if 'root' in config:
+        loggers.append(logging.getLogger())
+    handlers = list()
+    for log in loggers:
+        for handler in log.handlers:
+            if handler not in handlers:
+                handlers.append(handler)
+
+    records = queue.Queue()
+    queue_handler = QueueHandler(records)
+    for log in loggers:
+        log.handlers = [queue_handler]
+        if level:
+            log.setLevel(level)
+    _listener = QueueListener(records, *handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def StopLogging():
+    """Flush any queued records and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+# Registered once, StopLogging does nothing when logging was not configured
+atexit.register(StopLogging)
@@ -0,0 +1,153 @@
+"""metrics.py - Stage timers and counters for hbq, exported as JSON and Prometheus text files"""
+from contextlib import contextmanager
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger('metrics')
+
+PROMETHEUS_PREFIX = 'hbq'
+
+
+class Metrics(object):
+    """Collects elapsed time per named stage and labelled counters for a single hbq run"""
+    def __init__(self):
+        # Probes and scans may record from worker threads
+        self.lock = threading.Lock()
+        self.Reset()
+
+    def Reset(self):
+        """Discard all collected values"""
+        # stage name -> [calls, total seconds, max seconds]
+        self.stages = dict()
+        # (counter name, ((label, value), ...)) -> value
+        self.counters = dict()
+        # stage name -> [bodies running, start of the busy period] for BusyTimer
+        self.busy = dict()
+        self.start_time = time.time()
+
+    @contextmanager
+    def Timer(self, stage):
+        """Context manager that adds the wall time of its body to stage"""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.AddTime(stage, time.time() - start)
+
+    @contextmanager
+    def BusyTimer(self, stage):
+        """
+        Context manager that adds to stage the wall time during which at least one of its bodies runs,
+        so bodies overlapping in several threads are not counted twice (unlike Timer).
+        """
+        with self.lock:
+            entry = self.busy.setdefault(stage, [0, None])
+            if entry[0] == 0:
+                entry[1] = time.time()
+            entry[0] += 1
+        try:
+            yield
+        finally:
+            with self.lock:
+                entry = self.busy[stage]
+                entry[0] -= 1
+                elapsed = time.time() - entry[1] if entry[0] == 0 else None
+            if elapsed is not None:
+                self.AddTime(stage, elapsed)
+
+    def AddTime(self, stage, seconds):
+        """Add an elapsed time (in seconds) to stage"""
+        with self.lock:
+            entry = self.stages.setdefault(stage, [0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds)
+
+    def Increment(self, name, value=1, **labels):
+        """Add value to the counter name, optionally qualified by labels"""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def GetStageTime(self, stage):
+        """Returns the total seconds recorded for stage"""
+        return self.stages.get(stage, [0, 0.0, 0.0])[1]
+
+    def AsDict(self):
+        """Returns all collected values as a JSON serializable dict"""
+        stages = dict((name, dict(calls=calls, total_seconds=total, max_seconds=longest))
+                      for name, (calls, total, longest) in self.stages.items())
+        counters = list()
+        for (name, labels), value in sorted(self.counters.items()):
+            counters.append(dict(name=name, labels=dict(labels), value=value))
+        return dict(start_time=self.start_time,
+                    run_seconds=time.time() - self.start_time,
+                    stages=stages,
+                    counters=counters)
+
+    def WriteJSON(self, filename):
+        """Write all collected values to filename as JSON"""
+        f = open(filename, 'w')
+        try:
+            json.dump(self.AsDict(), f, indent=2, sort_keys=True)
+        finally:
+            f.close()
+
+    def WritePrometheus(self, filename):
+        """Write all collected values to filename in the Prometheus text exposition format"""
+        values = self.AsDict()
+        lines = list()
+
+        def AddMetric(name, metric_type, help_text, samples):
+            name = '{}_{}'.format(PROMETHEUS_PREFIX, name)
+            lines.append('# HELP {} {}'.format(name, help_text))
+            lines.append('# TYPE {} {}'.format(name, metric_type))
+            for labels, value in samples:
+                lines.append('{}{} {!r}'.format(name, _FormatLabels(labels), value))
+
+        AddMetric('run_start_timestamp_seconds', 'gauge', 'Unix time the hbq run started',
+                  [((), values['start_time'])])
+        AddMetric('run_seconds', 'gauge', 'Wall time of the hbq run',
+                  [((), values['run_seconds'])])
+        stage_names = sorted(self.stages)
+        AddMetric('stage_seconds_total', 'counter', 'Wall time spent in each stage',
+                  [((('stage', x),), self.stages[x][1]) for x in stage_names])
+        AddMetric('stage_calls_total', 'counter', 'Number of times each stage ran',
+                  [((('stage', x),), self.stages[x][0]) for x in stage_names])
+        AddMetric('stage_max_seconds', 'gauge', 'Longest single run of each stage',
+                  [((('stage', x),), self.stages[x][2]) for x in stage_names])
+
+        by_name = dict()
+        for (name, labels), value in sorted(self.counters.items()):
+            by_name.setdefault(name, list()).append((labels, value))
+        for name in sorted(by_name):
+            AddMetric(name + '_total', 'counter', 'hbq counter ' + name, by_name[name])
+
+        f = open(filename, 'w')
+        try:
+            f.write('\n'.join(lines) + '\n')
+        finally:
+            f.close()
+
+    def WriteFiles(self, base):
+        """Write base.json and base.prom"""
+        logger.debug('Writing metrics to "%s.json" and "%s.prom"', base, base)
+        self.WriteJSON(base + '.json')
+        self.WritePrometheus(base + '.prom')
+
+
+def _FormatLabels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                          for k, v in labels) + '}'
+
+
+# Process wide registry used by the hbq modules
+registry = Metrics()
+Timer = registry.Timer
+BusyTimer = registry.BusyTimer
+AddTime = registry.AddTime
+Increment = registry.Increment
@@ -0,0 +1,141 @@
+"""profiling.py - Run an hbq sub-command under a deterministic or sampling profiler"""
+import collections
+import logging
+import os
+import sys
+import threading
+import time
+
+import metrics
+
+logger = logging.getLogger('profiling')
+
+PROFILE_MODES = ('deterministic', 'sampling')
+
+# Number of entries listed in the text summaries
+SUMMARY_LIMIT = 50
+
+
+class SamplingProfiler(object):
+    """
+    Periodically records the call stack of a single thread from a background thread.
+    Cheap enough to leave running for a multi-hour scan.
+    """
+    def __init__(self, interval=0.01, thread_id=None):
+        self.interval = interval
+        self.thread_id = thread_id
+        self.stacks = collections.Counter()
+        self.num_samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def Start(self):
+        if self.thread_id is None:
+            self.thread_id = threading.current_thread().ident
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._Run, name='hbq-sampler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def Stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _Run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = list()
+            while frame is not None:
+                code = frame.f_code
+                stack.append('{}:{}({})'.format(os.path.basename(code.co_filename),
+                                                code.co_firstlineno, code.co_name))
+                frame = frame.f_back
+            stack.reverse()
+            self.stacks[tuple(stack)] += 1
+            self.num_samples += 1
+
+    def IsChildWait(self, stack):
+        """True if the sampled stack is blocked on a child process"""
+        return any(x.startswith('subprocess.py:') for x in stack)
+
+    def WriteReport(self, f):
+        """Write self/cumulative sample counts per function, then the collapsed stacks"""
+        own = collections.Counter()
+        cumulative = collections.Counter()
+        child_wait = 0
+        for stack, count in self.stacks.items():
+            own[stack[-1]] += count
+            for func in set(stack):
+                cumulative[func] += count
+            if self.IsChildWait(stack):
+                child_wait += count
+        total = float(self.num_samples or 1)
+        f.write('{:d} samples at {:.1f} ms intervals, {:.1f}% waiting on child processes\n\n'.format(
+            self.num_samples, self.interval * 1000, 100 * child_wait / total))
+        for title, counts in (('Self samples', own), ('Cumulative samples', cumulative)):
+            f.write('{}:\n'.format(title))
+            for func, count in counts.most_common(SUMMARY_LIMIT):
+                f.write('{:8d} {:6.1f}%  {}\n'.format(count, 100 * count / total, func))
+            f.write('\n')
+        # One line per stack, compatible with flamegraph.pl
+        f.write('Collapsed stacks:\n')
+        for stack, count in self.stacks.most_common():
+            f.write('{} {:d}\n'.format(';'.join(stack), count))
+
+
+def RunProfiled(func, args, mode, base, interval=0.01):
+    """
+    Call func(args) under the profiler selected by mode, writing results to files starting with base.
+    Wall time spent waiting on HandBrakeCLI is reported separately from Python CPU time.
+    """
+    if mode not in PROFILE_MODES:
+        raise ValueError('Unknown profile mode "{}"'.format(mode))
+    profiler = None
+    sampler = None
+    wall_start = time.time()
+    times_start = os.times()
+    child_wait_start = metrics.registry.GetStageTime('hb_wait')
+    scan_time_start = metrics.registry.GetStageTime('hb_scan')
+    try:
+        if mode == 'deterministic':
+            import cProfile
+            profiler = cProfile.Profile()
+            return profiler.runcall(func, args)
+        else:
+            sampler = SamplingProfiler(interval)
+            sampler.Start()
+            try:
+                return func(args)
+            finally:
+                sampler.Stop()
+    finally:
+        wall_time = time.time() - wall_start
+        times_end = os.times()
+        cpu_time = (times_end[0] - times_start[0]) + (times_end[1] - times_start[1])
+        child_cpu_time = (times_end[2] - times_start[2]) + (times_end[3] - times_start[3])
+        child_wait = metrics.registry.GetStageTime('hb_wait') - child_wait_start
+        scan_time = metrics.registry.GetStageTime('hb_scan') - scan_time_start
+        header = ('Wall time:                {:10.3f} s\n'
+                  'Python CPU time:          {:10.3f} s\n'
+                  'Waiting on child process: {:10.3f} s (wall time with any HandBrakeCLI running)\n'
+                  'Scan time, all threads:   {:10.3f} s (summed over --scan-jobs threads)\n'
+                  'Child process CPU time:   {:10.3f} s\n\n').format(wall_time, cpu_time, child_wait,
+                                                                      scan_time, child_cpu_time)
+        summary_filename = base + '.txt'
+        f = open(summary_filename, 'w')
+        try:
+            f.write(header)
+            if profiler:
+                import pstats
+                profiler.dump_stats(base + '.pstats')
+                stats = pstats.Stats(profiler, stream=f)
+                stats.sort_stats('cumulative').print_stats(SUMMARY_LIMIT)
+                stats.sort_stats('time').print_stats(SUMMARY_LIMIT)
+            else:
+                sampler.WriteReport(f)
+        finally:
+            f.close()
+        logger.info('Profile written to "%s" (wall %.3f s, CPU %.3f s, child wait %.3f s)',
+                    summary_filename, wall_time, cpu_time, child_wait)
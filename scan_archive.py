@@ -0,0 +1,72 @@
+"""scan_archive.py - Compressed archive of the raw HandBrakeCLI scan output of each DVD folder"""
+import logging
+import os.path
+import zipfile
+
+logger = logging.getLogger('scan_archive')
+
+INDEX_MEMBER = 'index.txt'
+
+
+def ArchiveFilename(xml_filename):
+    """Returns the archive filename stored next to a control file"""
+    (base, ext) = os.path.splitext(xml_filename)
+    return base + '.scans.zip'
+
+
+class ScanArchive(object):
+    """
+    Zip archive holding one deflated member per scanned DVD folder.
+    index.txt maps each member to the DVD folder it was scanned from, in scan order.
+    """
+    def __init__(self, filename, mode='r'):
+        assert mode in ('r', 'w')
+        self.filename = filename
+        self.mode = mode
+        self.zip = zipfile.ZipFile(filename, mode, zipfile.ZIP_DEFLATED)
+        self.index = list()
+        if mode == 'r':
+            index = self.zip.read(INDEX_MEMBER)
+            if not isinstance(index, str):
+                index = index.decode('utf-8')
+            for line in index.splitlines():
+                (member, folder) = line.split('\t', 1)
+                self.index.append((member, folder))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.Close()
+
+    def Add(self, folder, raw):
+        """Add the raw scan output of folder"""
+        assert self.mode == 'w'
+        member = 'scan_{:04d}.txt'.format(len(self.index) + 1)
+        self.zip.writestr(member, raw)
+        self.index.append((member, folder))
+
+    def Folders(self):
+        """Returns the archived folders in scan order"""
+        return [folder for member, folder in self.index]
+
+    def Get(self, folder):
+        """Returns the raw scan output of folder, or None if it is not archived"""
+        for member, archived_folder in self.index:
+            if archived_folder == folder:
+                return self.zip.read(member)
+        return None
+
+    def Items(self):
+        """Yields (folder, raw scan output) in scan order"""
+        for member, folder in self.index:
+            yield folder, self.zip.read(member)
+
+    def Close(self):
+        if self.zip is None:
+            return
+        if self.mode == 'w':
+            self.zip.writestr(INDEX_MEMBER, '\n'.join('{}\t{}'.format(*x) for x in self.index))
+            logger.debug('Archived %d scans to "%s"', len(self.index), self.filename)
+        self.zip.close()
+        self.zip = None
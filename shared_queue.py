@@ -0,0 +1,323 @@
+"""shared_queue.py - Work-stealing encode queue kept as job files in a directory shared by several nodes
+
+Layout of the shared directory:
+    pending/<job>                 published jobs waiting for a worker
+    claimed/<job>@<worker>        jobs being encoded, claimed by an atomic rename from pending/
+    leases/<job>@<worker>         heartbeat of the worker holding the claim (its mtime)
+    done/<job>, failed/<job>      finished jobs, with <job>.result holding exit code and timings
+    logs/<job>.log                HandBrakeCLI output
+A claim whose lease has not been touched for lease_timeout seconds is moved back to pending/.
+"""
+import hashlib
+import json
+import logging
+import os
+import os.path
+import shlex
+import socket
+import subprocess
+import time
+
+import metrics
+
+logger = logging.getLogger('shared_queue')
+
+STATE_FOLDERS = ('pending', 'claimed', 'leases', 'done', 'failed', 'logs', 'tmp')
+JOB_FIELDS = ('id', 'title_num', 'chapter_range', 'src_folder', 'destination', 'query', 'profile', 'tier')
+# Separates the job and worker id in claim names, so it cannot be part of a worker id
+CLAIM_SEPARATOR = '@'
+INVALID_WORKER_ID_CHARS = CLAIM_SEPARATOR + '/\\'
+
+
+def DefaultWorkerId():
+    return '{}-{:d}'.format(socket.gethostname(), os.getpid())
+
+
+def CheckWorkerId(worker_id):
+    """Raises ValueError if worker_id cannot be used in claim names"""
+    if any(x in worker_id for x in INVALID_WORKER_ID_CHARS):
+        raise ValueError('Worker id "{}" must not contain any of {}'.format(
+            worker_id, ' '.join(INVALID_WORKER_ID_CHARS)))
+    return worker_id
+
+
+def SplitClaimName(claim_name):
+    """Returns (job name, worker id) of a claim name"""
+    job_name, separator, worker_id = claim_name.rpartition(CLAIM_SEPARATOR)
+    return job_name, worker_id
+
+
+class SharedQueue(object):
+    """Job files in a shared directory, claimed by workers with atomic renames"""
+    def __init__(self, root):
+        self.root = root
+        for folder in STATE_FOLDERS:
+            path = os.path.join(root, folder)
+            if not os.path.isdir(path):
+                try:
+                    os.makedirs(path)
+                except OSError:
+                    # Another node created it first
+                    if not os.path.isdir(path):
+                        raise
+
+    def Path(self, folder, name=''):
+        return os.path.join(self.root, folder, name)
+
+    def ShareTime(self):
+        """Returns 'now' by the clock of the file server, lease ages are compared against it"""
+        probe = self.Path('tmp', '.clock-' + DefaultWorkerId())
+        open(probe, 'w').close()
+        try:
+            return os.path.getmtime(probe)
+        finally:
+            os.remove(probe)
+
+    def _WriteJSON(self, name, folder, data):
+        """Writes data as folder/name, appearing there atomically"""
+        tmp = self.Path('tmp', name + '.' + DefaultWorkerId())
+        f = open(tmp, 'w')
+        try:
+            json.dump(data, f, indent=2, sort_keys=True)
+        finally:
+            f.close()
+        os.rename(tmp, self.Path(folder, name))
+
+    def _DestinationHash(self, name):
+        return name.split('.')[0].rsplit('_', 1)[-1]
+
+    def _QueuedDestinations(self):
+        """Returns the destination hashes of the jobs waiting for or held by a worker"""
+        return set(self._DestinationHash(x) for folder in ('pending', 'claimed')
+                   for x in os.listdir(self.Path(folder)))
+
+    def _FinishedJobs(self):
+        """Returns {destination hash: [(folder, name)]} of the jobs in done/ and failed/"""
+        finished = dict()
+        for folder in ('done', 'failed'):
+            for name in os.listdir(self.Path(folder)):
+                if not name.endswith('.result'):
+                    finished.setdefault(self._DestinationHash(name), list()).append((folder, name))
+        return finished
+
+    def Publish(self, jobs):
+        """
+        Adds job settings (dicts from hbqueue.MakeJobs) to pending/, skipping destinations already pending
+        or claimed.  A finished (done or failed) job for the same destination is replaced, so failed
+        jobs and jobs re-queued after verification run again.
+        """
+        queued = self._QueuedDestinations()
+        finished = self._FinishedJobs()
+        published = 0
+        stamp = int(time.time() * 1000)
+        for num, cfg in enumerate(jobs, 1):
+            dest_hash = hashlib.md5(os.path.normcase(cfg['destination']).encode('utf-8')).hexdigest()[:12]
+            if dest_hash in queued:
+                logger.debug('Already queued: "%s"', cfg['destination'])
+                continue
+            queued.add(dest_hash)
+            for folder, name in finished.pop(dest_hash, ()):
+                logger.info('Publishing "%s" again, it was in %s/', cfg['destination'], folder)
+                metrics.Increment('jobs_republished', previous=folder)
+                for filename in (name, name + '.result'):
+                    if os.path.exists(self.Path(folder, filename)):
+                        os.remove(self.Path(folder, filename))
+            job = dict((x, cfg.get(x)) for x in JOB_FIELDS)
+            job['id'] = cfg.get('id', num)
+            # Sorting the names keeps pending jobs in publish order
+            name = '{:d}_{:06d}_{}.job'.format(stamp, num, dest_hash)
+            self._WriteJSON(name, 'pending', job)
+            published += 1
+        logger.info('Published %d jobs to "%s" (%d already queued)', published, self.root, len(jobs) - published)
+        return published
+
+    def Claim(self, worker_id):
+        """Claims the oldest pending job, returns (claimed filename, job dict) or None if there is none"""
+        for name in sorted(os.listdir(self.Path('pending'))):
+            claim_name = name + CLAIM_SEPARATOR + worker_id
+            lease = self.Path('leases', claim_name)
+            # The lease exists before the claim does, so a claim without a lease is always stale
+            open(lease, 'w').close()
+            try:
+                os.rename(self.Path('pending', name), self.Path('claimed', claim_name))
+            except OSError:
+                # Another worker got there first
+                os.remove(lease)
+                continue
+            f = open(self.Path('claimed', claim_name))
+            try:
+                job = json.load(f)
+            finally:
+                f.close()
+            logger.info('%s claimed job %s "%s"', worker_id, job['id'], job['destination'])
+            return claim_name, job
+        return None
+
+    def Heartbeat(self, claim_name):
+        """Renews the lease on a claimed job, returns False if the lease was lost (the job was reclaimed)"""
+        try:
+            os.utime(self.Path('leases', claim_name), None)
+        except OSError:
+            return False
+        return True
+
+    def Complete(self, claim_name, result, succeeded=True):
+        """Moves a claimed job to done/ (or failed/) and records result"""
+        name = SplitClaimName(claim_name)[0]
+        folder = 'done' if succeeded else 'failed'
+        try:
+            os.rename(self.Path('claimed', claim_name), self.Path(folder, name))
+        except OSError:
+            logger.warning('Lease on %s was lost before it finished, it may have been encoded twice', name)
+            return False
+        finally:
+            if os.path.exists(self.Path('leases', claim_name)):
+                os.remove(self.Path('leases', claim_name))
+        self._WriteJSON(name + '.result', folder, result)
+        return True
+
+    def ReclaimExpired(self, lease_timeout):
+        """Moves claimed jobs whose lease is older than lease_timeout seconds back to pending/"""
+        now = self.ShareTime()
+        reclaimed = 0
+        for claim_name in os.listdir(self.Path('claimed')):
+            lease = self.Path('leases', claim_name)
+            try:
+                age = now - os.path.getmtime(lease)
+            except OSError:
+                age = None
+            if age is not None and age < lease_timeout:
+                continue
+            name, worker_id = SplitClaimName(claim_name)
+            try:
+                os.rename(self.Path('claimed', claim_name), self.Path('pending', name))
+            except OSError:
+                # Completed or reclaimed by another node meanwhile
+                continue
+            if os.path.exists(lease):
+                os.remove(lease)
+            logger.warning('Reclaimed %s from %s (lease expired)', name, worker_id)
+            metrics.Increment('jobs_reclaimed')
+            reclaimed += 1
+        return reclaimed
+
+    def Counts(self):
+        """Returns the number of jobs in each state"""
+        return dict((folder, len([x for x in os.listdir(self.Path(folder)) if not x.endswith('.result')]))
+                    for folder in ('pending', 'claimed', 'done', 'failed'))
+
+
+def TranscoderCommand(transcoder, query):
+    """Returns the Popen command for running query with transcoder"""
+    if os.name == 'nt':
+        # The query is already quoted for the Windows command line
+        return '"{}" {}'.format(transcoder, query)
+    return [transcoder] + shlex.split(query)
+
+
+class Worker(object):
+    """Claims jobs from a SharedQueue and encodes them one at a time, heartbeating its lease"""
+    def __init__(self, queue, transcoder, worker_id=None, lease_timeout=300.0, heartbeat_interval=30.0,
+                 poll_interval=30.0):
+        self.queue = queue
+        self.transcoder = transcoder
+        self.worker_id = CheckWorkerId(worker_id or DefaultWorkerId())
+        self.lease_timeout = lease_timeout
+        self.heartbeat_interval = heartbeat_interval
+        self.poll_interval = poll_interval
+
+    def Run(self, max_jobs=None, exit_when_empty=False):
+        """Encodes jobs until max_jobs have run, or the queue is empty when exit_when_empty is set"""
+        num_jobs = 0
+        while max_jobs is None or num_jobs < max_jobs:
+            self.queue.ReclaimExpired(self.lease_timeout)
+            claim = self.queue.Claim(self.worker_id)
+            if claim is None:
+                if exit_when_empty and not self.queue.Counts()['claimed']:
+                    break
+                time.sleep(self.poll_interval)
+                continue
+            self.RunJob(*claim)
+            num_jobs += 1
+        logger.info('%s finished after %d jobs', self.worker_id, num_jobs)
+        return num_jobs
+
+    def StartJob(self, claim_name, job, preexec_fn=None):
+        """Starts the transcoder for a claimed job, returns the RunningJob"""
+        name = SplitClaimName(claim_name)[0]
+        log_filename = self.queue.Path('logs', name + '.log')
+        log_file = open(log_filename, 'w')
+        running = RunningJob(claim_name, job, log_filename, log_file)
+        try:
+            running.process = subprocess.Popen(TranscoderCommand(self.transcoder, job['query']),
+                                               stdout=log_file, stderr=subprocess.STDOUT,
+                                               preexec_fn=preexec_fn)
+        except OSError as e:
+            logger.error('Unable to run "%s": %s', self.transcoder, e)
+        return running
+
+    def AbandonJob(self, running):
+        """Stops the transcoder of a job whose lease was lost, the job is back in the queue for another worker"""
+        logger.warning('%s lost the lease on job %s, stopping its encode', self.worker_id, running.job['id'])
+        running.lease_lost = True
+        if running.process is not None and running.process.poll() is None:
+            running.process.terminate()
+            running.process.wait()
+        self.FinishJob(running)
+
+    def FinishJob(self, running):
+        """Completes a job whose transcoder has exited (or could not be started)"""
+        running.log_file.close()
+        if running.lease_lost:
+            metrics.Increment('leases_lost')
+            return
+        returncode = running.process.returncode if running.process else -1
+        elapsed = time.time() - running.start
+        succeeded = returncode == 0
+        job = running.job
+        metrics.AddTime('encode', elapsed)
+        metrics.Increment('jobs_encoded' if succeeded else 'jobs_failed', profile=job.get('profile'),
+                          tier=job.get('tier'))
+        logger.info('%s job %s %s in %.1f seconds (exit code %d)', self.worker_id, job['id'],
+                    'finished' if succeeded else 'FAILED', elapsed, returncode)
+        result = dict(worker=self.worker_id, returncode=returncode, start=running.start, elapsed=elapsed,
+                      profile=job.get('profile'), tier=job.get('tier'))
+        self.queue.Complete(running.claim_name, result, succeeded)
+
+    def RunJob(self, claim_name, job):
+        """Runs the transcoder for a claimed job and completes it"""
+        running = self.StartJob(claim_name, job)
+        while running.Poll() is None:
+            time.sleep(min(1.0, self.heartbeat_interval))
+            if running.HeartbeatDue(self.heartbeat_interval) and not self.queue.Heartbeat(claim_name):
+                self.AbandonJob(running)
+                return
+        self.FinishJob(running)
+
+
+class RunningJob(object):
+    """A claimed job and its transcoder process"""
+    def __init__(self, claim_name, job, log_filename, log_file):
+        self.claim_name = claim_name
+        self.job = job
+        self.log_filename = log_filename
+        self.log_file = log_file
+        self.process = None
+        # Set when another worker reclaimed the job while it was running
+        self.lease_lost = False
+        self.start = time.time()
+        self.last_heartbeat = self.start
+
+    def Poll(self):
+        """Returns the exit code of the transcoder, or None while it is running"""
+        if self.process is None:
+            return -1
+        return self.process.poll()
+
+    def HeartbeatDue(self, heartbeat_interval):
+        """True (and restarts the interval) if the lease should be renewed"""
+        now = time.time()
+        if now - self.last_heartbeat < heartbeat_interval:
+            return False
+        self.last_heartbeat = now
+        return True
@@ -0,0 +1,150 @@
+"""test_autotune.py - Follows HandBrakeCLI progress and steps the job count with autotune"""
+import os.path
+import shutil
+import sys
+import tempfile
+import unittest
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+from autotune import AutotuneWorker, ConcurrencyTuner, CpuSlices, ProgressTail
+from shared_queue import SharedQueue
+
+
+def Progress(percent, fps):
+    return 'Encoding: task 1 of 1, {:.2f} % ({:.2f} fps, avg {:.2f} fps, ETA 00h05m12s)\r'.format(percent, fps, fps)
+
+
+class ProgressTailTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix='hbq_autotune_test_')
+        self.filename = os.path.join(self.folder, 'job.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def Append(self, text):
+        with open(self.filename, 'a') as f:
+            f.write(text)
+
+    def testRead(self):
+        tail = ProgressTail(self.filename)
+        # No log yet, then a log without progress
+        self.assertEqual(tail.Read(), 0.0)
+        self.Append('HandBrake 1.3.3 (2020061300) - Linux x86_64\nScanning title 1 of 1...\n')
+        self.assertEqual(tail.Read(), 0.0)
+        # Only the last of several progress lines counts
+        self.Append(Progress(1.5, 80.25) + Progress(2.0, 87.34))
+        self.assertEqual(tail.Read(), 87.34)
+        # A line cut short by the read is completed by the next one
+        line = Progress(2.5, 91.5)
+        self.Append(line[:30])
+        self.assertEqual(tail.Read(), 87.34)
+        self.Append(line[30:])
+        self.assertEqual(tail.Read(), 91.5)
+        # Other output keeps the last fps
+        self.Append('\nEncode done!\n')
+        self.assertEqual(tail.Read(), 91.5)
+
+
+class ConcurrencyTunerTest(unittest.TestCase):
+    def Run(self, tuner, fps_by_workers, num_windows, cpu_percent=None):
+        """Feeds num_windows windows of samples, returns the job count after each"""
+        counts = list()
+        for _ in range(num_windows):
+            for _ in range(tuner.window):
+                fps = fps_by_workers[tuner.workers]
+                tuner.Update(fps, cpu_percent, tuner.workers)
+            counts.append(tuner.workers)
+        return counts
+
+    def testClimbAndHold(self):
+        tuner = ConcurrencyTuner(1, 6, window=3, hold=4)
+        fps = {1: 100.0, 2: 180.0, 3: 240.0, 4: 245.0, 5: 230.0, 6: 200.0}
+        # Up to 4, which gains too little over 3, back to 3 and held there, then a probe of 2
+        self.assertEqual(self.Run(tuner, fps, 10), [2, 3, 4, 3, 3, 3, 3, 2, 3, 3])
+        # Then held again before probing 4
+        self.assertEqual(self.Run(tuner, fps, 4), [3, 3, 4, 3])
+
+    def testNoHold(self):
+        tuner = ConcurrencyTuner(1, 6, window=3, hold=0)
+        fps = {1: 100.0, 2: 180.0, 3: 240.0, 4: 245.0, 5: 230.0, 6: 200.0}
+        # Without a hold 3 is no better than 4 either, so the count swings between them
+        self.assertEqual(self.Run(tuner, fps, 6), [2, 3, 4, 3, 4, 3])
+
+    def testHoldEndsOnChange(self):
+        tuner = ConcurrencyTuner(1, 6, window=3, hold=10)
+        fps = {1: 100.0, 2: 180.0, 3: 240.0, 4: 245.0}
+        self.assertEqual(self.Run(tuner, fps, 5), [2, 3, 4, 3, 3])
+        # The job mix changed, the climb resumes in its current direction
+        fps[3], fps[2] = 150.0, 170.0
+        self.assertEqual(self.Run(tuner, fps, 1), [2])
+
+    def testSamplesWhileRamping(self):
+        tuner = ConcurrencyTuner(1, 4, window=2)
+        for _ in range(5):
+            self.assertEqual(tuner.Update(50.0, None, 0), 1)
+        self.assertEqual(tuner.samples, [])
+
+    def testCpuSaturated(self):
+        tuner = ConcurrencyTuner(2, 6, window=3)
+        fps = {1: 100.0, 2: 180.0, 3: 240.0}
+        self.assertEqual(self.Run(tuner, fps, 1, cpu_percent=60.0), [3])
+        self.assertEqual(self.Run(tuner, fps, 1, cpu_percent=99.0), [2])
+
+    def testBounds(self):
+        tuner = ConcurrencyTuner(1, 2, window=3)
+        fps = {1: 100.0, 2: 180.0}
+        self.assertEqual(self.Run(tuner, fps, 3), [2, 1, 2])
+        tuner = ConcurrencyTuner(3, 3, window=3)
+        self.assertEqual(self.Run(tuner, {3: 100.0}, 3), [3, 3, 3])
+
+
+class RunningJob(object):
+    def __init__(self, slot):
+        self.job = dict(id=str(slot))
+        self.process = None
+        self.slot = slot
+        self.cpus = None
+
+
+class PinJobsTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix='hbq_autotune_test_')
+        self.tuner = ConcurrencyTuner(1, 4)
+        self.worker = AutotuneWorker(SharedQueue(os.path.join(self.folder, 'queue')), sys.executable, self.tuner,
+                                     'enc1-1')
+        # Pinning only records the CPUs of jobs without a process, so psutil is not needed
+        self.worker.affinity = True
+        self.worker.sampler.num_cpus = 8
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def testCpuSlices(self):
+        self.assertEqual(CpuSlices(8, 3), [[0, 1], [2, 3, 4], [5, 6, 7]])
+        self.assertEqual(CpuSlices(2, 4), [[0], [1]])
+
+    def testRepinOnCountChange(self):
+        running = [RunningJob(0), RunningJob(1)]
+        self.tuner.workers = 2
+        self.worker.PinJobs(running)
+        self.assertEqual([x.cpus for x in running], [[0, 1, 2, 3], [4, 5, 6, 7]])
+
+        # One more job wanted: the running jobs move to the narrower slices as the new one starts
+        self.tuner.workers = 3
+        running.append(RunningJob(2))
+        self.worker.PinJobs(running)
+        self.assertEqual([x.cpus for x in running], [[0, 1], [2, 3, 4], [5, 6, 7]])
+
+        # One job fewer wanted: the slices stay until a job finishes, then the others spread out
+        self.tuner.workers = 2
+        self.worker.PinJobs(running)
+        self.assertEqual([x.cpus for x in running], [[0, 1], [2, 3, 4], [5, 6, 7]])
+        del running[0]
+        self.worker.PinJobs(running)
+        self.assertEqual([(x.slot, x.cpus) for x in running], [(0, [0, 1, 2, 3]), (1, [4, 5, 6, 7])])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+"""test_batch_classify.py - Checks the batch (NumPy) classification against the per-DVD EpisodeDetector"""
+import copy
+import os.path
+import random
+import sys
+import unittest
+import xml.etree.ElementTree as et
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+import batch_classify
+from dvdinfo import DvdInfo, Title, AudioTrack, SubtitleTrack
+try:
+    from eps_detector import EpisodeDetector
+except ImportError:
+    # eps_detector needs Python 2 (hbscan) and oreillycookbook
+    EpisodeDetector = None
+
+DURATIONS = (30, 45, 600, 1320, 1380, 1400, 1450, 2760, 2800, 5000)
+
+
+def MakeDvd(rand, durations=DURATIONS):
+    """Returns a DvdInfo with a few titles of episode, double episode, extra and short durations"""
+    titles = list()
+    for num in range(1, rand.randint(1, 7)):
+        duration = rand.choice(durations)
+        if duration is not None:
+            duration += rand.randint(-40, 40)
+        titles.append(Title(num, duration, '23.976', rand.randint(1, 5) * 1000,
+                            [AudioTrack(1, 'English (AC3)', 'eng', 48000, 192000, False)],
+                            [SubtitleTrack(1, 'Closed Captions', 'eng', 'Text', 'CC', False)]))
+    if titles and rand.random() < 0.3:
+        duplicate = copy.deepcopy(titles[0])
+        duplicate.num = len(titles) + 1
+        titles.append(duplicate)
+    return DvdInfo(titles)
+
+
+def Detect(discs, batch, params):
+    remove_dup_titles, title_min_duration, eps_durations, eps_2x_durations, auto_eps_duration = params
+    detector = EpisodeDetector(1, 1, remove_dup_titles, False, title_min_duration, eps_durations,
+                               eps_2x_durations, True, auto_eps_duration, batch=batch)
+    for dvd, folder, series, season in copy.deepcopy(discs):
+        detector.ProcessDvd(dvd, folder, series, season)
+    detector.Finish()
+    return [et.tostring(x.EmitXML()) for x in detector.dvds]
+
+
+@unittest.skipIf(EpisodeDetector is None or not batch_classify.Available(),
+                 'needs eps_detector and NumPy')
+class BatchClassifyTest(unittest.TestCase):
+    def testSameAsPerDvd(self):
+        rand = random.Random(1)
+        for _ in range(200):
+            discs = list()
+            for season in range(1, rand.randint(2, 4)):
+                for disc in range(1, rand.randint(2, 5)):
+                    discs.append((MakeDvd(rand), '/dvds/Show_S{:02d}D{:d}'.format(season, disc), 'Show', season))
+            params = (rand.random() < 0.7, rand.choice([60, 100, 700]),
+                      rand.choice([[(1380, 60)], [(1380, 60), (1400, 100)]]),
+                      rand.choice([None, [(2760, 120)]]), rand.random() < 0.5)
+            self.assertEqual(Detect(discs, False, params), Detect(discs, True, params), params)
+
+    def testUnknownDurationIsShort(self):
+        rand = random.Random(2)
+        dvds = [MakeDvd(rand, DURATIONS + (None,)) for _ in range(50)]
+        expected = copy.deepcopy(dvds)
+        detector = EpisodeDetector(1, 1, False, False, 100, [(1380, 60)], None, True)
+        for dvd in expected:
+            detector.curr_dvd = dvd
+            detector.RemoveShortTitles()
+        batch_classify.RemoveShortTitles(dvds, 100)
+        self.assertTrue(any(x.duration is None for dvd in dvds for x in dvd.titles))
+        self.assertEqual([(x.enabled, x.eps_type) for dvd in dvds for x in dvd.titles],
+                         [(x.enabled, x.eps_type) for dvd in expected for x in dvd.titles])
+
+
+if __name__ == '__main__':
+    unittest.main()
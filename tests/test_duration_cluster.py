@@ -0,0 +1,51 @@
+"""test_duration_cluster.py - Infers the episode durations of a season with duration_cluster"""
+import os.path
+import sys
+import unittest
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+from duration_cluster import ClusterDurations, FindEpisodeDurations
+
+
+class ClusterDurationsTest(unittest.TestCase):
+    def testGapSplit(self):
+        self.assertEqual(ClusterDurations([1330, 45, 1310, 2640, 1320, 60]),
+                         [[45, 60], [1310, 1320, 1330], [2640]])
+        self.assertEqual(ClusterDurations([]), [])
+
+    def testChainedExtras(self):
+        # Extras a minute apart chain onto the episodes, the largest relative gap separates them
+        self.assertEqual(ClusterDurations([1300, 1310, 1320, 1320, 1380, 1440, 1500]),
+                         [[1300, 1310, 1320, 1320], [1380, 1440, 1500]])
+        # An even run is cut up until no cluster is wider than the cap
+        clusters = ClusterDurations(range(600, 1800, 60))
+        self.assertEqual(sorted(x for cluster in clusters for x in cluster), list(range(600, 1800, 60)))
+        self.assertTrue(all(x[-1] - x[0] <= max(180, x[0] * 0.1) for x in clusters), clusters)
+
+
+class FindEpisodeDurationsTest(unittest.TestCase):
+    def testSingleAndDouble(self):
+        # 22:00 episodes and a 44:00 double episode, plus a menu loop and a featurette
+        durations = [1318, 1320, 1322, 1325, 1321, 2640, 2645, 30, 600]
+        self.assertEqual(FindEpisodeDurations(durations), (((1321, 30),), ((2645, 30),)))
+        self.assertEqual(FindEpisodeDurations(durations, False), (((1321, 30),), None))
+
+    def testMostPlaytime(self):
+        # More 44:00 episodes than 22:00 extras, the 44:00 ones are the episodes
+        durations = [2640, 2650, 2655, 1320, 1325, 1330, 1335]
+        eps_durations, eps_2x_durations = FindEpisodeDurations(durations)
+        self.assertEqual(eps_durations, ((2650, 30),))
+        self.assertEqual(eps_2x_durations, ((5300, 60),))
+
+    def testExtrasKeptOutOfWindow(self):
+        eps_durations = FindEpisodeDurations([1300, 1310, 1320, 1320, 1380, 1440, 1500], False)[0]
+        self.assertEqual(eps_durations, ((1320, 30),))
+
+    def testNoEpisodes(self):
+        self.assertEqual(FindEpisodeDurations([1320, 2640, 600]), (None, None))
+        self.assertEqual(FindEpisodeDurations([]), (None, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+"""test_hbqueue.py - Diffs and appends jobs to HandBrake queue files with hbqueue"""
+import os.path
+import shutil
+import sys
+import tempfile
+import unittest
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+from hbqueue import AddJobElement, AppendJobs, AppendToQueue, DiffQueue, GetJobElements, NewQueue, ReadQueue
+
+
+def MakeJob(num, chapter_range='', query=None):
+    return dict(title_num=num, chapter_range=chapter_range, src_folder='/dvds/Show_S01D1', profile='test',
+                tier='fast', destination='/out/Show/Season 1/Show S01E{:02d}.mkv'.format(num),
+                query=query or '-i "/dvds/Show_S01D1" -t {:d}'.format(num))
+
+
+def JobIds(root):
+    return [x.findtext('Id') for x in GetJobElements(root)]
+
+
+class DiffQueueTest(unittest.TestCase):
+    def testSameDestinations(self):
+        root = NewQueue()
+        for job_id, num in enumerate((1, 2, 3, 4), 1):
+            AddJobElement(root, job_id, MakeJob(num))
+        # Already queued (a differently spelt path still matches), changed, new, and no longer generated
+        jobs = [MakeJob(1), MakeJob(2, query='-t 2 --crop 0:0:0:0'), MakeJob(3), MakeJob(5)]
+        jobs[2]['destination'] = jobs[2]['destination'].replace('/Show/', '/Show/./')
+        diff = DiffQueue(root, jobs)
+        self.assertEqual([x['title_num'] for x in diff.added], [5])
+        self.assertEqual([(elem.findtext('Id'), cfg['title_num']) for elem, cfg in diff.changed], [('2', 2)])
+        self.assertEqual([x.findtext('Id') for x in diff.unchanged], ['1', '3'])
+        self.assertEqual([x.findtext('Id') for x in diff.missing], ['4'])
+
+    def testChapterRange(self):
+        root = NewQueue(True)
+        AddJobElement(root, 1, MakeJob(1, '1-3'))
+        diff = DiffQueue(root, [MakeJob(1, '1-3')])
+        self.assertEqual((len(diff.unchanged), len(diff.changed)), (1, 0))
+        diff = DiffQueue(root, [MakeJob(1, '4-6')])
+        self.assertEqual((len(diff.unchanged), len(diff.changed)), (0, 1))
+
+
+class AppendJobsTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix='hbq_hbqueue_test_')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def testIdContinuation(self):
+        root = NewQueue()
+        AppendJobs(root, [MakeJob(1), MakeJob(2)])
+        self.assertEqual(JobIds(root), ['1', '2'])
+        # Numbering continues after the highest id, not the number of jobs
+        AddJobElement(root, 7, MakeJob(3))
+        AppendJobs(root, [MakeJob(4), MakeJob(5)])
+        self.assertEqual(JobIds(root), ['1', '2', '7', '8', '9'])
+
+    def testAppendToQueue(self):
+        filename = os.path.join(self.folder, 'Show.queue')
+        diff = AppendToQueue(filename, [MakeJob(1), MakeJob(2)])
+        self.assertEqual(len(diff.added), 2)
+        mtime = int(os.path.getmtime(filename)) - 60
+        os.utime(filename, (mtime, mtime))
+
+        # Nothing new: the file is left alone
+        diff = AppendToQueue(filename, [MakeJob(1), MakeJob(2)])
+        self.assertEqual((len(diff.added), len(diff.unchanged)), (0, 2))
+        self.assertEqual(os.path.getmtime(filename), mtime)
+
+        diff = AppendToQueue(filename, [MakeJob(1), MakeJob(3), MakeJob(2, query='-t 2 --crop 0:0:0:0')])
+        self.assertEqual([x['title_num'] for x in diff.added], [3])
+        root = ReadQueue(filename)
+        self.assertEqual(JobIds(root), ['1', '2', '3'])
+        # The changed job keeps its queued query
+        self.assertEqual(root[1].findtext('Query'), MakeJob(2)['query'])
+
+    def testQueueGeneration(self):
+        filename = os.path.join(self.folder, 'Show.queue')
+        AppendToQueue(filename, [MakeJob(1)], make_1st_gen_queue=True)
+        # Jobs are added in the format of the existing file
+        AppendToQueue(filename, [MakeJob(2)])
+        root = ReadQueue(filename)
+        self.assertEqual(root.tag, 'ArrayOfJob')
+        self.assertEqual([x.tag for x in root], ['Job', 'Job'])
+
+
+if __name__ == '__main__':
+    unittest.main()
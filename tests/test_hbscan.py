@@ -0,0 +1,41 @@
+"""test_hbscan.py - Parses canned HandBrakeCLI scan output with hbscan.ParseHBOutput"""
+import os.path
+import sys
+import unittest
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+try:
+    from hbscan import ParseHBOutput
+except ImportError:
+    # hbscan uses cStringIO, it only runs under Python 2
+    ParseHBOutput = None
+
+SCAN_OUTPUT = """[00:00:00] scan: DVD has 1 title(s)
++ title 1:
+  + vts 1, ttn 1, cells 0->1 (250000 blocks)
+  + duration: 00:44:10
+  + size: 720x480, pixel aspect: 32/27, display aspect: 1.78, 29.970 fps
+  + chapters:
+    + 1: cells 0->0, 125000 blocks, duration 00:22:05
+    + 2: cells 1->1, 125000 blocks, duration 00:22:05
+  + audio tracks:
+    + 1, English (AC3) (5.1 ch) (iso639-2: eng), 48000Hz, 448000bps
+    + 2, Francais (AC3) (2.0 ch) (iso639-2: fra)
+  + subtitle tracks:
+    + 1, English (iso639-2: eng) (Bitmap)(VOBSUB)
+HandBrake has exited.
+"""
+
+
+@unittest.skipIf(ParseHBOutput is None, 'hbscan needs Python 2')
+class ParseHBOutputTest(unittest.TestCase):
+    def testAudioTrackFormats(self):
+        title = ParseHBOutput(SCAN_OUTPUT).titles[0]
+        self.assertEqual([(x.num, x.desc, x.lang, x.sr, x.rate) for x in title.audio_tracks],
+                         [(1, 'English (AC3) (5.1 ch)', 'eng', 48000, 448000),
+                          (2, 'Francais (AC3) (2.0 ch)', 'fra', -1, -1)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+"""test_ifo_reader.py - Reads a small synthetic VIDEO_TS with ifo_reader and parses it like a scan"""
+import os
+import os.path
+import shutil
+import struct
+import sys
+import tempfile
+import unittest
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+from ifo_reader import IfoError, ReadDvd, RenderHBOutput, SECTOR_SIZE
+try:
+    from hbscan import ParseHBOutput
+except ImportError:
+    # hbscan uses cStringIO, it only runs under Python 2
+    ParseHBOutput = None
+
+# (coding, channels - 1, language) of the audio streams and languages of the subpicture streams of VTS 1
+AUDIO_STREAMS = [(0, 5, b'en'), (0, 1, b'fr')]
+SUBPICTURE_STREAMS = [b'en', b'es']
+# (cells as (seconds, blocks), entry cell of each chapter, audio streams used, subpicture streams used)
+TITLES = [
+    ([(660, 100000), (662, 101000)], [1, 2], [0, 1], [0, 1]),
+    ([(90, 5000)], [1], [0], []),
+]
+
+
+def _Time(seconds):
+    """BCD playback time at 29.97 fps"""
+    values = (seconds // 3600, seconds // 60 % 60, seconds % 60)
+    return struct.pack('>4B', *[(x // 10) << 4 | x % 10 for x in values] + [3 << 6])
+
+
+def _Pgc(cells, programs, audio, subpictures):
+    program_map = 0xec
+    cell_playback = program_map + len(programs) + 1
+    pgc = bytearray(cell_playback + 24 * len(cells))
+    struct.pack_into('>BB', pgc, 2, len(programs), len(cells))
+    pgc[4:8] = _Time(sum(x[0] for x in cells))
+    for i in audio:
+        struct.pack_into('>H', pgc, 0x0c + 2 * i, 0x8000 | i << 8)
+    for i in subpictures:
+        struct.pack_into('>I', pgc, 0x1c + 4 * i, 0x80000000)
+    struct.pack_into('>HH', pgc, 0xe6, program_map, cell_playback)
+    pgc[program_map:program_map + len(programs)] = bytearray(programs)
+    sector = 0
+    for i, (seconds, blocks) in enumerate(cells):
+        cell = cell_playback + 24 * i
+        pgc[cell + 4:cell + 8] = _Time(seconds)
+        struct.pack_into('>IIII', pgc, cell + 8, sector, 0, sector + blocks - 10, sector + blocks - 1)
+        sector += blocks
+    return pgc
+
+
+def WriteVideoTs(folder):
+    """Writes VIDEO_TS.IFO and VTS_01_0.IFO describing TITLES, each title its own PGC of VTS 1"""
+    os.makedirs(os.path.join(folder, 'VIDEO_TS'))
+    vmg = bytearray(2 * SECTOR_SIZE)
+    vmg[:12] = b'DVDVIDEO-VMG'
+    struct.pack_into('>I', vmg, 0xc4, 1)
+    struct.pack_into('>H2xI', vmg, SECTOR_SIZE, len(TITLES), 8 + 12 * len(TITLES) - 1)
+    for i, title in enumerate(TITLES):
+        struct.pack_into('>BBHHBBI', vmg, SECTOR_SIZE + 8 + 12 * i, 0, 1, len(title[1]), 0, 1, i + 1, 0)
+
+    vts = bytearray(2 * SECTOR_SIZE)
+    vts[:12] = b'DVDVIDEO-VTS'
+    struct.pack_into('>II', vts, 0xc8, 1, 2)
+    # NTSC 16:9 with closed captions in line 21
+    struct.pack_into('>HH', vts, 0x200, 3 << 10 | 0x80, len(AUDIO_STREAMS))
+    for i, (coding, channels, lang) in enumerate(AUDIO_STREAMS):
+        struct.pack_into('>BB2s', vts, 0x204 + 8 * i, coding << 5 | 4, channels, lang)
+    struct.pack_into('>H', vts, 0x254, len(SUBPICTURE_STREAMS))
+    for i, lang in enumerate(SUBPICTURE_STREAMS):
+        struct.pack_into('>BB2s', vts, 0x256 + 6 * i, 1, 0, lang)
+    # Chapter (part of title) table in sector 1
+    ptts = b''.join(b''.join(struct.pack('>HH', i + 1, pgn) for pgn in range(1, len(title[1]) + 1))
+                    for i, title in enumerate(TITLES))
+    first_ptt = 8 + 4 * len(TITLES)
+    offsets = [first_ptt + 4 * sum(len(x[1]) for x in TITLES[:i]) for i in range(len(TITLES))]
+    ptt_srpt = struct.pack('>H2xI', len(TITLES), first_ptt + len(ptts) - 1)
+    ptt_srpt += struct.pack('>{:d}I'.format(len(TITLES)), *offsets) + ptts
+    vts[SECTOR_SIZE:SECTOR_SIZE + len(ptt_srpt)] = ptt_srpt
+    # Program chain table from sector 2
+    pgcs = [_Pgc(*x) for x in TITLES]
+    pgcit = bytearray(struct.pack('>H2xI', len(pgcs), 0))
+    offset = 8 + 8 * len(pgcs)
+    for i, pgc in enumerate(pgcs):
+        pgcit += struct.pack('>II', 0x80000000 | (i + 1) << 24, offset)
+        offset += len(pgc)
+    for pgc in pgcs:
+        pgcit += pgc
+
+    for name, data in (('VIDEO_TS.IFO', vmg), ('VTS_01_0.IFO', vts + pgcit)):
+        with open(os.path.join(folder, 'VIDEO_TS', name), 'wb') as f:
+            f.write(bytes(data))
+
+
+class IfoReaderTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix='hbq_ifo_test_')
+        WriteVideoTs(self.folder)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def testReadDvd(self):
+        titles = ReadDvd(self.folder)
+        self.assertEqual([(x.num, x.vts, x.ttn, x.duration, x.fps) for x in titles],
+                         [(1, 1, 1, 1322, '29.970'), (2, 1, 2, 90, '29.970')])
+        self.assertEqual(titles[0].chapters, [(0, 0, 100000, 660), (1, 1, 101000, 662)])
+        self.assertEqual(titles[0].audio_streams, [('AC3', 6, 'en', ''), ('AC3', 2, 'fr', '')])
+        self.assertEqual(titles[0].subtitle_streams, [('en', False), ('es', False), ('en', True)])
+        self.assertEqual(titles[1].subtitle_streams, [('en', True)])
+
+    def testRenderHBOutput(self):
+        output = RenderHBOutput(ReadDvd(self.folder))
+        self.assertIn('  + vts 1, ttn 1, cells 0->1 (201000 blocks)\n  + duration: 00:22:02\n', output)
+        self.assertIn('    + 2: cells 1->1, 101000 blocks, duration 00:11:02\n', output)
+        self.assertIn('    + 1, English (AC3) (5.1 ch) (iso639-2: eng)\n', output)
+        self.assertIn('    + 3, Closed Captions (iso639-2: eng) (Text)(CC)\n', output)
+        self.assertTrue(output.endswith('HandBrake has exited.\n'))
+
+    @unittest.skipIf(ParseHBOutput is None, 'hbscan needs Python 2')
+    def testParseRenderedOutput(self):
+        dvd = ParseHBOutput(RenderHBOutput(ReadDvd(self.folder)))
+        self.assertEqual([(x.num, x.duration, x.fps, x.num_blocks) for x in dvd.titles],
+                         [(1, 1322, '29.970', 201000), (2, 90, '29.970', 5000)])
+        title = dvd.titles[0]
+        self.assertEqual([(x.num, x.cell_start, x.cell_end, x.block_count, x.duration) for x in title.chapters],
+                         [(1, 0, 0, 100000, 660), (2, 1, 1, 101000, 662)])
+        self.assertEqual([(x.num, x.desc, x.lang, x.sr, x.rate) for x in title.audio_tracks],
+                         [(1, 'English (AC3) (5.1 ch)', 'eng', -1, -1), (2, 'Francais (AC3) (2.0 ch)', 'fra', -1, -1)])
+        self.assertEqual([(x.num, x.lang, x.format, x.src_name) for x in title.subtitle_tracks],
+                         [(1, 'eng', 'Bitmap', 'VOBSUB'), (2, 'spa', 'Bitmap', 'VOBSUB'), (3, 'eng', 'Text', 'CC')])
+
+    def testTruncated(self):
+        filename = os.path.join(self.folder, 'VIDEO_TS', 'VTS_01_0.IFO')
+        with open(filename, 'rb') as f:
+            data = f.read()
+        with open(filename, 'wb') as f:
+            f.write(data[:SECTOR_SIZE + 16])
+        self.assertRaises(IfoError, ReadDvd, self.folder)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+"""test_metrics.py - Times overlapping stage bodies with metrics.BusyTimer"""
+import os.path
+import sys
+import threading
+import time
+import unittest
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+from metrics import Metrics
+
+
+class BusyTimerTest(unittest.TestCase):
+    def testOverlappingThreads(self):
+        registry = Metrics()
+
+        def Wait():
+            with registry.BusyTimer('wait'):
+                with registry.Timer('summed'):
+                    time.sleep(0.2)
+        threads = [threading.Thread(target=Wait) for _ in range(4)]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall_time = time.time() - start
+
+        self.assertGreater(registry.GetStageTime('summed'), 0.75)
+        self.assertGreaterEqual(registry.GetStageTime('wait'), 0.19)
+        self.assertLessEqual(registry.GetStageTime('wait'), wall_time)
+
+    def testSeparateBusyPeriods(self):
+        registry = Metrics()
+        for _ in range(2):
+            with registry.BusyTimer('wait'):
+                time.sleep(0.05)
+            time.sleep(0.1)
+        self.assertEqual(registry.stages['wait'][0], 2)
+        self.assertLess(registry.GetStageTime('wait'), 0.2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+"""test_shared_queue.py - Runs several local worker processes against a temporary shared queue"""
+import json
+import os
+import os.path
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+from shared_queue import SharedQueue, SplitClaimName, Worker
+
+# Stub transcoder query: appends one line to the destination, so an encode run twice shows up
+ENCODE_QUERY = '-c "import sys, time; time.sleep(0.05); open(sys.argv[1], \'a\').write(\'encoded\\\\n\')" "{}"'
+SLOW_QUERY = '-c "import time; time.sleep(30)"'
+FAIL_QUERY = '-c "import sys; sys.exit(1)"'
+
+WORKER_SCRIPT = """
+import sys
+sys.path.insert(0, {repo!r})
+from shared_queue import SharedQueue, Worker
+Worker(SharedQueue({root!r}), sys.executable, {worker_id!r}, lease_timeout=60, heartbeat_interval=0.2,
+       poll_interval=0.1).Run(exit_when_empty=True)
+"""
+
+
+def MakeJobs(folder, num_jobs, query=ENCODE_QUERY):
+    return [dict(title_num=num, chapter_range='', src_folder='/dvds/Show_S01D1', profile='test',
+                 destination=os.path.join(folder, 'Show S01E{:02d}.mkv'.format(num)),
+                 query=query.format(os.path.join(folder, 'Show S01E{:02d}.mkv'.format(num))))
+            for num in range(1, num_jobs + 1)]
+
+
+class SharedQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix='hbq_queue_test_')
+        self.queue = SharedQueue(os.path.join(self.folder, 'queue'))
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def ReadResult(self, folder, job_name):
+        with open(self.queue.Path(folder, job_name + '.result')) as f:
+            return json.load(f)
+
+    def testWorkerProcesses(self):
+        jobs = MakeJobs(self.folder, 12)
+        self.assertEqual(self.queue.Publish(jobs), 12)
+        # A node that died holding a claim, its lease long expired
+        claim_name, job = self.queue.Claim('dead.example.lan-1')
+        old = time.time() - 3600
+        os.utime(self.queue.Path('leases', claim_name), (old, old))
+
+        # Worker ids with dots, like those made from a fully qualified hostname
+        workers = [subprocess.Popen([sys.executable, '-c', WORKER_SCRIPT.format(
+                       repo=REPO, root=self.queue.root, worker_id='enc{:d}.example.lan-{:d}'.format(i, i))])
+                   for i in range(4)]
+        for worker in workers:
+            self.assertEqual(worker.wait(), 0)
+
+        self.assertEqual(self.queue.Counts(), dict(pending=0, claimed=0, done=12, failed=0))
+        self.assertEqual(os.listdir(self.queue.Path('leases')), [])
+        for cfg in jobs:
+            with open(cfg['destination']) as f:
+                self.assertEqual(f.read(), 'encoded\n', cfg['destination'])
+        # The expired claim was encoded by a live worker under its own job name
+        job_name = SplitClaimName(claim_name)[0]
+        self.assertTrue(self.ReadResult('done', job_name)['worker'].startswith('enc'))
+        self.assertTrue(os.path.exists(self.queue.Path('logs', job_name + '.log')))
+
+    def testLostLease(self):
+        self.queue.Publish(MakeJobs(self.folder, 1, SLOW_QUERY))
+        claim_name, job = self.queue.Claim('enc1.example.lan-1')
+        self.assertTrue(self.queue.Heartbeat(claim_name))
+        # Another node reclaims the job as if this worker had stalled
+        self.assertEqual(self.queue.ReclaimExpired(-1), 1)
+        self.assertFalse(self.queue.Heartbeat(claim_name))
+
+        worker = Worker(self.queue, sys.executable, 'enc1.example.lan-1', heartbeat_interval=0.1)
+        start = time.time()
+        worker.RunJob(claim_name, job)
+        # The encode was stopped rather than run to the end, and left for another worker
+        self.assertLess(time.time() - start, 10)
+        self.assertEqual(self.queue.Counts(), dict(pending=1, claimed=0, done=0, failed=0))
+
+    def testPublishAgain(self):
+        jobs = MakeJobs(self.folder, 3, FAIL_QUERY)
+        self.assertEqual(self.queue.Publish(jobs), 3)
+        # Pending and claimed jobs are not published twice
+        claim_name, job = self.queue.Claim('enc1.example.lan-1')
+        self.assertEqual(self.queue.Publish(jobs), 0)
+
+        Worker(self.queue, sys.executable, 'enc1.example.lan-1').RunJob(claim_name, job)
+        self.assertEqual(self.queue.Counts(), dict(pending=2, claimed=0, done=0, failed=1))
+        # The failed job replaces its entry in failed/ (e.g. from a verify re-queue), the others stay pending
+        self.assertEqual(self.queue.Publish(MakeJobs(self.folder, 3)), 1)
+        self.assertEqual(self.queue.Counts(), dict(pending=3, claimed=0, done=0, failed=0))
+        self.assertEqual(os.listdir(self.queue.Path('failed')), [])
+
+    def testInvalidWorkerId(self):
+        self.assertRaises(ValueError, Worker, self.queue, sys.executable, 'enc1@lan')
+
+
+if __name__ == '__main__':
+    unittest.main()
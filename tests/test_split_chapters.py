@@ -0,0 +1,82 @@
+"""test_split_chapters.py - Splits titles holding several episodes at chapter boundaries"""
+import os.path
+import sys
+import unittest
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+from dvdinfo import DvdInfo, Title, AudioTrack, Chapter
+try:
+    from eps_detector import EpisodeDetector, GroupChapters, SplitTitleByChapters
+except ImportError:
+    # eps_detector needs Python 2 (hbscan) and oreillycookbook
+    EpisodeDetector = None
+
+EPS_DURATIONS = [(1300, 60)]
+
+
+def MakeChapters(durations):
+    return [Chapter(num, num - 1, num - 1, 1000 * num, duration, True) for num, duration in enumerate(durations, 1)]
+
+
+def MakeTitle(num, durations):
+    chapters = MakeChapters(durations)
+    return Title(num, sum(durations), '29.970', sum(x.block_count for x in chapters),
+                 [AudioTrack(1, 'English (AC3) (2.0 ch)', 'eng', 48000, 192000, True)], list(), chapters)
+
+
+@unittest.skipIf(EpisodeDetector is None, 'needs eps_detector')
+class GroupChaptersTest(unittest.TestCase):
+    def Group(self, durations, title_min_duration=120):
+        return GroupChapters(MakeChapters(durations), EPS_DURATIONS, title_min_duration)
+
+    def testEpisodeBoundaries(self):
+        self.assertEqual(self.Group([600, 700, 650, 650]), [(0, 1), (2, 3)])
+        self.assertEqual(self.Group([400, 400, 500, 300, 300, 300, 400]), [(0, 2), (3, 6)])
+
+    def testClosestDivision(self):
+        # 1250+1340 and 1310+1280 are both in the window, the division closest to 1300 wins
+        self.assertEqual(self.Group([1250, 60, 1280]), [(0, 1), (2, 2)])
+        self.assertEqual(self.Group([1310, 1250, 30]), [(0, 0), (1, 2)])
+
+    def testTrailingChapters(self):
+        # Credits shorter than title_min_duration join the last episode, longer ones prevent a split
+        self.assertEqual(self.Group([650, 650, 650, 650, 100]), [(0, 1), (2, 4)])
+        self.assertEqual(self.Group([650, 650, 650, 650, 300]), None)
+
+    def testNoDivision(self):
+        self.assertEqual(self.Group([650, 650]), None)
+        self.assertEqual(self.Group([900, 900, 900]), None)
+        self.assertEqual(self.Group([]), None)
+
+    def testSplitTitle(self):
+        title = MakeTitle(3, [600, 700, 650, 650, 100])
+        split_titles = SplitTitleByChapters(title, EPS_DURATIONS, 120)
+        self.assertEqual([(x.num, x.chapter_start, x.chapter_end, x.duration, x.num_blocks) for x in split_titles],
+                         [(3, 1, 2, 1300, 3000), (3, 3, 5, 1400, 12000)])
+        self.assertEqual([len(x.chapters) for x in split_titles], [2, 3])
+        self.assertEqual(split_titles[0].audio_tracks, title.audio_tracks)
+
+    def testSplitChapterTitles(self):
+        dvd = DvdInfo([MakeTitle(1, [650, 650]), MakeTitle(2, [600, 700, 650, 650])],
+                      folder='/dvds/Show_S01D1', series='Show', season=1)
+        detector = EpisodeDetector(1, 1, False, False, 120, EPS_DURATIONS, None, True, split_chapters=True)
+        detector.curr_dvd = dvd
+        detector.SplitChapterTitles()
+        self.assertEqual([(x.num, x.enabled, x.eps_type, x.chapter_start) for x in dvd.titles],
+                         [(1, True, None, None), (2, False, 'split', None), (2, True, None, 1), (2, True, None, 3)])
+
+
+class ChapterRangeXMLTest(unittest.TestCase):
+    def testRoundTrip(self):
+        title = MakeTitle(2, [600, 700])
+        title.chapter_start, title.chapter_end = 3, 4
+        dvd = DvdInfo([title, MakeTitle(1, [1300])], folder='/dvds/Show_S01D1', series='Show', season=1)
+        parsed = DvdInfo()
+        parsed.ParseXML(dvd.EmitXML())
+        self.assertEqual([(x.num, x.chapter_start, x.chapter_end) for x in parsed.titles],
+                         [(2, 3, 4), (1, None, None)])
+
+
+if __name__ == '__main__':
+    unittest.main()
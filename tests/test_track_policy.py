@@ -0,0 +1,150 @@
+"""test_track_policy.py - Selects audio and subtitle tracks with track_policy and EpisodeDetector"""
+import os.path
+import shutil
+import sys
+import tempfile
+import unittest
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+from dvdinfo import DvdInfo, Title, AudioTrack, SubtitleTrack
+from track_policy import LoadTrackPolicies, TrackPolicy, TrackPolicyError, TrackPolicySet
+try:
+    import yaml
+except ImportError:
+    yaml = None
+try:
+    from eps_detector import EpisodeDetector
+except ImportError:
+    # eps_detector needs Python 2 (hbscan) and oreillycookbook
+    EpisodeDetector = None
+
+
+def MakeTitle(num, enabled=True):
+    return Title(num, 1380, '29.970', 1000,
+                 [AudioTrack(1, 'English (AC3) (5.1 ch)', 'eng', 48000, 448000, False),
+                  AudioTrack(2, 'Francais (AC3) (2.0 ch)', 'fra', 48000, 192000, False)],
+                 [SubtitleTrack(1, 'English', 'eng', 'Bitmap', 'VOBSUB', False),
+                  SubtitleTrack(2, 'Closed Captions', 'eng', 'Text', 'CC', False)],
+                 enabled=enabled)
+
+
+AUDIO_TRACKS = [AudioTrack(1, 'Francais (AC3) (2.0 ch)', 'fra', 48000, 192000, False),
+                AudioTrack(2, 'English (AC3) (5.1 ch)', 'eng', 48000, 448000, False),
+                AudioTrack(3, "English (AC3) (Director's Commentary 1) (2.0 ch)", 'eng', 48000, 192000, False),
+                AudioTrack(4, 'English (DTS) (5.1 ch)', 'eng', 48000, 768000, False),
+                AudioTrack(5, 'Unknown (AC3) (2.0 ch)', 'und', 48000, 192000, False)]
+SUBTITLE_TRACKS = [SubtitleTrack(1, 'Francais', 'fra', 'Bitmap', 'VOBSUB', False),
+                   SubtitleTrack(2, 'English', 'eng', 'Bitmap', 'VOBSUB', False),
+                   SubtitleTrack(3, 'English Commentary', 'eng', 'Bitmap', 'VOBSUB', False),
+                   SubtitleTrack(4, 'Closed Captions', 'eng', 'Text', 'CC', False)]
+
+
+def Enabled(tracks):
+    return [x.num for x in tracks if x.enabled]
+
+
+class TrackPolicyTest(unittest.TestCase):
+    def Select(self, policy, default_close_captions=True):
+        audio, subtitles, default = policy.Select(AUDIO_TRACKS, SUBTITLE_TRACKS, default_close_captions)
+        return Enabled(audio), Enabled(subtitles), default
+
+    def testDefaultPolicy(self):
+        self.assertEqual(self.Select(TrackPolicy('default')), ([2, 3, 4, 5], [2, 3, 4], 4))
+        self.assertEqual(self.Select(TrackPolicy('default'), default_close_captions=False),
+                         ([2, 3, 4, 5], [2, 3, 4], 0))
+        self.assertEqual(self.Select(TrackPolicy('default', default_close_captions=False)),
+                         ([2, 3, 4, 5], [2, 3, 4], 0))
+
+    def testTracksAreNotModified(self):
+        TrackPolicy('default').Select(AUDIO_TRACKS, SUBTITLE_TRACKS)
+        self.assertEqual(Enabled(AUDIO_TRACKS) + Enabled(SUBTITLE_TRACKS), [])
+
+    def testLanguagesAndCodecs(self):
+        policy = TrackPolicy('french', languages=['fra'], subtitle_languages=['eng'])
+        self.assertEqual(self.Select(policy), ([1], [2, 3, 4], 4))
+        self.assertEqual(self.Select(TrackPolicy('dts', audio_codecs=['dts'])), ([4], [2, 3, 4], 4))
+
+    def testExcludeCommentary(self):
+        self.assertEqual(self.Select(TrackPolicy('main', exclude_commentary=True)), ([2, 4, 5], [2, 4], 4))
+
+    def testMaxTracksKeepsPreferredLanguages(self):
+        policy = TrackPolicy('limited', languages=['und', 'eng'], max_audio_tracks=2, max_subtitle_tracks=1)
+        self.assertEqual(self.Select(policy), ([2, 5], [2], 0))
+
+    def testAnyLanguage(self):
+        for languages in (None, []):
+            policy = TrackPolicy('any', languages=languages, max_subtitle_tracks=3)
+            self.assertEqual(policy.audio_languages, None)
+            self.assertEqual(self.Select(policy), ([1, 2, 3, 4, 5], [1, 2, 3], 0))
+        policy = TrackPolicy('any', languages=None, exclude_commentary=True, max_audio_tracks=2)
+        self.assertEqual(self.Select(policy), ([1, 2], [1, 2, 4], 4))
+
+
+class TrackPolicySetTest(unittest.TestCase):
+    def setUp(self):
+        self.policies = {'english': TrackPolicy('english'), 'french': TrackPolicy('french', languages=['fra']),
+                         'season2': TrackPolicy('season2', max_audio_tracks=1)}
+
+    def testRules(self):
+        policy_set = TrackPolicySet(self.policies,
+                                    [{'series': 'Show', 'season': 2, 'policy': 'season2'},
+                                     {'series': 'Show', 'policy': 'french'}],
+                                    default_policy='english')
+        self.assertEqual(policy_set.Select(DvdInfo(series='Show', season=2)).name, 'season2')
+        self.assertEqual(policy_set.Select(DvdInfo(series='Show', season=1)).name, 'french')
+        self.assertEqual(policy_set.Select(DvdInfo(series='Other', season=2)).name, 'english')
+
+    def testInvalidRules(self):
+        self.assertRaises(TrackPolicyError, TrackPolicySet, self.policies, [{'policy': 'missing'}], 'english')
+        self.assertRaises(TrackPolicyError, TrackPolicySet, self.policies,
+                          [{'disc': 1, 'policy': 'french'}], 'english')
+        self.assertRaises(TrackPolicyError, TrackPolicySet, self.policies, None, 'missing')
+
+
+@unittest.skipIf(yaml is None, 'needs PyYAML')
+class LoadTrackPoliciesTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix='hbq_tracks_test_')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def Load(self, text):
+        filename = os.path.join(self.folder, 'tracks.yaml')
+        f = open(filename, 'w')
+        try:
+            f.write(text)
+        finally:
+            f.close()
+        return LoadTrackPolicies(filename)
+
+    def testDefaultFile(self):
+        policy_set = LoadTrackPolicies()
+        self.assertEqual(policy_set.Select(DvdInfo(series='Show', season=1)).name, 'english')
+
+    def testEmptyLanguages(self):
+        policy_set = self.Load('default_policy: any\npolicies:\n    any:\n        languages:\n')
+        self.assertEqual(policy_set.policies['any'].subtitle_languages, None)
+
+    def testUnknownSetting(self):
+        self.assertRaises(TrackPolicyError, self.Load,
+                          'default_policy: any\npolicies:\n    any:\n        language: [eng]\n')
+
+
+@unittest.skipIf(EpisodeDetector is None, 'needs eps_detector')
+class EnableTracksTest(unittest.TestCase):
+    def testDisabledTitleGetsTracks(self):
+        dvd = DvdInfo([MakeTitle(1), MakeTitle(2, enabled=False)], folder='/dvds/Show_S01D1',
+                      series='Show', season=1)
+        detector = EpisodeDetector(1, 1, False, False, 100, [(1380, 60)], None, True)
+        detector.curr_dvd = dvd
+        detector.EnableAudioAndSubtitleTracks()
+        for title in dvd.titles:
+            self.assertEqual([x.num for x in title.audio_tracks if x.enabled], [1])
+            self.assertEqual([x.num for x in title.subtitle_tracks if x.enabled], [1, 2])
+            self.assertEqual(title.default_subtitle_track, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
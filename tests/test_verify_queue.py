@@ -0,0 +1,136 @@
+"""test_verify_queue.py - Checks encoded outputs against their titles with verify_queue and 'hbq.py verify'"""
+import argparse
+import os
+import os.path
+import shutil
+import stat
+import sys
+import tempfile
+import unittest
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+from dvdinfo import DvdInfo, Title, AudioTrack, SubtitleTrack, WriteDvdListToXML
+from hbqueue import AddJobElement, GetJobElements, NewQueue, ReadQueue, WriteQueue
+try:
+    from verify_queue import CompareTitle, IndexTitles, MakeRequeue, TitleKey, VerifyResult
+    import hbq
+except ImportError:
+    # verify_queue needs hbscan, which needs Python 2
+    CompareTitle = None
+
+# Stub HandBrakeCLI: the 'encoded' output file holds the scan output the probe prints
+PROBE_SCRIPT = """#!{python}
+import sys
+sys.stdout.write(open(sys.argv[sys.argv.index('-i') + 1]).read())
+"""
+
+SCAN_OUTPUT = """+ title 1:
+  + duration: {duration}
+  + audio tracks:
+    + 1, English (AC3) (5.1 ch) (iso639-2: eng), 48000Hz, 448000bps
+  + subtitle tracks:
+{subtitles}HandBrake has exited.
+"""
+SUBTITLE_LINE = '    + 1, English (iso639-2: eng) (Bitmap)(VOBSUB)\n'
+
+
+def MakeTitle(num, duration, chapter_range=None):
+    title = Title(num, duration, '29.970', 1000,
+                  [AudioTrack(1, 'English (AC3) (5.1 ch)', 'eng', 48000, 448000, True),
+                   AudioTrack(2, 'Francais (AC3) (2.0 ch)', 'fra', 48000, 192000, False)],
+                  [SubtitleTrack(1, 'English', 'eng', 'Bitmap', 'VOBSUB', True)])
+    if chapter_range:
+        title.chapter_start, title.chapter_end = chapter_range
+    return title
+
+
+def Probed(duration, num_audio=1, num_subtitles=1):
+    dvd = DvdInfo([Title(1, duration)])
+    dvd.titles[0].audio_tracks = [AudioTrack(x, 'English', 'eng', 48000, 448000, False) for x in range(num_audio)]
+    dvd.titles[0].subtitle_tracks = [SubtitleTrack(x, 'English', 'eng', 'Bitmap', 'VOBSUB', False)
+                                     for x in range(num_subtitles)]
+    return dvd
+
+
+@unittest.skipIf(CompareTitle is None, 'needs verify_queue')
+class VerifyQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix='hbq_verify_test_')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def testIndexTitles(self):
+        whole = MakeTitle(1, 1320)
+        first, second = MakeTitle(2, 1300, (1, 3)), MakeTitle(2, 1310, (4, 6))
+        titles = IndexTitles([DvdInfo([whole, first, second], folder='/dvds/Show_S01D1/')])
+        self.assertIs(titles[TitleKey('/dvds/Show_S01D1', 1)], whole)
+        self.assertIs(titles[TitleKey('/dvds/Show_S01D1', '2', '1-3')], first)
+        self.assertIs(titles[TitleKey('/dvds/Show_S01D1', 2, '4-6')], second)
+        self.assertNotIn(TitleKey('/dvds/Show_S01D1', 2), titles)
+
+    def testCompareTitle(self):
+        expected = MakeTitle(1, 1320)
+        self.assertEqual(CompareTitle(expected, Probed(1325), 5), [])
+        self.assertEqual(CompareTitle(expected, Probed(1314), 5), ['duration 1314s, expected 1320s'])
+        self.assertEqual(CompareTitle(expected, Probed(None), 5), ['duration Nones, expected 1320s'])
+        self.assertEqual(CompareTitle(expected, Probed(1320, num_audio=2, num_subtitles=0), 5),
+                         ['2 audio tracks, expected 1', '0 subtitle tracks, expected 1'])
+        self.assertEqual(CompareTitle(expected, DvdInfo(), 5), ['no title found in output'])
+
+    def testMakeRequeue(self):
+        for make_1st_gen_queue in (False, True):
+            root = NewQueue(make_1st_gen_queue)
+            for job_id in range(1, 5):
+                AddJobElement(root, job_id, dict(title_num=job_id, query='-t {:d}'.format(job_id),
+                                                 src_folder='/dvds/Show_S01D1', chapter_range='', profile='p',
+                                                 tier='t', destination='/out/E{:02d}.mkv'.format(job_id)))
+            if not make_1st_gen_queue:
+                root[2].find('Status').text = 'Completed'
+            results = [VerifyResult(str(job_id), '/dvds/Show_S01D1', job_id, None, status, [])
+                       for job_id, status in enumerate(('ok', 'missing', 'failed', 'unknown'), 1)]
+            requeue = MakeRequeue(root, results)
+            self.assertEqual(requeue.tag, root.tag)
+            self.assertEqual([x.findtext('Id') for x in GetJobElements(requeue)], ['2', '3'])
+            if not make_1st_gen_queue:
+                self.assertEqual([x.findtext('Status') for x in GetJobElements(requeue)], ['Waiting', 'Waiting'])
+                # The original queue is left as it was
+                self.assertEqual(root[2].findtext('Status'), 'Completed')
+
+    def testExitStatus(self):
+        probe = os.path.join(self.folder, 'probe.py')
+        with open(probe, 'w') as f:
+            f.write(PROBE_SCRIPT.format(python=sys.executable))
+        os.chmod(probe, os.stat(probe).st_mode | stat.S_IXUSR)
+        titles = [MakeTitle(1, 1320), MakeTitle(2, 1330), MakeTitle(3, 1310)]
+        control_file = os.path.join(self.folder, 'Show.xml')
+        WriteDvdListToXML([DvdInfo(titles, folder='/dvds/Show_S01D1', series='Show', season=1)], control_file)
+
+        root = NewQueue()
+        for title in titles:
+            destination = os.path.join(self.folder, 'Show S01E{:02d}.mkv'.format(title.num))
+            AddJobElement(root, title.num, dict(title_num=title.num, query='', src_folder='/dvds/Show_S01D1',
+                                                chapter_range='', profile='p', tier='t', destination=destination))
+            with open(destination, 'w') as f:
+                f.write(SCAN_OUTPUT.format(duration='00:{:02d}:{:02d}'.format(*divmod(title.duration, 60)),
+                                           subtitles=SUBTITLE_LINE))
+        queue_filename = os.path.join(self.folder, 'Show.queue')
+        WriteQueue(root, queue_filename)
+        args = argparse.Namespace(queue_filename=[queue_filename], control_file=[control_file],
+                                  duration_tolerance='0:05', transcoder=probe, num_threads=2,
+                                  requeue_filename='', report_filename='')
+        requeue_filename = os.path.join(self.folder, 'Show_requeue.queue')
+        self.assertEqual(hbq.VerifyQueue(args), 0)
+        self.assertFalse(os.path.exists(requeue_filename))
+
+        # A truncated output and a missing one
+        with open(os.path.join(self.folder, 'Show S01E02.mkv'), 'w') as f:
+            f.write(SCAN_OUTPUT.format(duration='00:11:00', subtitles=SUBTITLE_LINE))
+        os.remove(os.path.join(self.folder, 'Show S01E03.mkv'))
+        self.assertEqual(hbq.VerifyQueue(args), 1)
+        self.assertEqual([x.findtext('Id') for x in GetJobElements(ReadQueue(requeue_filename))], ['2', '3'])
+
+
+if __name__ == '__main__':
+    unittest.main()
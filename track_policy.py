@@ -0,0 +1,173 @@
+"""track_policy.py - Declarative audio/subtitle track selection, compiled once into predicates per policy"""
+import logging
+import os.path
+import re
+
+logger = logging.getLogger('track_policy')
+
+DEFAULT_POLICIES_FILENAME = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                         'hbq_tracks_default.yaml')
+
+POLICY_SETTINGS = ('languages', 'audio_languages', 'subtitle_languages', 'audio_codecs',
+                   'exclude_commentary', 'default_close_captions', 'max_audio_tracks',
+                   'max_subtitle_tracks')
+RULE_FIELDS = ('series', 'season')
+
+COMMENTARY_RE = re.compile(r'commentary', re.IGNORECASE)
+
+
+class TrackPolicyError(Exception):
+    pass
+
+
+def _Languages(languages):
+    """Returns the languages as a tuple, None (any language) when there are none"""
+    return tuple(languages) if languages else None
+
+
+def _Priorities(languages):
+    """Returns {language: rank} for the languages in order of preference, None for any language"""
+    if languages is None:
+        return None
+    return dict((lang, i) for i, lang in reversed(list(enumerate(languages))))
+
+
+class TrackPolicy(object):
+    """
+    Selects the audio and subtitle tracks of a title.
+    Languages are ISO 639-2 codes in order of preference, when there are more matching tracks
+    than max_*_tracks the tracks of the preferred languages (then the lowest numbers) are kept.
+    No languages (None or empty) selects tracks in any language, the lowest numbers are kept.
+    audio_codecs limits audio tracks to the listed codecs as HandBrakeCLI names them (e.g. AC3, DTS).
+    """
+    def __init__(self, name, languages=('eng', 'und'), audio_languages=None, subtitle_languages=None,
+                 audio_codecs=None, exclude_commentary=False, default_close_captions=True,
+                 max_audio_tracks=None, max_subtitle_tracks=None):
+        self.name = name
+        self.audio_languages = _Languages(audio_languages or languages)
+        self.subtitle_languages = _Languages(subtitle_languages or languages)
+        self.audio_codecs = tuple(audio_codecs) if audio_codecs else None
+        self.exclude_commentary = exclude_commentary
+        self.default_close_captions = default_close_captions
+        self.max_audio_tracks = max_audio_tracks
+        self.max_subtitle_tracks = max_subtitle_tracks
+        self.audio_priorities = _Priorities(self.audio_languages)
+        self.subtitle_priorities = _Priorities(self.subtitle_languages)
+        self.audio_predicate = self.CompileAudio()
+        self.subtitle_predicate = self.CompileSubtitle()
+
+    def CompileAudio(self):
+        """Returns the predicate selecting audio tracks, built from the enabled checks only"""
+        checks = list()
+        if self.audio_priorities is not None:
+            checks.append(lambda track, langs=self.audio_priorities: track.lang in langs)
+        if self.audio_codecs:
+            codec_re = re.compile(r'\((?:{})\)'.format('|'.join(re.escape(x) for x in self.audio_codecs)),
+                                  re.IGNORECASE)
+            checks.append(lambda track: codec_re.search(track.desc) is not None)
+        if self.exclude_commentary:
+            checks.append(lambda track: COMMENTARY_RE.search(track.desc) is None)
+        if not checks:
+            return lambda track: True
+        if len(checks) == 1:
+            return checks[0]
+        return lambda track: all(check(track) for check in checks)
+
+    def CompileSubtitle(self):
+        """Returns the predicate selecting subtitle tracks"""
+        langs = self.subtitle_priorities
+        if langs is None:
+            if self.exclude_commentary:
+                return lambda track: COMMENTARY_RE.search(track.desc) is None
+            return lambda track: True
+        if self.exclude_commentary:
+            return lambda track: track.lang in langs and COMMENTARY_RE.search(track.desc) is None
+        return lambda track: track.lang in langs
+
+    def _Limit(self, tracks, priorities, max_tracks):
+        if max_tracks is None or len(tracks) <= max_tracks:
+            return tracks
+        if priorities is None:
+            # Any language, every track ranks the same
+            return tracks[:max_tracks]
+        kept = sorted(tracks, key=lambda x: (priorities[x.lang], x.num))[:max_tracks]
+        return sorted(kept, key=lambda x: x.num)
+
+    def Select(self, audio_tracks, subtitle_tracks, default_close_captions=True):
+        """
+        Returns (audio tracks, subtitle tracks, default subtitle track number) with the enabled
+        flag of every track set by this policy.  The default is the first selected CC track, or 0.
+        """
+        selected_audio = self._Limit([x for x in audio_tracks if self.audio_predicate(x)],
+                                     self.audio_priorities, self.max_audio_tracks)
+        selected_subtitles = self._Limit([x for x in subtitle_tracks if self.subtitle_predicate(x)],
+                                         self.subtitle_priorities, self.max_subtitle_tracks)
+        audio_nums = set(x.num for x in selected_audio)
+        subtitle_nums = set(x.num for x in selected_subtitles)
+        default_subtitle = 0
+        if self.default_close_captions and default_close_captions:
+            for track in selected_subtitles:
+                if track.src_name == 'CC':
+                    default_subtitle = track.num
+                    break
+        return ([x if x.enabled == (x.num in audio_nums) else x._replace(enabled=x.num in audio_nums)
+                 for x in audio_tracks],
+                [x if x.enabled == (x.num in subtitle_nums) else x._replace(enabled=x.num in subtitle_nums)
+                 for x in subtitle_tracks],
+                default_subtitle)
+
+    def __repr__(self):
+        return 'TrackPolicy(name={!r}, audio_languages={!r}, subtitle_languages={!r})'.format(
+            self.name, self.audio_languages, self.subtitle_languages)
+
+
+class TrackPolicySet(object):
+    """Track policies plus the rules selecting one per series and season"""
+    def __init__(self, policies, rules=None, default_policy=None):
+        self.policies = policies
+        self.rules = rules or list()
+        self.default_policy = default_policy
+        for rule in self.rules:
+            if rule['policy'] not in self.policies:
+                raise TrackPolicyError('Rule {!r} uses unknown policy "{}"'.format(rule, rule['policy']))
+            unknown = set(rule) - set(RULE_FIELDS) - set(['policy'])
+            if unknown:
+                raise TrackPolicyError('Rule {!r} has unknown fields {}'.format(rule, sorted(unknown)))
+        if default_policy not in self.policies:
+            raise TrackPolicyError('Unknown default_policy "{}"'.format(default_policy))
+
+    def Select(self, dvd):
+        """Returns the TrackPolicy for dvd"""
+        values = dict(series=dvd.series, season=dvd.season)
+        for rule in self.rules:
+            if all(rule[field] == values[field] for field in RULE_FIELDS if field in rule):
+                return self.policies[rule['policy']]
+        return self.policies[self.default_policy]
+
+
+def DefaultTrackPolicies():
+    """Returns a TrackPolicySet selecting English and undetermined tracks, as before policies existed"""
+    return TrackPolicySet({'default': TrackPolicy('default')}, default_policy='default')
+
+
+def LoadTrackPolicies(filename=None):
+    """Returns the TrackPolicySet defined in the YAML file filename (default: hbq_tracks_default.yaml)"""
+    import yaml
+
+    filename = filename or DEFAULT_POLICIES_FILENAME
+    f = open(filename)
+    try:
+        cfg = yaml.safe_load(f)
+    finally:
+        f.close()
+    policies = dict()
+    for name, settings in (cfg.get('policies') or {}).items():
+        settings = settings or dict()
+        unknown = set(settings) - set(POLICY_SETTINGS)
+        if unknown:
+            raise TrackPolicyError('Track policy "{}" in "{}" has unknown settings {}'.format(name, filename,
+                                                                                             sorted(unknown)))
+        policies[name] = TrackPolicy(name, **settings)
+    policy_set = TrackPolicySet(policies, cfg.get('rules'), cfg.get('default_policy'))
+    logger.debug('Loaded track policies %s from "%s"', sorted(policies), filename)
+    return policy_set
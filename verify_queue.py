@@ -0,0 +1,112 @@
+"""verify_queue.py - Probes the encoded outputs of a queue and compares them against their source titles"""
+from collections import namedtuple
+import copy
+import logging
+from multiprocessing.pool import ThreadPool
+import os.path
+
+from hbqueue import GetJobElements, NewQueue
+from hbscan import ParseHBOutput, ProbeFile, TRANSCODER
+import metrics
+
+logger = logging.getLogger('verify_queue')
+
+# status is 'ok', 'missing' (no output file), 'failed' (output does not match its title) or
+# 'unknown' (the source title is not in any control file)
+VerifyResult = namedtuple('VerifyResult', 'job_id, source, title_num, destination, status, problems')
+
+
+def TitleKey(folder, title_num, chapter_range=''):
+    return (os.path.normcase(os.path.normpath(folder)), int(title_num), chapter_range or '')
+
+
+def IndexTitles(dvds):
+    """Returns a dict of (source folder, title number, chapter range) -> Title for every DVD in dvds"""
+    titles = dict()
+    for dvd in dvds:
+        for title in dvd.titles:
+            if title.chapter_start is not None:
+                chapter_range = '{:d}-{:d}'.format(title.chapter_start, title.chapter_end)
+            else:
+                chapter_range = ''
+            titles[TitleKey(dvd.folder, title.num, chapter_range)] = title
+    return titles
+
+
+def CompareTitle(expected, probed, duration_tolerance):
+    """Returns the list of differences between the source Title expected and the DvdInfo probed from its output"""
+    if not probed.titles:
+        return ['no title found in output']
+    # The output is a single title, the longest one if HandBrakeCLI reports more
+    actual = max(probed.titles, key=lambda x: x.duration or 0)
+    problems = list()
+    if actual.duration is None or abs(actual.duration - expected.duration) > duration_tolerance:
+        problems.append('duration {}s, expected {}s'.format(actual.duration, expected.duration))
+    num_audio = len([x for x in expected.audio_tracks if x.enabled])
+    if len(actual.audio_tracks) != num_audio:
+        problems.append('{:d} audio tracks, expected {:d}'.format(len(actual.audio_tracks), num_audio))
+    num_subtitles = len([x for x in expected.subtitle_tracks if x.enabled])
+    if len(actual.subtitle_tracks) != num_subtitles:
+        problems.append('{:d} subtitle tracks, expected {:d}'.format(len(actual.subtitle_tracks), num_subtitles))
+    return problems
+
+
+class QueueVerifier(object):
+    """Probes queue job outputs with HandBrakeCLI and checks them against the titles of the control files"""
+    def __init__(self, titles, transcoder=TRANSCODER, duration_tolerance=5, num_threads=4):
+        self.titles = titles
+        self.transcoder = transcoder
+        self.duration_tolerance = duration_tolerance
+        self.num_threads = num_threads
+
+    def VerifyJob(self, job):
+        """Returns the VerifyResult for one Job/QueueTask element"""
+        job_id = job.findtext('Id')
+        source = job.findtext('Source')
+        title_num = int(job.findtext('Title'))
+        destination = job.findtext('Destination')
+        expected = self.titles.get(TitleKey(source, title_num, job.findtext('Chapters')))
+        if expected is None:
+            status, problems = 'unknown', ['title {:d} of "{}" is not in the control files'.format(title_num, source)]
+        elif not os.path.exists(destination):
+            status, problems = 'missing', ['output file does not exist']
+        else:
+            try:
+                probed = ParseHBOutput(ProbeFile(destination, self.transcoder))
+            except Exception as e:
+                logger.exception('Unable to probe "%s"', destination)
+                probed, problems = None, ['probe failed: {}'.format(e)]
+            if probed is not None:
+                problems = CompareTitle(expected, probed, self.duration_tolerance)
+            status = 'failed' if problems else 'ok'
+        metrics.Increment('outputs_verified', status=status)
+        return VerifyResult(job_id, source, title_num, destination, status, problems)
+
+    def Verify(self, jobs):
+        """Returns the VerifyResult of every job element, in queue order"""
+        with metrics.Timer('verify'):
+            if self.num_threads > 1 and len(jobs) > 1:
+                # The probes are child processes, threads are enough to overlap them
+                pool = ThreadPool(min(self.num_threads, len(jobs)))
+                try:
+                    results = pool.map(self.VerifyJob, jobs)
+                finally:
+                    pool.close()
+                    pool.join()
+            else:
+                results = [self.VerifyJob(x) for x in jobs]
+        return results
+
+
+def MakeRequeue(queue_root, results):
+    """Returns a new queue root holding copies of the jobs whose output was missing or failed verification"""
+    failed_ids = set(x.job_id for x in results if x.status in ('missing', 'failed'))
+    root = NewQueue(queue_root.tag == 'ArrayOfJob')
+    for job in GetJobElements(queue_root):
+        if job.findtext('Id') in failed_ids:
+            job = copy.deepcopy(job)
+            status = job.find('Status')
+            if status is not None:
+                status.text = 'Waiting'
+            root.append(job)
+    return root